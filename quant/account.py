@@ -0,0 +1,20 @@
+# coding:utf-8
+
+
+class Account(object):
+    """
+    账户：一组策略及其独立的信号处理（portfolio）、下单（broker）和交易记录（fill）模块，
+    多个账户共用同一份行情和bar，资金、仓位、订单和回测结果互不影响
+    """
+
+    def __init__(self, name, strategy_list=None, fill=None, portfolio=None, broker=None):
+        self.name = name
+        self.strategy_list = list(strategy_list or [])
+        self.fill = fill
+        self.portfolio = portfolio
+        self.broker = broker
+        self.results = None  # 回测结束后的简略结果
+        self.finished = False  # 已爆仓，之后的行情不再交给该账户
+
+    def __repr__(self):
+        return 'Account({}, {})'.format(self.name, [i.__name__ for i in self.strategy_list])
@@ -7,8 +7,8 @@ from copy import copy
 import numpy as np
 import pandas as pd
 from dateutil.relativedelta import relativedelta
-from numpy.lib.stride_tricks import as_strided
 from .logging_backtest import logger
+from .clock import to_datetime
 
 TRADING_DAYS_PER_YEAR = 252
 TRADING_DAYS_PER_MONTH = 20
@@ -25,9 +25,9 @@ def create_sharpe_ratio(returns, period=252):
     period：周期，日线（252），小时线（252*6.5），分钟线（252*6.5*60）
     """
     logger.debug('-----returns-----: {}'.format(returns))
-    ratio = np.sqrt(period) * (np.mean(returns)) / np.std(returns)
-    logger.debug('-----ratio-----: {} {}'.format(ratio, ratio[0]))
-    return ratio[0]
+    ratio = np.sqrt(period) * returns.mean() / returns.std(ddof=0)
+    logger.debug('-----ratio-----: {}'.format(ratio))
+    return ratio.iloc[0] if isinstance(ratio, pd.Series) else ratio
 
 
 def create_drawdowns(equity_curve: pd.DataFrame):
@@ -44,19 +44,16 @@ def create_drawdowns(equity_curve: pd.DataFrame):
     eq_idx = equity_curve.index  # RangeIndex(start=0, stop=1199, step=1)
     logger.debug('---------eq_idx---------: {}'.format(eq_idx))
     drawdown = pd.DataFrame(index=eq_idx, columns=['date', 'equity', 'drawdown', 'pct'])
-    hwm = pd.Series(index=eq_idx, name='hwm')
     try:
         drawdown['date'] = equity_curve['date']
     except Exception as e:
         drawdown['date'] = equity_curve.index
+    if drawdown['date'].dtype.kind in 'iu':  # 纳秒时间戳转换为时间
+        drawdown['date'] = to_datetime(drawdown['date'].values)
     drawdown['equity'] = equity_curve['equity']
-    # 注意，要更改值，需先生成好数组再插入到 DataFrame 中，而不是直接更改 DataFrame 中的值
-    hwm[0] = equity_curve['equity'][0]
-    for t in range(1, len(eq_idx)):
-        # 更改高水位线
-        cur_hwm = max(drawdown['equity'][t], hwm[t - 1])
-        hwm[t] = cur_hwm
-
+    # 高水位线为权益的累计最大值
+    hwm = pd.Series(np.maximum.accumulate(drawdown['equity'].values.astype(np.float64)),
+                    index=eq_idx, name='hwm')
     drawdown.insert(2, 'hwm', hwm)  # 插入高水位线
     drawdown['drawdown'] = (drawdown['hwm'] - drawdown['equity']).round(2)  # 计算回撤值，保留2位小数
     # logger.info('-------drawdown-----: {} {}'.format(type(drawdown), drawdown))
@@ -65,7 +62,6 @@ def create_drawdowns(equity_curve: pd.DataFrame):
     # logger.info('-------drawdown-----: {} {}'.format(type(drawdown), drawdown))
     # with open('drawdown.txt', 'w') as f:
     #     f.write(str(copy(drawdown)))
-    drawdown.to_csv(date + '_drawdown.csv', index=False)
     # logger.info('--------tpye of drawdown------: {}'.format(type(drawdown)))
     # logger.info('--------max_drawdown----------: {}'.format(drawdown['drawdown'].max()))
     return drawdown
@@ -79,11 +75,16 @@ def create_trade_log(completed_list, context):
     trade_log_list = []
     logger.debug('-----------completed_list----------: {}'.format(completed_list))
     logger.debug('len(completed_list): {}'.format(len(completed_list)))
+    position_df = context.fill.position.df
+    realized_df = context.fill.realized_gain_and_loss.df
+    commission_df = context.fill.commission.df
+    equity_df = context.fill.equity.df
     for i in completed_list:
         logger.debug('-----------i-------------: {}'.format(i))
 
         d = {}
-        d['date'] = i.date
+        date = to_datetime(i.date)
+        d['date'] = date
         d['price'] = i.price
         d['order_type'] = i.order_type
         d['lots'] = context.lots
@@ -91,19 +92,18 @@ def create_trade_log(completed_list, context):
         # position = context.fill.position.df
         # logger.info('----position----: {}'.format(position))
         # logger.info('----position----: {}'.format(position.index))
-        position = context.fill.position.df[i.date:i.date].values[0][0]
+        position = position_df[date:date].values[0][0]
         d['position'] = position
         logger.debug('----position----: {} {}'.format(position, type(position)))
-        logger.debug('----position----: {}'.format(context.fill.position.df[i.date:i.date]))
         if position == 0:
-            d['re_profit'] = context.fill.realized_gain_and_loss.df[i.date:i.date].values[0][0]
+            d['re_profit'] = realized_df[date:date].values[0][0]
             logger.debug('---d["re_profit"]---{}'.format(d['re_profit']))
         else:
             d['re_profit'] = 0
         comm = i.per_comm * i.units
         # d['commission'] = d['lots'] * comm * i.price
-        d['commission'] = context.fill.commission.df[i.date:i.date].values[0][0]
-        d['equity'] = context.fill.equity.df[i.date:i.date].values[0][0]
+        d['commission'] = commission_df[date:date].values[0][0]
+        d['equity'] = equity_df[date:date].values[0][0]
         logger.debug('----------d------------: {}'.format(d))
         trade_log_list.append(d)
 
@@ -212,7 +212,7 @@ def duration_of_equity_not_reaching_high(equity):
     max_equity = 0
     duration = pd.Timedelta(0)  # 时间间隔为 0
     date_list = []
-    date_dur = pd.DataFrame(columns=['duration','start','end'])
+    rows = []
     for i in range(equity.shape[0]):
         if max_equity <= equity.values[i][0]:
             max_equity = equity.values[i][0]
@@ -221,13 +221,13 @@ def duration_of_equity_not_reaching_high(equity):
     for j in range(len(date_list)-1):   #len()-1
         duration_ = date_list[j + 1] - date_list[j]
 
-        date_dur=date_dur.append(pd.Series([duration_,date_list[j],date_list[j+1]],index=['duration','start','end']),ignore_index=True)
+        rows.append([duration_, date_list[j], date_list[j + 1]])
         #
         # if duration < duration_:
         #     duration = duration_
         #     date_dict[duration] = [date_list[i], date_list[i + 1]]
     # date = date_dict[max(date_dict)][0] + '-' + date_dict[max(date_dict)][1]
-    date_dur =date_dur.sort_values('duration')
+    date_dur = pd.DataFrame(rows, columns=['duration', 'start', 'end']).sort_values('duration')
     start_date=date_dur.iloc[-1]['start']
     if equity.iloc[-1].values<=max_equity:
         deltta=equity.index[-1]-date_list[-1]
@@ -261,13 +261,13 @@ def total_net_profit(equity, capital):
 def long_net_profit(context):
     """净利润（多头）"""
     df = context.fill.long_realized_gain_and_loss.df
-    return float(df.sum())
+    return float(df.sum().iloc[0])
 
 
 def short_net_profit(context):
     """净利润（空头）"""
     df = context.fill.short_realized_gain_and_loss.df
-    return float(df.sum())
+    return float(df.sum().iloc[0])
 
 
 def gross_profit(context):
@@ -279,13 +279,13 @@ def gross_profit(context):
 def gross_long_profit(context):
     """总盈利(多头)"""
     df = context.fill.long_realized_gain_and_loss.df
-    return float(df[df > 0].sum())
+    return float(df[df > 0].sum().iloc[0])
 
 
 def gross_short_profit(context):
     """总盈利(空头)"""
     df = context.fill.short_realized_gain_and_loss.df
-    return float(df[df > 0].sum())
+    return float(df[df > 0].sum().iloc[0])
 
 
 def gross_loss(context):
@@ -297,13 +297,13 @@ def gross_loss(context):
 def gross_long_loss(context):
     """总亏损（多头）"""
     df = context.fill.long_realized_gain_and_loss.df
-    return -1 * float(df[df < 0].sum())
+    return -1 * float(df[df < 0].sum().iloc[0])
 
 
 def gross_short_loss(context):
     """总亏损（空头）"""
     df = context.fill.short_realized_gain_and_loss.df
-    return -1 * float(df[df < 0].sum())
+    return -1 * float(df[df < 0].sum().iloc[0])
 
 
 def profit_factor(context):
@@ -322,7 +322,7 @@ def return_rate(equity, capital):
 
 def annualized_return_rate(equity, capital, start, end):
     """年化单利收益率（annualized return rate）"""
-    end_equity = equity['equity'][-1]
+    end_equity = equity['equity'].iloc[-1]
     profit = end_equity - capital
     n = _difference_in_years(start, end)
     logger.debug('---year---: {}'.format(n))
@@ -332,7 +332,7 @@ def annualized_return_rate(equity, capital, start, end):
 
 def annualized_compound_return_rate(equity, capital, start, end):
     """年化复利收益率（compound annualized return rate）"""
-    end_equity = equity['equity'][-1]
+    end_equity = equity['equity'].iloc[-1]
     n = _difference_in_years(start, end)
     rate = (math.pow(end_equity / capital, 1 / n) - 1)
     return rate
@@ -340,7 +340,7 @@ def annualized_compound_return_rate(equity, capital, start, end):
 
 def monthly_return_rate(equity, capital, start, end):
     """月化单利收益率"""
-    end_equity = equity['equity'][-1]
+    end_equity = equity['equity'].iloc[-1]
     n = _difference_in_months(start, end)
     rate = ((end_equity - capital) / capital) / n
     return rate
@@ -348,7 +348,7 @@ def monthly_return_rate(equity, capital, start, end):
 
 def monthly_compound_return_rate(equity, capital, start, end):
     """月化复利收益率"""
-    end_equity = equity['equity'][-1]
+    end_equity = equity['equity'].iloc[-1]
     n = _difference_in_months(start, end)
     rate = math.pow(end_equity / capital, 1 / n) - 1
     return rate
@@ -695,26 +695,33 @@ def largest_loss_losing_trade(context):
 
 # -------------------------连续次数---------------------------
 
-def _subsequence(string, c):
+def run_length_encode(values):
     """
-    判断字符串中连续的字符c的个数，如string：'001000001111100'，c：'0'，
-    连续的字符c的个数为5
+    游程编码：将一维数组中连续相同的值合并为一段，
+    返回 (starts, lengths, run_values)，分别为各段的起始位置、长度和值，例：
+    >>> run_length_encode(np.array([0, 0, 1, 0, 0, 0]))
+    (array([0, 2, 3]), array([2, 1, 3]), array([0, 1, 0]))
     """
+    values = np.asarray(values)
+    if len(values) == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, values[:0]
+    starts = np.concatenate(([0], np.flatnonzero(values[1:] != values[:-1]) + 1))
+    lengths = np.diff(np.append(starts, len(values)))
+    return starts, lengths, values[starts]
 
-    bit = 0
-    count = 0
-    maxlen = 0
 
-    for i in range(len(string)):
-        bit = string[i]
+def max_run_length(values, value):
+    """values 中连续等于 value 的最大个数，如 [0, 0, 1, 0, 0, 0] 中连续的 0 最多为 3 个"""
+    _, lengths, run_values = run_length_encode(values)
+    lengths = lengths[run_values == value]
+    return int(lengths.max()) if len(lengths) else 0
 
-        if bit == c:
-            count = count + 1
-            if count > maxlen:
-                maxlen = count
-        else:
-            count = 0
-    return maxlen
+
+def next_run_start(values):
+    """每个位置所在段之后下一段的起始位置，最后一段为 len(values)"""
+    starts, lengths, _ = run_length_encode(values)
+    return np.repeat(starts + lengths, lengths)
 
 
 def max_consecutive_winning_trades(context):
@@ -722,11 +729,9 @@ def max_consecutive_winning_trades(context):
     # if num_winning_trades(context) == 0:
     #     return 0
     df = context.trade_log
-    logger.debug('---df in analysis---: {}'.format(df))
-    logger.debug('---df in analysis---: {}'.format(df['position'] == 0))
     trade_log = df[df['position'] == 0]
     logger.debug('---trade_log in analysis---:{}'.format(trade_log))
-    return _subsequence(trade_log['re_profit'] > 0, True)
+    return max_run_length(trade_log['re_profit'].values > 0, True)
 
 
 def max_consecutive_losing_trades(context):
@@ -735,7 +740,7 @@ def max_consecutive_losing_trades(context):
         return 0
     df = context.trade_log
     trade_log = df[df['position'] == 0]
-    return _subsequence(trade_log['re_profit'] > 0, False)
+    return max_run_length(trade_log['re_profit'].values > 0, False)
 
 
 def avg_bars_winning_trades(ohlc_data, context):
@@ -802,61 +807,254 @@ def max_intra_day_drawdown(high, low):
     return dd
 
 
-def _windowed_view(x, window_units):
+def _blocks(x, window):
     """
-    为一个一维的数组创建一个二维的窗口视图（数组形式），
-    x：一维数组
-    例：
-    >>> x = np.array([1, 2, 3, 4, 5, 6])
-    >>> _windowed_view(x, 3)
-    array([[1, 2, 3],
-           [2, 3, 4],
-           [3, 4, 5],
-           [4, 5, 6]])
+    将一维数组按 window 分块，返回 (块数, window) 的二维数组，最后一块不足时用最后一个值补齐；
+    长度为 window 的滑动窗口最多跨两个相邻的块，窗口内的结果可由前一块的后缀与后一块的前缀合并得到，
+    各块内的前缀、后缀都可沿 axis=1 一次算出，总计算量和内存都是 O(N)，与窗口长度无关
     """
-    y = as_strided(x, shape=(x.size - window_units + 1, window_units),
-                   strides=(x.strides[0], x.strides[0]))
-    return y
+    x = np.asarray(x, dtype=np.float64)
+    n_blocks = -(-len(x) // window)
+    padded = np.empty(n_blocks * window)
+    padded[:len(x)] = x
+    padded[len(x):] = x[-1] if len(x) else 0
+    return padded.reshape(n_blocks, window)
+
+
+def _suffix(func, blocks):
+    """各块内从每个位置到块末尾的累计结果，func 如 np.maximum.accumulate"""
+    return func(blocks[:, ::-1], axis=1)[:, ::-1]
+
+
+def _window_split(n, window):
+    """
+    需要合并前后两块的窗口：返回 (start, end, mask)，第 end 个位置的窗口为 [start, end]，
+    其余位置的窗口从块首开始（或为数据开头的不足 window 的窗口），直接取块内前缀
+    """
+    index = np.arange(n)
+    mask = (index >= window) & (index % window != window - 1)
+    end = index[mask]
+    return end - window + 1, end, mask
+
+
+def rolling_window_sum(x, window):
+    """
+    滑动窗口内的和，窗口为当前及之前共 window 个值，开头不足 window 个时为已有值的和；
+    每个结果只由不超过 window 个值相加得到，不像 cumsum 相减那样随长度累积误差
+    """
+    n = len(x)
+    blocks = _blocks(x, window)
+    prefix = np.cumsum(blocks, axis=1).ravel()[:n]
+    suffix = _suffix(np.cumsum, blocks).ravel()[:n]
+    start, end, mask = _window_split(n, window)
+    result = prefix.copy()
+    result[mask] = suffix[start] + prefix[end]
+    return result
+
+
+def _rolling_extreme_change(x, window, peak, pick):
+    """
+    滑动窗口内相对于此前最高（低）值的最大变化比例，x 须为正数：
+    最大回撤 peak=np.maximum、pick=np.minimum，最大回升 peak=np.minimum、pick=np.maximum；
+    两段合并时：dd(AB) = pick(dd(A), dd(B), pick(B) / peak(A) - 1)
+    """
+    n = len(x)
+    blocks = _blocks(x, window)
+    # 每块的前缀：峰值、极值及最大变化
+    prefix_peak = peak.accumulate(blocks, axis=1)
+    prefix_pick = pick.accumulate(blocks, axis=1)
+    prefix_change = pick.accumulate(blocks / prefix_peak - 1, axis=1)
+    # 每块的后缀：从该位置到块末尾的峰值、极值及最大变化
+    suffix_peak = _suffix(peak.accumulate, blocks)
+    suffix_pick = _suffix(pick.accumulate, blocks)
+    next_pick = np.empty_like(blocks)
+    next_pick[:, :-1] = suffix_pick[:, 1:]
+    next_pick[:, -1] = blocks[:, -1]
+    suffix_change = pick(_suffix(pick.accumulate, next_pick / blocks - 1), 0)
+    prefix_change, prefix_pick = prefix_change.ravel()[:n], prefix_pick.ravel()[:n]
+    suffix_change, suffix_peak = suffix_change.ravel()[:n], suffix_peak.ravel()[:n]
+    start, end, mask = _window_split(n, window)
+    result = prefix_change.copy()
+    result[mask] = pick(pick(suffix_change[start], prefix_change[end]),
+                        prefix_pick[end] / suffix_peak[start] - 1)
+    return result
+
+
+def _rolling_result(values, ser, min_periods):
+    """组装为与ser同索引的Series，前 min_periods - 1 个值不足，为NaN"""
+    values[:min_periods - 1] = np.nan
+    return pd.Series(data=values, index=ser.index, name=ser.name)
 
 
 def rolling_max_dd(ser, period, min_periods=1):
     """
-    计算ser中滚动的最大回撤
-    ser： Series
-    min_periods： 1 <= min_periods <= window_units
-    Return： 一维数组，长度为 len(x) - min_periods + 1
+    计算ser中滚动的最大回撤（百分数，为负数），窗口为当前及之前的 period + 1 个值，
+    ser： Series，须为正数，如权益
+    min_periods： 1 <= min_periods <= period + 1，之前的值为NaN
+    Return： Series，与ser等长
     """
-    window_units = period + 1
-    x = ser.values
-    if min_periods < window_units:
-        pad = np.empty(window_units - min_periods)
-        pad.fill(x[0])
-        x = np.concatenate((pad, x))
-    y = _windowed_view(x, window_units)
-    running_max_y = np.maximum.accumulate(y, axis=1)
-    dd = (y - running_max_y) / running_max_y * 100
-    rmdd = dd.min(axis=1)
-    return pd.Series(data=rmdd, index=ser.index, name=ser.name)
+    values = _rolling_extreme_change(ser.values, period + 1, np.maximum, np.minimum) * 100
+    return _rolling_result(values, ser, min_periods)
 
 
 def rolling_max_ru(ser, period, min_periods=1):
     """
-    计算ser中的最大回升
-    ser： Series
-    min_periods： 1 <= min_periods <= window_units
-    Return： 一维数组，长度为 len(x) - min_periods + 1
+    计算ser中滚动的最大回升（百分数），窗口为当前及之前的 period + 1 个值，
+    ser： Series，须为正数，如权益
+    min_periods： 1 <= min_periods <= period + 1，之前的值为NaN
+    Return： Series，与ser等长
     """
-    window_units = period + 1
-    x = ser.values
-    if min_periods < window_units:
-        pad = np.empty(window_units - min_periods)
-        pad.fill(x[0])
-        x = np.concatenate((pad, x))
-    y = _windowed_view(x, window_units)
-    running_min_y = np.minimum.accumulate(y, axis=1)
-    ru = (y - running_min_y) / running_min_y * 100
-    rmru = ru.max(axis=1)
-    return pd.Series(data=rmru, index=ser.index, name=ser.name)
+    values = _rolling_extreme_change(ser.values, period + 1, np.minimum, np.maximum) * 100
+    return _rolling_result(values, ser, min_periods)
+
+
+def _rolling_moments(ser, window, mask=None):
+    """
+    滑动窗口内有效值的个数、均值和标准差（ddof=0），NaN不计入；
+    mask 为布尔数组时只统计其中为True的值，用于下偏标准差
+    """
+    x = np.asarray(ser, dtype=np.float64)
+    valid = np.isfinite(x) if mask is None else np.isfinite(x) & mask
+    center = x[valid].mean() if valid.any() else 0.0  # 先减去整体均值，减小平方和相减的误差
+    x = np.where(valid, x - center, 0)
+    count = rolling_window_sum(valid, window)
+    total = rolling_window_sum(x, window)
+    squares = rolling_window_sum(x * x, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+        std = np.sqrt(np.maximum(squares / count - mean * mean, 0))
+    return count, mean + center, std
+
+
+def rolling_volatility(returns, window, min_periods=2, period=TRADING_DAYS_PER_YEAR):
+    """滚动的年化波动率，returns 为收益率的Series，窗口为当前及之前的 window 个值"""
+    count, _, std = _rolling_moments(returns, window)
+    values = std * np.sqrt(period)
+    values[count < min_periods] = np.nan
+    return pd.Series(data=values, index=returns.index, name=returns.name)
+
+
+def rolling_sharpe_ratio(returns, window, min_periods=2, period=TRADING_DAYS_PER_YEAR):
+    """滚动的夏普比率，与 create_sharpe_ratio 相同：sqrt(period) * 均值 / 标准差"""
+    count, mean, std = _rolling_moments(returns, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = np.sqrt(period) * mean / std
+    values[(count < min_periods) | (std == 0)] = np.nan
+    return pd.Series(data=values, index=returns.index, name=returns.name)
+
+
+def rolling_sortino_ratio(returns, window, min_periods=2, risk_free=0.00,
+                          period=TRADING_DAYS_PER_YEAR):
+    """滚动的索提诺比率，与 sortino_ratio 相同：(均值 * period - risk_free) / (负收益的标准差 * sqrt(period))"""
+    count, mean, _ = _rolling_moments(returns, window)
+    values = np.asarray(returns, dtype=np.float64)
+    negative_count, _, negative_std = _rolling_moments(returns, window, values < 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = (mean * period - risk_free) / (negative_std * np.sqrt(period))
+    values[(count < min_periods) | (negative_count < 2) | (negative_std == 0)] = np.nan
+    return pd.Series(data=values, index=returns.index, name=returns.name)
+
+
+# -------------------------蒙特卡洛---------------------------
+
+def closed_trade_profits(context):
+    """按时间顺序取出每笔平仓交易的盈亏（含手续费），多头与空头合并"""
+    dates = []
+    profits = []
+    for series in (context.fill.long_realized_gain_and_loss,
+                   context.fill.short_realized_gain_and_loss):
+        for date, profit in zip(series.date, series.list):
+            if date != 'start':
+                dates.append(date)
+                profits.append(profit)
+    order = np.argsort(np.array(dates), kind='mergesort')
+    return np.array(profits, dtype=np.float64)[order]
+
+
+def _monte_carlo_chunk(args):
+    """
+    生成一块合成权益路径，每行一条路径：
+    按行累加盈亏得到权益，再沿 axis=1 取累计最大值得到高水位线
+    """
+    profits, n_paths, n_trades, method, seed, initial_cash, ruin_equity = args
+    random_state = np.random.RandomState(seed)
+    if method == 'bootstrap':  # 有放回抽样
+        index = random_state.randint(0, len(profits), size=(n_paths, n_trades))
+    else:  # 打乱顺序
+        index = random_state.rand(n_paths, len(profits)).argsort(axis=1)[:, :n_trades]
+    equity = profits[index]
+    np.cumsum(equity, axis=1, out=equity)
+    equity += initial_cash
+    hwm = np.maximum.accumulate(equity, axis=1)
+    np.maximum(hwm, initial_cash, out=hwm)
+    drawdown = hwm - equity
+    max_drawdown = drawdown.max(axis=1)
+    max_drawdown_pct = (drawdown / hwm).max(axis=1)
+    ruin = equity.min(axis=1) <= ruin_equity
+    return max_drawdown, max_drawdown_pct, equity[:, -1], ruin
+
+
+def monte_carlo(profits, n_paths=10000, method='bootstrap', initial_cash=500000,
+                ruin_equity=0, n_trades=None, seed=None, max_memory=64 * 2 ** 20,
+                processes=1):
+    """
+    对平仓盈亏做蒙特卡洛重抽样，得到最大回撤、最终权益及破产概率的分布
+    profits：每笔交易盈亏，可由 closed_trade_profits(context) 得到
+    method：'bootstrap' 有放回抽样，'shuffle' 打乱交易顺序
+    ruin_equity：权益低于或等于该值视为破产
+    n_trades：每条路径的交易数，默认与原交易数相同，shuffle 时不能超过原交易数
+    max_memory：每块计算占用的内存上限（字节），路径数过多时自动分块
+    processes：大于 1 时用多进程计算各块；结果由 seed 和分块决定，与进程数无关
+    Return：dict，包括每条路径的 max_drawdown、max_drawdown_pct、final_equity 及 risk_of_ruin
+    """
+    profits = np.asarray(profits, dtype=np.float64)
+    if len(profits) == 0:
+        raise ValueError('没有平仓交易，无法进行蒙特卡洛模拟')
+    if method not in ('bootstrap', 'shuffle'):
+        raise ValueError('method 须为 bootstrap 或 shuffle: {}'.format(method))
+    if n_trades is None:
+        n_trades = len(profits)
+    if method == 'shuffle' and n_trades > len(profits):
+        raise ValueError('shuffle 的交易数不能超过原交易数')
+
+    # 每条路径约需 权益、高水位线、回撤、索引 四个数组
+    chunk_paths = int(max(1, min(n_paths, max_memory // (n_trades * 8 * 4))))
+    sizes = [chunk_paths] * (n_paths // chunk_paths)
+    if n_paths % chunk_paths:
+        sizes.append(n_paths % chunk_paths)
+    seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, size=len(sizes))
+    tasks = [(profits, size, n_trades, method, chunk_seed, initial_cash, ruin_equity)
+             for size, chunk_seed in zip(sizes, seeds)]
+    logger.debug('monte carlo chunks: {}'.format(sizes))
+
+    if processes > 1 and len(tasks) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        try:
+            chunks = pool.map(_monte_carlo_chunk, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        chunks = [_monte_carlo_chunk(i) for i in tasks]
+
+    ruin = np.concatenate([i[3] for i in chunks])
+    return {
+        'max_drawdown': np.concatenate([i[0] for i in chunks]),
+        'max_drawdown_pct': np.concatenate([i[1] for i in chunks]),
+        'final_equity': np.concatenate([i[2] for i in chunks]),
+        'risk_of_ruin': float(ruin.mean()),
+    }
+
+
+def monte_carlo_table(result, percentiles=(1, 5, 25, 50, 75, 95, 99)):
+    """蒙特卡洛结果的分位数表，index 为分位数，列为最大回撤、最大回撤比及最终权益"""
+    table = pd.DataFrame(OrderedDict([
+        ('最大回撤', np.percentile(result['max_drawdown'], percentiles)),
+        ('最大回撤比', np.percentile(result['max_drawdown_pct'], percentiles)),
+        ('最终权益', np.percentile(result['final_equity'], percentiles)),
+    ]), index=['{}%'.format(i) for i in percentiles])
+    return table.round(4)
 
 
 # -------------------------百分比变化---------------------------
@@ -927,10 +1125,10 @@ def risk_rate(equity):
     本金最大回调为比初始资金小的权益中，最小的权益与初始资金的差值，
     若无小于初始资金的权益，则本金最大回调为 0
     """
-    max_correction = equity['equity'][0] - min(equity['equity'])
+    max_correction = equity['equity'].iloc[0] - min(equity['equity'])
     if max_correction < 0:
         max_correction = 0
-    risk_rate = max_correction / equity['equity'][0]
+    risk_rate = max_correction / equity['equity'].iloc[0]
     return risk_rate
 
 
@@ -1102,46 +1300,43 @@ def add_pct(number: int or float):
 
 ##jerry
 
+def _trade_positions(context):
+    """
+    交易记录中每行的仓位及成交所在的 K 线序号，
+    同时给 ohlc_data 加上 K 线序号列 order，交易记录以成交时间为索引，供之后的统计使用
+    """
+    df = context.trade_log
+    q = context.ohlc_data
+    q['order'] = np.arange(len(q))
+    df.index = pd.DatetimeIndex(df['date'])
+    return df['position'].values, q.index.searchsorted(df.index)
+
+
 def None_repo_log(context):
-    """仓位中存在nan的时间段内,对应的时间之间的差值"""
-    df=context.trade_log
-    q=context.ohlc_data
-    q['order']=pd.Series(range(len(q)), index=q.index)
-    df.index=pd.DatetimeIndex(df.iloc[:,0])
-    df=df.iloc[:,4]
-    w=df[(df==1) | (df==-1)].index
-    w ,_= w.map(lambda x: x.strftime('%Y-%m-%d')),q[q.index==w[0]]['order']-q.iloc[0,-1]
-    dur=_.tolist()
-    for i in range(1,len(df)-1):
-        if df[i] ==0:
-            cur=q[q.index==df.index[i].strftime('%Y-%m-%d')]['order']
-            after=w[w>df.index[i].strftime('%Y-%m-%d')][0]
-            after=q[q.index==after]['order']
-            dur.append(after[0]-cur[0])
+    """
+    空仓的 K 线数：第一次开仓前的 K 线数及每次平仓到下次开仓的 K 线数，
+    返回 (总空仓 K 线数, 最长的一次)，最后一笔为平仓时总数加 1
+    """
+    position, bars = _trade_positions(context)
+    in_market = position != 0
+    following = next_run_start(in_market)  # 每段空仓之后开仓的行
+    rows = np.flatnonzero(~in_market & (following < len(position)))
+    rows = rows[(rows >= 1) & (rows < len(position) - 1)]
+    dur = np.append(bars[np.flatnonzero(in_market)[0]], bars[following[rows]] - bars[rows])
     dur.sort()
-    if df.iloc[-1] == 0:
-        return sum(dur)+1,dur[-1]
+    if position[-1] == 0:
+        return int(dur.sum()) + 1, int(dur[-1])
     else:
-        return sum(dur),dur[-1]
+        return int(dur.sum()), int(dur[-1])
 
-def have_repo_log(context):
-    """仓位中存在非nan的时间段内,对应的时间之间的差值"""
-    df = context.trade_log
-    q = context.ohlc_data
-    q['order'] = pd.Series(range(len(q)), index=q.index)
-    df.index = pd.DatetimeIndex(df.iloc[:, 0])
-    df = df.iloc[:, 4]
-    w = df[df==0].index
-    w= w.map(lambda x: x.strftime('%Y-%m-%d'))
-    dur=[]
-    for i in range(len(df)):
-        if df[i]==1 or df[i]==-1:
-            cur = q[q.index == df.index[i].strftime('%Y-%m-%d')]['order']
-            after = w[w > df.index[i].strftime('%Y-%m-%d')][0]
-            after = q[q.index == after]['order']
-            dur.append(after[0] - cur[0])
-    return dur
 
+def have_repo_log(context):
+    """持仓的 K 线数：每次开仓到之后第一次平仓的 K 线数，每个开仓一个值"""
+    position, bars = _trade_positions(context)
+    in_market = position != 0
+    following = next_run_start(in_market)  # 每段持仓之后平仓的行
+    rows = np.flatnonzero(in_market & (following < len(position)))
+    return (bars[following[rows]] - bars[rows]).tolist()
 
 
 def calc_clir_date_range(context,value):
@@ -1164,23 +1359,14 @@ def calc_clir_date_range(context,value):
 
 
 def log_profit_or_loss(context):
-    """损益情况的记录"""
-    log=context.trade_log
-    p_or_l=[]
-    ind=[]
-    for i in range(1,len(log)-1):
-        if (log.iloc[i-1,4]==1 or log.iloc[i-1,4]==-1) and log.iloc[i,4]==0:
-            p_or_l.append(log.iloc[i,-1])
-            ind.append(log.index[i].strftime('%Y/%m/%d'))
-    return pd.Series(p_or_l,index=ind)
-
-
-
-
-
-
-
-
+    """损益情况的记录：每次平仓（由持仓变为空仓）时的权益，以平仓日期为索引，不含最后一行"""
+    log = context.trade_log
+    position = log['position'].values
+    starts, _, run_values = run_length_encode(position != 0)
+    rows = starts[~run_values & (starts >= 1) & (starts < len(log) - 1)]
+    dates = pd.DatetimeIndex(log['date'].values[rows]).values.astype('datetime64[D]')
+    dates = np.char.replace(dates.astype(str), '-', '/')  # 比逐个 strftime 快得多
+    return pd.Series(log['equity'].values[rows], index=dates.tolist())
 
 
     #######like.reset_index(0).iloc[:,0].diff(1).map(lambda x: str(x))
@@ -1254,16 +1440,16 @@ def stats(context):
     # stats['unrealized_profit'] = (
     #     ending_equity(dbal) - total_net_profit(trade_log) - (
     #         beginning_equity(capital)))
-    stats['持仓日收益率'] = add_pct(profit_rate_in_open(equity['equity'][-1], capital, ohlc_data, trade_log))
+    stats['持仓日收益率'] = add_pct(profit_rate_in_open(equity['equity'].iloc[-1], capital, ohlc_data, trade_log))
     stats['盈亏总平均/亏损平均'] = get_round(avg_profit_per_trade(context) / avg_loss_per_losing_trade(context))
     # drawdown = create_drawdowns(equity.reset_index())
     # equity.reset_index().to_csv('equity_in_analysis.csv')
     drawdown = create_drawdowns(pd.DataFrame(context.fill.equity.dict))
 
     stats['权益最大回撤'] = get_round(drawdown['drawdown'].max())
-    stats['权益最大回撤时间'] = drawdown['date'][drawdown['drawdown'].idxmax()]
+    stats['权益最大回撤时间'] = str(drawdown['date'][drawdown['drawdown'].idxmax()])
     stats['权益最大回撤比'] = add_pct(drawdown['pct'].max())
-    stats['权益最大回撤比时间'] = drawdown['date'][drawdown['pct'].idxmax()]
+    stats['权益最大回撤比时间'] = str(drawdown['date'][drawdown['pct'].idxmax()])
     stats['权益最长未创新高的持续时间'] = duration_of_equity_not_reaching_high(equity)
 
     stats['风险率'] = add_pct(risk_rate(equity))
@@ -1355,7 +1541,7 @@ def stats(context):
     stats['空仓周期数']=a
     stats['最长连续空仓周期数'] =b
     c=context.trade_log['re_profit'][context.trade_log['re_profit'] != 0]
-    if c[-1]<0:
+    if c.iloc[-1]<0:
         le=len(c)+1
     else:
         le=len(c)
@@ -1369,8 +1555,8 @@ def stats(context):
     drawdown = create_drawdowns(new)
     stats['损益最大回撤']=get_round(drawdown['drawdown'].max())
     stats['损益最大回撤比']=add_pct(drawdown['pct'].max())
-    stats['损益最大回撤时间']= drawdown['date'][drawdown['pct'].idxmax()]
-    stats['损益最大回撤比时间']=drawdown['date'][drawdown['pct'].idxmax()]
+    stats['损益最大回撤时间']= str(drawdown['date'][drawdown['pct'].idxmax()])
+    stats['损益最大回撤比时间']= str(drawdown['date'][drawdown['pct'].idxmax()])
     new.index=pd.DatetimeIndex(new.iloc[:,0])
     n=new.iloc[:,1:]
     stats['损益最长未创新高持续时间']=duration_of_equity_not_reaching_high(n)
@@ -1388,11 +1574,11 @@ def stats(context):
     stats['平均亏损交易周期(多头)']=get_round(stats['测试周期数']/stats['亏损次数（多头）'])
     stats['平均亏损交易周期(空头)']=get_round(stats['测试周期数']/stats['亏损次数（空头）'])
   #  stats['平均资金使用额']=len(have_repo_log(context))   ##########Dont KNOW YET
-    stats['最大资金使用额']=get_round(context.fill.margin.df.max()[0])
+    stats['最大资金使用额']=get_round(context.fill.margin.df.max().iloc[0])
     stats['扣除最大盈利后收益率']=str(np.round(((equity.values[-1][0]-context.trade_log['re_profit'].max()-context.initial_cash)/context.initial_cash)*100,3))+'%'
     stats['扣除最大亏损后收益率']=str(np.round(((equity.values[-1][0]-context.trade_log['re_profit'].min()-context.initial_cash)/context.initial_cash)*100,3))+'%'
-    stats['期间最大权益']=get_round(equity.max()[0])
-    stats['期间最小权益']=get_round(equity.min()[0])
+    stats['期间最大权益']=get_round(equity.max().iloc[0])
+    stats['期间最小权益']=get_round(equity.min().iloc[0])
     stats['手续费']=get_round(context.fill.commission.df.values[-1][0])
  #   q=pd.Series(context.fill.commission.df.values.reshape(-1))
    # [q[q.index == i].values[0] for i in have_repo_log(context)]  ###持仓期内的保证金
@@ -1435,7 +1621,7 @@ def stats(context):
     # stats['drawdown_recovery'] = _difference_in_years(
     #     datetime.strptime(dd['start_date'], "%Y-%m-%d %H:%M:%S"),
     #     datetime.strptime(dd['end_date'], "%Y-%m-%d %H:%M:%S")) * -1
-    # cagr = annualized_return_rate(equity['equity'][-1], capital, start, end)
+    # cagr = annualized_return_rate(equity['equity'].iloc[-1], capital, start, end)
     # stats['drawdown_annualized_return'] = dd['max'] / cagr
     # # dd = max_intra_day_drawdown(equity['equity_high'], equity['equity_low'])
     # # stats['max_intra_day_drawdown'] = dd['max']
@@ -1556,3 +1742,164 @@ def summary3(stats, benchmark_stats, *extras):
 
     df = pd.DataFrame(data, columns=columns, index=index)
     return df
+
+
+# -------------------------多次回测的比较---------------------------
+
+def _to_numeric(column):
+    """将一列统计值转换为数值，'12.5%' 转为 0.125，无法转换的为NaN"""
+    if column.dtype.kind in 'biuf':
+        return column.astype(np.float64)
+    text = column.astype(str).str.strip()
+    pct = text.str.endswith('%')
+    values = pd.to_numeric(text.str.rstrip('%'), errors='coerce')
+    return values.where(~pct, values / 100)
+
+
+def stats_table(stats_list, names=None):
+    """
+    将多次回测的stats（或 Quant.account.results）一次组装成一张表，每行一次回测，每列一个统计量，
+    百分数字符串转为小数，只保留能转换为数值的列
+    """
+    table = pd.DataFrame.from_records(list(stats_list), index=names)
+    table = table.apply(_to_numeric)
+    return table.dropna(axis=1, how='all')
+
+
+def equity_matrix(curves, names=None):
+    """
+    将多条权益曲线组成矩阵，每行一条曲线；curves 为等长的数组，
+    或以时间为索引的 pd.Series，按时间对齐，缺失处沿用前一个值
+    返回 (matrix, names, index)
+    """
+    if isinstance(curves, dict):
+        names = list(curves) if names is None else names
+        curves = list(curves.values())
+    curves = list(curves)
+    names = list(range(len(curves)) if names is None else names)
+    if curves and all(isinstance(i, pd.Series) for i in curves):
+        frame = pd.concat(curves, axis=1, ignore_index=True).sort_index().ffill().bfill()
+        return frame.values.T.astype(np.float64), names, frame.index
+    matrix = np.vstack([np.asarray(i, dtype=np.float64) for i in curves])
+    return matrix, names, pd.RangeIndex(matrix.shape[1])
+
+
+def _returns(matrix):
+    """每条权益曲线逐期的收益率"""
+    previous = matrix[:, :-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.diff(matrix, axis=1) / previous
+    returns[~np.isfinite(returns)] = 0
+    return returns
+
+
+def equity_metrics(matrix, names=None, period=TRADING_DAYS_PER_YEAR):
+    """
+    对权益矩阵的每一行（一条曲线）同时计算：总收益率、最大回撤、最大回撤比、
+    年化波动率和夏普比率（无风险利率为0），返回每行一次回测的表
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    hwm = np.maximum.accumulate(matrix, axis=1)
+    drawdown = hwm - matrix
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdown_pct = np.where(hwm > 0, drawdown / hwm, 0)
+        total_return = matrix[:, -1] / matrix[:, 0] - 1
+    returns = _returns(matrix)
+    std = returns.std(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(std > 0, returns.mean(axis=1) / std * np.sqrt(period), np.nan)
+    return pd.DataFrame(OrderedDict([
+        ('总收益率', total_return),
+        ('最大回撤', drawdown.max(axis=1)),
+        ('最大回撤比', drawdown_pct.max(axis=1)),
+        ('年化波动率', std * np.sqrt(period)),
+        ('夏普比率', sharpe),
+    ]), index=names)
+
+
+# 越小越好的统计量，排名时按升序
+LOWER_IS_BETTER = ('最大回撤', '最大回撤比', '年化波动率', '手续费', '权益最大回撤', '权益最大回撤比')
+
+
+def rank_table(table, lower_is_better=LOWER_IS_BETTER, pct=False):
+    """
+    各统计量在全部回测中的排名，1为最好，pct 为 True 时为百分位排名（0-1，越大越好）；
+    lower_is_better 中的列越小越好，其余越大越好
+    """
+    ranks = OrderedDict()
+    for column in table.columns:
+        ascending = (column in lower_is_better) != pct  # 百分位排名时方向相反
+        ranks[column] = table[column].rank(ascending=ascending, pct=pct, method='min')
+    return pd.DataFrame(ranks, index=table.index)
+
+
+def percentile_table(table, percentiles=(5, 25, 50, 75, 95)):
+    """各统计量在全部回测中的分位数，index 为分位数，忽略NaN"""
+    values = np.nanpercentile(table.values.astype(np.float64), percentiles, axis=0)
+    return pd.DataFrame(values, columns=table.columns,
+                        index=['{}%'.format(i) for i in percentiles])
+
+
+def _standardize(matrix):
+    """每条曲线收益率的z值，标准差为0的曲线全为0"""
+    returns = _returns(np.asarray(matrix, dtype=np.float64))
+    returns -= returns.mean(axis=1)[:, None]
+    std = returns.std(axis=1)
+    std[std == 0] = np.inf
+    returns /= std[:, None]
+    return returns
+
+
+def equity_correlation(matrix, names=None, dtype=np.float64):
+    """
+    权益曲线收益率两两之间的相关系数矩阵，用z值矩阵相乘一次算出；
+    n条曲线需要 n*n 个元素的内存，回测很多时可先选出一部分曲线，或用 float32
+    """
+    z = _standardize(matrix).astype(dtype)
+    corr = z.dot(z.T) / z.shape[1]
+    return pd.DataFrame(corr, index=names, columns=names)
+
+
+def mean_correlation(matrix, names=None):
+    """
+    每条曲线与其余全部曲线相关系数的平均值，不生成相关系数矩阵，
+    内存与时间都只与曲线数成正比，用于在很多次回测中找出与其他结果最不相关的
+    """
+    z = _standardize(matrix)
+    n, length = z.shape
+    if n < 2:
+        return pd.Series(np.nan, index=names)
+    total = z.dot(z.sum(axis=0)) / length  # 与全部曲线（含自身）的相关系数之和
+    self_corr = (z * z).sum(axis=1) / length
+    return pd.Series((total - self_corr) / (n - 1), index=names)
+
+
+def compare_runs(stats_list=None, curves=None, names=None, period=TRADING_DAYS_PER_YEAR,
+                 percentiles=(5, 25, 50, 75, 95)):
+    """
+    比较多次回测：stats_list 为各次的stats，curves 为各次的权益曲线，至少给出一个，
+    两者都给出时按顺序对应同一次回测；返回 dict：
+    table 各次回测的统计量，ranks 排名，percentile_ranks 百分位排名，
+    percentiles 各统计量的分位数，有权益曲线时另有 mean_correlation 平均相关系数
+    """
+    if stats_list is None and curves is None:
+        raise ValueError('stats_list 和 curves 至少给出一个')
+    tables = []
+    matrix = None
+    if curves is not None:
+        matrix, names, _ = equity_matrix(curves, names)
+        tables.append(equity_metrics(matrix, names, period))
+    if stats_list is not None:
+        table = stats_table(stats_list, names)
+        if tables:
+            table = table.drop([i for i in table.columns if i in tables[0].columns], axis=1)
+        tables.append(table)
+    table = pd.concat(tables, axis=1) if len(tables) > 1 else tables[0]
+    report = OrderedDict()
+    report['table'] = table
+    report['ranks'] = rank_table(table)
+    report['percentile_ranks'] = rank_table(table, pct=True)
+    report['percentiles'] = percentile_table(table, percentiles)
+    if matrix is not None:
+        report['mean_correlation'] = mean_correlation(matrix, names)
+    return report
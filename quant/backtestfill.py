@@ -1,5 +1,6 @@
 # coding:utf-8
 from quant import dataseries
+from quant.clock import clock
 from copy import copy
 from quant.event import events
 from quant.logging_backtest import logger
@@ -31,6 +32,7 @@ class FillBase(object):
         self._order_list = []
         self._trade_list = []
         self._completed_list = []
+        self.bankrupt = False  # 已爆仓，账户不再继续回测
 
     @property
     def completed_list(self):
@@ -39,6 +41,16 @@ class FillBase(object):
     def set_cash(self, cash):
         self.initial_cash = cash  # 重设初始资金
 
+    def set_spill(self, store):
+        """流式模式：各项数据只在内存中保留最近的部分，较旧的数据写入store"""
+        for series in vars(self).values():
+            if isinstance(series, dataseries.DataSeriesBase):
+                series.set_spill(store)
+
+    def idle(self):
+        """空仓，且没有挂单和止盈止损单，新行情不会改变账户的任何数据"""
+        return self.position[-1] == 0 and not self._order_list and not self._trade_list
+
     def set_dataseries_instrument(self, instrument):
         self.position.set_instrument(instrument)
         self.margin.set_instrument(instrument)
@@ -49,7 +61,6 @@ class FillBase(object):
         self.realized_gain_and_loss.set_instrument(instrument)
         self.long_realized_gain_and_loss.set_instrument(instrument)
         self.short_realized_gain_and_loss.set_instrument(instrument)
-        logger.debug('realized_gain_and_loss in set_dataseries_instrument: {}'.format(self.realized_gain_and_loss.list))
         self.unrealized_gain_and_loss.set_instrument(instrument)
 
     def update_time_index(self, feed_list):
@@ -107,8 +118,8 @@ class BacktestFill(FillBase):
             #     cur_position * fill_event.mult * cur_close)
             logger.debug('fill_event.per_margin * cur_position * avg_price * fill_event.units: {}, {}, {}, {}'.format(
                 fill_event.per_margin, cur_position, avg_price, fill_event.units))
-            # 保证金不能为负，用持仓均价计算，不用当日结算价计算，保留两位小数
-            margin = np.round(fill_event.per_margin * fill_event.units * avg_price * fill_event.lots, 2)
+            # 保证金不能为负，用持仓均价和交易后的持仓总量计算，不用当日结算价计算，保留两位小数
+            margin = np.round(fill_event.per_margin * fill_event.units * avg_price * abs(cur_position), 2)
         logger.debug('margin in date: {} {}'.format(margin, fill_event.date))
         self.margin.add(fill_event.date, margin)
 
@@ -154,10 +165,10 @@ class BacktestFill(FillBase):
             # 当最新仓位为负时，即卖出平仓后又卖出开仓了，均价即为卖出的执行价
             elif last > 0:
                 if fill_event.order_type == 'BUY':
-                    avg_price = (last * avg_price + fill_event.units * fill_event.price) / cur
+                    avg_price = (last * avg_price + fill_event.lots * fill_event.price) / cur
                 if fill_event.order_type == 'SELL':
-                    if cur > 0:
-                        avg_price = (last * avg_price - fill_event.units * fill_event.price) / cur
+                    if cur > 0:  # 部分平仓，均价不变
+                        pass
                     elif cur < 0:
                         avg_price = fill_event.price
             # 上一次仓位为空头时，当最新仓位变为多头时，即买入平仓后又买入开仓了，
@@ -166,10 +177,10 @@ class BacktestFill(FillBase):
                 if fill_event.order_type == 'BUY':
                     if cur > 0:
                         avg_price = fill_event.price
-                    elif cur < 0:
-                        avg_price = (-last * avg_price - fill_event.units * fill_event.price) / cur
+                    elif cur < 0:  # 部分平仓，均价不变
+                        pass
                 elif fill_event.order_type == 'SELL':
-                    avg_price = (-last * avg_price + fill_event.units * fill_event.price) / cur
+                    avg_price = (-last * avg_price + fill_event.lots * fill_event.price) / -cur
         logger.debug('avg_price in date in update_avg_price: {} {}'.format(avg_price, fill_event.date))
         self.avg_price.add(fill_event.date, avg_price)
 
@@ -204,20 +215,13 @@ class BacktestFill(FillBase):
         """
         equity = self.equity[-1]
         logger.debug('equity1 in date in update_equity: {} {}'.format(equity, fill_event.date))
-        logger.debug('realized_gain_and_loss in update_equity: {}'.format(self.realized_gain_and_loss.list))
-        total_re_profit = sum(self.realized_gain_and_loss.list)
+        total_re_profit = self.realized_gain_and_loss.sum()
         # total_re_profit = self.realized_gain_and_loss.list[-1]
         logger.debug('total_re_profit in date in update_equity: {} {}'.format(total_re_profit, fill_event.date))
-        logger.debug('self.realized_gain_and_loss.list: {}'.format(
-            self.realized_gain_and_loss.list))
-        logger.debug('self.realized_gain_and_loss.list: {}'.format(
-            self.long_realized_gain_and_loss.list))
-        logger.debug('self.realized_gain_and_loss.list: {}'.format(
-            self.short_realized_gain_and_loss.list))
         total_profit = total_re_profit + self.unrealized_gain_and_loss.total()
         logger.debug('total_profit in date in update_equity: {} {}'.format(total_profit, fill_event.date))
-        total_commission = sum(self.commission.list)
-        last_commission = self.commission.list[-1]
+        total_commission = self.commission.sum()
+        last_commission = self.commission[-1]
         logger.debug('total_commission in date in update_equity: {} {}'.format(total_commission, fill_event.date))
 
         # buy_open = self.position[-2] == 0 and self.position[-1] > 0  # 买开仓，即做多
@@ -277,44 +281,38 @@ class BacktestFill(FillBase):
         若当日无交易，则更新后的数据即为当日数据，
         若当日有交易，则交易后的数据覆盖开盘后更新的数据
         """
-        date = feed_list[-1].cur_bar.cur_date
-        logger.info('---------------------------------------------------------------')
-        logger.info('update_time_index, 开盘后date in backtestfill: {}'.format(date))
-
         # for feed in feed_list:
         feed = feed_list[-1]
+        date = clock.time  # 账户的时间序列取引擎时钟，即一个时间片中最后一个feed的时间
         # 控制计算的价格，同指令成交价一样
         price = feed.cur_bar.cur_close  # 取收盘价为计算价格
         # high = feed.cur_bar.cur_high
         # low = feed.cur_bar.cur_low
-        logger.info('price in date in update_time_index: {} {}'.format(price, date))
         self.set_dataseries_instrument(feed.instrument)
+        if self.idle():
+            self.__carry_forward(date, price, feed.units)
+            return
         # self.position.copy_last(date)  # 更新仓位
         # logger.debug('self.position in backtestfill: {}'.format(self.position))
         # logger.info('self.position in backtestfill: {}'.format(self.position[-1]))
-        logger.debug('self.position[-1] in date in update_time_index: {} {}'.format(self.position[-1], date))
 
         # 更新保证金
         # margin = self.position[-1] * price * feed.per_margin * feed.mult
         # margin = feed.per_margin * feed.units * price * 300
         margin = self.margin[-1]  # 未持仓时，保证金 = 上一次开仓保证金 或 0（平仓后）
-        logger.debug('feed.units: {}'.format(feed.units))
         # margin = abs(self.position[-1]) * price * feed.per_margin
-        logger.debug('margin in date in update_time_index: {} {}'.format(margin, date))
         self.margin.add(date, margin)
         # 更新平均价格
         # self.avg_price.copy_last(date)
         # 更新手续费，注意期货手续费需要重新计算
         commission = 0  # 无交易进行时，手续费 = 0
         self.commission.add(date, commission)
-        logger.debug('commission in date in update_time_index: {} {}'.format(self.commission[-1], date))
         # self.commission.add(date, commission)
         # 更新浮动盈亏
         cur_avg = self.avg_price[-1]
         self.avg_price.add(date, cur_avg)
         cur_position = self.position[-1]
         self.position.add(date, cur_position)
-        logger.debug('cur_position, cur_avg in date update_time_index: {} {} {}'.format(cur_position, cur_avg, date))
         # 浮盈 = （卖出价 - 买入价）× 手数
         # 若卖出平仓，则原仓位为正，浮盈 = （平仓价（卖出）- 持仓均价）× 原仓位
         # 若买入平仓，则原仓位为负，浮盈 = （平仓价（买入）- 持仓均价）× 原仓位
@@ -322,8 +320,6 @@ class BacktestFill(FillBase):
         if self.avg_price[-1] == 0:
             unrealized_g_l = 0
             # unrealized_g_l = unrealized_g_l_high = unrealized_g_l_low = 0
-        logger.debug('cur_avg in date in update_time_index: {} {}'.format(cur_avg, date))
-        logger.debug('unrealized_g_l in date in update_time_index: {} {}'.format(unrealized_g_l, date))
         self.unrealized_gain_and_loss.add(date, unrealized_g_l)
 
         def get_last_closed_equity():
@@ -341,17 +337,10 @@ class BacktestFill(FillBase):
 
         # 更新equity
         # last_equity = get_last_closed_equity()
-        total_re_profit = sum(self.realized_gain_and_loss.list)
-        logger.debug('total_re_profit: {}'.format(total_re_profit))
-        logger.debug('self.realized_gain_and_loss.list: {}'.format(self.realized_gain_and_loss.list))
+        total_re_profit = self.realized_gain_and_loss.sum()
         total_profit = total_re_profit + self.unrealized_gain_and_loss[-1]
-        logger.debug('total_profit in date in update_time_index: {} {}'.format(total_profit, date))
-        logger.debug('sum(self.commission.list) in date in update_time_index: {} {}'.format(
-            sum(self.commission.list), date))
         # logger.debug('self.commission.list in date in update_time_index: {} {}'.format(self.commission.list, date))
-        total_commission = sum(self.commission.list)
-        logger.debug('total_re_profit: {}'.format(total_re_profit))
-        logger.debug('total_commission:{}'.format(total_commission))
+        total_commission = self.commission.sum()
         # 持仓时余额 = 上一次开仓后的余额 + 当日浮动盈亏
         # equity = last_equity + unrealized_g_l  # **这里可能有问题**
         equity = self.initial_cash + total_profit - total_commission
@@ -360,19 +349,37 @@ class BacktestFill(FillBase):
 
         # 更新cash
         # total_margin = self.margin.total()
-        logger.debug('total_margin in update_time_index: {}'.format(margin))
         if self.position[-1] == 0:
             cash = self.equity[-1]
         else:
             cash = np.round(self.equity[-1] - margin, 2)
-        logger.debug('cash in date in update_time_index: {} {}'.format(cash, date))
         self.cash.add(date, cash)
-        logger.info('####################################')
 
-        # 检查是否爆仓
+        self.__check_bankrupt()
+
+    def __carry_forward(self, date, price, units):
+        """
+        空仓且没有挂单时，各项数据沿用上一条，与逐项计算的结果完全相同，
+        多账户回测中大部分时间空仓的账户，每条行情只需添加一次数据
+        """
+        cur_avg = self.avg_price[-1]
+        cur_position = self.position[-1]
+        self.margin.add(date, self.margin[-1])
+        self.commission.add(date, 0)
+        self.avg_price.add(date, cur_avg)
+        self.position.add(date, cur_position)
+        unrealized_g_l = 0 if cur_avg == 0 else (price - cur_avg) * cur_position * units
+        self.unrealized_gain_and_loss.add(date, unrealized_g_l)
+        total_profit = self.realized_gain_and_loss.sum() + unrealized_g_l
+        equity = self.initial_cash + total_profit - self.commission.sum()
+        self.equity.add(date, equity)
+        self.cash.add(date, equity)
+        self.__check_bankrupt()
+
+    def __check_bankrupt(self):
+        """检查是否爆仓，由 Quant 结束该账户的回测"""
         if self.equity[-1] <= 0 or self.cash[-1] <= 0:
-            for feed in feed_list:
-                feed.continue_backtest = False
+            self.bankrupt = True
             logger.info('警告：策略已造成爆仓！')
             logger.info('####################################')
 
@@ -424,8 +431,6 @@ class BacktestFill(FillBase):
             # 加入累计的盈亏
             # self.realized_gain_and_loss.add(f.date, sum(re_profit_list))
             self.realized_gain_and_loss.add(f.date, re_profit)  # 记录每次盈亏
-            logger.debug('---self.realized_gain_and_loss.add---: {} {}'.format(
-                self.realized_gain_and_loss.list, self.realized_gain_and_loss.dict))
             if i.direction > 0:  # 多头平仓盈亏（含手续费）
                 self.realized_gain_and_loss.long_poisition_re_profit.append(re_profit - commission)
                 self.long_realized_gain_and_loss.add(f.date, re_profit - commission)
@@ -436,10 +441,8 @@ class BacktestFill(FillBase):
                 self.short_commission.add(f.date, commission)
             logger.debug('self.realized_gain_and_loss in backtestfill: {}'.format(
                 self.realized_gain_and_loss))
-            logger.debug('self.realized_gain_and_loss.date in backtestfill: {}'.format(
-                self.realized_gain_and_loss.date))
-            if len(self.realized_gain_and_loss.date) > 1:
-                if self.realized_gain_and_loss.date[-2] is f.date:
+            if len(self.realized_gain_and_loss) > 1:
+                if self.realized_gain_and_loss.get_date(-2) == f.date:
                     new_realized_g_l = (
                         self.realized_gain_and_loss[-1] + self.realized_gain_and_loss[-2])
                     # self.realized_gain_and_loss.update_cur(new_realized_g_l)
@@ -461,7 +464,7 @@ class BacktestFill(FillBase):
             if f.order_type == 'BUY' and last_position < 0:
                 for i in self._trade_list:
                     # 剩余空单且品种相同
-                    if f.instrument is i.instrument and i.order_type == 'SELL':
+                    if f.instrument == i.instrument and i.order_type == 'SELL':
                         if f.lots == 0:
                             break
                         if i.lots > f.lots:  # 空单大于多单，剩余空单
@@ -490,7 +493,7 @@ class BacktestFill(FillBase):
             elif f.order_type == 'SELL' and last_position > 0:
                 for i in self._trade_list:
                     # 剩余多单且品种相同
-                    if f.instrument is i.instrument and i.order_type == 'BUY':
+                    if f.instrument == i.instrument and i.order_type == 'BUY':
                         if f.lots == 0:
                             break
                         if i.lots > f.lots:  # 多单大于空单，剩余多单
@@ -554,7 +557,7 @@ class BacktestFill(FillBase):
             trade.take_profit = None
             trade.stop_loss = None
             trade.trailing_stop = None
-            trade.date = data_today['date']
+            trade.date = feed.clock.time
             events.put(trade)
 
         data_today = feed.cur_bar.cur_data  # 今日的价格
@@ -572,7 +575,7 @@ class BacktestFill(FillBase):
                 continue  # 不是同个instrument无法比较，所以跳过
             if i.take_profit is i.stop_loss is i.trailing_stop:
                 continue  # 没有止盈止损，所以跳过
-            if trade.date is data_today['date']:
+            if trade.date == feed.clock.time:
                 continue  # 防止当天挂的单，因为昨天的价格而成交，不符合逻辑
 
             # 检查移动止损,修改止损价格
@@ -645,7 +648,7 @@ class BacktestFill(FillBase):
                 order.price = data_today['open']
             order.type = 'Order'
             order.order_type = order_type
-            order.date = data_today['date']
+            order.date = feed.clock.time
             order.execute_type = '{order.execute_type} Triggered'
             events.put(order)
 
@@ -1,7 +1,8 @@
 # coding:utf-8
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
 from quant.logging_backtest import logger
-from datetime import datetime
 
 
 
@@ -11,16 +12,105 @@ class BarBase(object):
     pass
 
 
+class Column(object):
+    """
+    bar中单个字段的数据列，保存在numpy缓冲区中，容量不足时翻倍扩展，
+    支持numpy的切片、负索引和len()，切片返回只读视图，不复制数据
+    """
+
+    def __init__(self, dtype=np.float64, capacity=256):
+        self._buffer = np.empty(capacity, dtype=dtype)
+        self._length = 0
+        self._spill = None  # 流式模式下的磁盘文件
+        self._window = None
+        self._limit = None
+        self._spilled = 0  # 已写入磁盘的条数
+
+    def set_spill(self, spill_file, window, limit):
+        """流式模式：内存中只保留最近的数据，达到limit条时，window条之前的数据写入spill_file"""
+        if self._buffer.dtype == object:
+            raise TypeError('非数值的数据列不能写入磁盘')
+        self._spill = spill_file
+        self._window = window
+        self._limit = limit
+
+    def append(self, value):
+        if self._spill is not None and self._length >= self._limit:
+            self.__spill()
+        if self._length == len(self._buffer):
+            buffer = np.empty(len(self._buffer) * 2, dtype=self._buffer.dtype)
+            buffer[:self._length] = self._buffer
+            self._buffer = buffer
+        self._buffer[self._length] = value
+        self._length += 1
+
+    def __spill(self):
+        """
+        将window条之前的数据写入磁盘，保留的数据复制到新的缓冲区开头，
+        与扩展时相同，不改写策略已取得的视图
+        """
+        n = self._length - self._window
+        self._spill.append(self._buffer[:n])
+        buffer = np.empty(len(self._buffer), dtype=self._buffer.dtype)
+        buffer[:self._window] = self._buffer[n:self._length]
+        self._buffer = buffer
+        self._length = self._window
+        self._spilled += n
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, item):
+        data = self._buffer[:self._length][item]
+        if isinstance(data, np.ndarray):
+            data.flags.writeable = False
+        return data
+
+    def __repr__(self):
+        return repr(self.array)
+
+    @property
+    def array(self):
+        """内存中数据的只读视图，非流式模式下即全部数据"""
+        return self[:]
+
+    @property
+    def count(self):
+        """添加过的总条数，含已写入磁盘的部分"""
+        return self._spilled + self._length
+
+    @property
+    def spilled(self):
+        return self._spilled
+
+    @property
+    def window(self):
+        """流式模式下内存中至少保留的条数，非流式模式为None"""
+        return self._window
+
+    def history(self):
+        """全部数据，有数据写入磁盘时与memmap读取的部分拼接"""
+        if not self._spilled:
+            return self.array
+        return np.concatenate([self._spill.read(), self.array])
+
+    @classmethod
+    def from_array(cls, array):
+        """由numpy数组创建数据列"""
+        dtype = object if array.dtype.kind == 'U' else array.dtype
+        column = cls(dtype, max(256, len(array)))
+        column._buffer[:len(array)] = array
+        column._length = len(array)
+        return column
+
+
 class Current_bar(BarBase):
     """当前bar的数据，以列表储存，只有一条，为当前行情，并把这些数据设为类属性"""
     def __init__(self):
         self._cur_bar_list = [0]
 
     def add_new_bar(self, new_bar):
-        """不断更新当前行情数据"""
-
-        bar_date = datetime.strptime(new_bar['time'], '%Y/%m/%d')
-        logger.debug('---bar_date in barbase---: {}'.format(bar_date))
+        """不断更新当前行情数据，time为纳秒时间戳，不做解析"""
         # bar_list_length = len(self._cur_bar_list)
         logger.debug('self._cur_bar_list in barbase: {}'.format(self._cur_bar_list))
         # if bar_list_length == 2:
@@ -83,13 +173,19 @@ class Current_bar(BarBase):
 
 class Bar(BarBase):
     """存储feed中的OHLC数据（open, high, low, close）
-    一个instrument对应bar_dict中的一个值
+    一个instrument对应bar_dict中的一个值，
+    同时每个字段按列保存为Column，bar.close[-10:] 等返回numpy视图
     """
 
     def __init__(self, instrument):
         self._bar_dict = {instrument: []}
+        self._columns = {instrument: {}}
         self._instrument = instrument
-        self._data_name = None
+        self._spill = None  # 流式模式下的SpillStore
+
+    def set_spill(self, store):
+        """流式模式：数据列和bar列表在内存中只保留最近的部分，较旧的数据列写入磁盘"""
+        self._spill = store
 
     def __getitem__(self, item):
         return self._bar_dict
@@ -97,44 +193,57 @@ class Bar(BarBase):
     def _initialize(self):
         """清空数据"""
         self._bar_dict = {}
+        self._columns = {}
 
-    def _combine_all_feed(self, new_bar_dict):
-        """只运行一次，将所有feed整合到一起"""
-        self._bar_dict.update(new_bar_dict)
-
-    def __getitem_func(self, given):
-        if isinstance(given, slice):
-            """处理切片对象"""
-            if given.start and given.stop:
-                start = given.start
-                stop = given.stop
-            else:
-                start = 0
-                stop = len(self.data)  # 通过属性定义
-
-            # 切片为负时的情况
-            length = len(self.data)
-            if start < 0 and stop < 0:
-                start = length + start
-                stop = length + stop
-            original_data = self.data[start:stop]  # 格式为[{},{},{}...]
-            data = [i[self._data_name] for i in original_data]
-            return data
-        else:
-            return self._bar_dict[self.instrument][given]["close"]
-
-    def __create_data_cls(self):
-        """产生一个新类型，类名为OHLC"""
-        cls = type("OHLC", (), {})
-        cls.data = self._bar_dict[self.instrument]
-        cls.__getitem__ = self.__getitem_func
-        return cls
+    def _combine_all_feed(self, bar):
+        """只运行一次，将所有feed整合到一起，与feed共享数据"""
+        self._bar_dict.update(bar.total_dict)
+        self._columns.update(bar.total_columns)
 
     def set_instrument(self, instrument):
         self._instrument = instrument
 
     def add_new_bar(self, new_bar):
-        self._bar_dict[self.instrument].append(new_bar)
+        data = self._bar_dict[self.instrument]
+        data.append(new_bar)
+        columns = self._columns[self.instrument]
+        if not columns:
+            for name, value in new_bar.items():
+                if name == 'time':
+                    dtype = np.int64
+                elif isinstance(value, (int, float, np.number)):
+                    dtype = np.float64
+                else:
+                    dtype = object
+                columns[name] = Column(dtype)
+                if self._spill is not None:
+                    columns[name].set_spill(self._spill.file(
+                        '{}.{}'.format(self.instrument, name), dtype), self._spill.window, self._spill.limit)
+        for name, column in columns.items():
+            column.append(new_bar[name])
+        if self._spill is not None and len(data) >= self._spill.limit:
+            del data[:-self._spill.window]  # 已写入磁盘的数据列可还原bar，bar列表只保留最近的部分
+
+    def get_state(self):
+        """保存当前instrument的数据列"""
+        columns = self._columns[self.instrument]
+        return {'fields': list(columns),
+                'columns': {name: np.array(column.array, dtype=str if column.array.dtype == object else None)
+                            for name, column in columns.items()}}
+
+    def set_state(self, state):
+        """恢复当前instrument的数据列，并由数据列重建bar列表"""
+        columns = self._columns[self.instrument]
+        columns.clear()
+        for name in state['fields']:
+            columns[name] = Column.from_array(state['columns'][name])
+        values = [state['columns'][name].tolist() for name in state['fields']]
+        data = self._bar_dict[self.instrument]
+        data[:] = [dict(zip(state['fields'], row)) for row in zip(*values)]
+
+    def get_column(self, name):
+        """获取字段name的数据列"""
+        return self._columns[self.instrument][name]
 
     @property
     def instrument(self):
@@ -148,30 +257,33 @@ class Bar(BarBase):
     def total_dict(self):
         return self._bar_dict
 
+    @property
+    def total_columns(self):
+        return self._columns
+
     @property
     def df(self):
-        return pd.DataFrame(self._bar_dict[self.instrument])
+        columns = self._columns[self.instrument]
+        if self._spill is None or not columns:
+            return pd.DataFrame(self._bar_dict[self.instrument])
+        return pd.DataFrame(OrderedDict((name, column.history()) for name, column in columns.items()))
+
+    @property
+    def time(self):
+        return self.get_column('time')
 
     @property
     def open(self):
-        self._data_name = "open"
-        cls = self.__create_data_cls()
-        return cls()
+        return self.get_column('open')
 
     @property
     def high(self):
-        self._data_name = "high"
-        cls = self.__create_data_cls()
-        return cls()
+        return self.get_column('high')
 
     @property
     def low(self):
-        self._data_name = "low"
-        cls = self.__create_data_cls()
-        return cls()
+        return self.get_column('low')
 
     @property
     def close(self):
-        self._data_name = "close"
-        cls = self.__create_data_cls()
-        return cls()
+        return self.get_column('close')
@@ -0,0 +1,151 @@
+# coding:utf-8
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from quant.clock import TIME_FORMATS
+from quant.feedbase import ColumnDataReader, load_csv_columns, search_range
+from quant.logging_backtest import logger
+
+VERSION = 1
+MANIFEST = 'manifest.json'
+
+
+class BarStore(object):
+    """
+    持久化的列式行情库，每个品种一个目录，每个字段一个定长的 .npy 文件，
+    time 列为升序的int64纳秒时间戳，另有 manifest.json 记录行数、字段和起止时间；
+    读取时用memmap打开，只读取用到的页，多个进程共用同一份页缓存
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, instrument):
+        return os.path.join(self.root, instrument)
+
+    def instruments(self):
+        """库中全部品种"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(i for i in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, i, MANIFEST)))
+
+    def manifest(self, instrument):
+        """品种的manifest：{'version', 'instrument', 'rows', 'fields': {字段: dtype}, 'start', 'end'}"""
+        with open(os.path.join(self.path(instrument), MANIFEST)) as f:
+            return json.load(f, object_pairs_hook=OrderedDict)
+
+    def write(self, instrument, columns):
+        """
+        写入（覆盖）品种的全部数据，columns 为 {'time': int64数组, 'open': 数组, ...}，
+        time 须为升序，其余字段须为定长类型
+        """
+        columns = self.__check(columns)
+        directory = self.path(instrument)
+        os.makedirs(directory, exist_ok=True)
+        for name, values in columns.items():
+            tmp = os.path.join(directory, '{}.npy.tmp'.format(name))
+            with open(tmp, 'wb') as f:  # np.save 会给文件名加上 .npy，故用文件对象
+                np.save(f, values)
+            os.replace(tmp, os.path.join(directory, '{}.npy'.format(name)))
+        self.__write_manifest(instrument, columns)
+        logger.info('{} 写入 {} 条行情'.format(instrument, len(columns['time'])))
+
+    def append(self, instrument, columns):
+        """在品种数据末尾追加新行，新行的时间须晚于已有数据，字段须相同"""
+        if instrument not in self.instruments():
+            return self.write(instrument, columns)
+        columns = self.__check(columns)
+        manifest = self.manifest(instrument)
+        if set(columns) != set(manifest['fields']):
+            raise ValueError('{} 的字段与已有数据不同: {}'.format(instrument, list(manifest['fields'])))
+        if len(columns['time']) and manifest['rows'] and columns['time'][0] <= manifest['end']:
+            raise ValueError('{} 追加的行情须晚于 {}'.format(instrument, manifest['end']))
+        old = self.open(instrument)
+        rows = manifest['rows'] + len(columns['time'])
+        directory = self.path(instrument)
+        for name in manifest['fields']:
+            values = columns[name]
+            tmp = os.path.join(directory, '{}.npy.tmp'.format(name))
+            array = np.lib.format.open_memmap(tmp, mode='w+', dtype=old[name].dtype, shape=(rows,))
+            array[:manifest['rows']] = old[name]
+            array[manifest['rows']:] = values
+            array.flush()
+            del array
+            os.replace(tmp, os.path.join(directory, '{}.npy'.format(name)))
+        self.__write_manifest(instrument, self.open(instrument, check=False))
+
+    def import_csv(self, instrument, datapath, date_format=TIME_FORMATS['daily']):
+        """读取csv并写入品种数据，date_format 同 CSVDataReader"""
+        self.write(instrument, load_csv_columns(datapath, date_format))
+
+    def open(self, instrument, check=True):
+        """以只读memmap打开品种的全部字段，返回 OrderedDict{字段: 数组}，不读取数据本身"""
+        manifest = self.manifest(instrument)
+        directory = self.path(instrument)
+        columns = OrderedDict(
+            (name, np.load(os.path.join(directory, '{}.npy'.format(name)), mmap_mode='r'))
+            for name in manifest['fields'])
+        if check and any(len(i) != manifest['rows'] for i in columns.values()):
+            raise ValueError('{} 的数据与manifest不一致'.format(instrument))
+        return columns
+
+    def read(self, instrument, startdate=None, enddate=None):
+        """
+        取 [startdate, enddate] 范围内的数据，用二分查找time列定位，
+        返回memmap上的切片，不复制数据
+        """
+        columns = self.open(instrument)
+        start, stop = search_range(columns['time'], startdate, enddate)
+        return OrderedDict((name, values[start:stop]) for name, values in columns.items())
+
+    def __check(self, columns):
+        """检查并整理要写入的数据，time放在第一列"""
+        if 'time' not in columns:
+            raise ValueError('缺少time列')
+        time = np.asarray(columns['time'], dtype=np.int64)
+        if len(time) > 1 and np.any(time[1:] < time[:-1]):
+            raise ValueError('time列须为升序')
+        checked = OrderedDict([('time', time)])
+        for name, values in columns.items():
+            if name == 'time':
+                continue
+            values = np.asarray(values)
+            if values.dtype == object:
+                raise TypeError('字段 {} 不是定长类型，无法保存'.format(name))
+            if len(values) != len(time):
+                raise ValueError('字段 {} 的长度与time列不同'.format(name))
+            checked[name] = values
+        return checked
+
+    def __write_manifest(self, instrument, columns):
+        time = columns['time']
+        manifest = OrderedDict([
+            ('version', VERSION),
+            ('instrument', instrument),
+            ('rows', len(time)),
+            ('fields', OrderedDict((name, values.dtype.str) for name, values in columns.items())),
+            ('start', int(time[0]) if len(time) else None),
+            ('end', int(time[-1]) if len(time) else None),
+        ])
+        path = os.path.join(self.path(instrument), MANIFEST)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+
+class StoreDataReader(ColumnDataReader):
+    """
+    从BarStore读取行情，以memmap打开各字段，打开时不读取数据，
+    起止时间用二分查找定位，只有回测用到的行才会从磁盘读入
+    """
+
+    def __init__(self, store, instrument, startdate=None, enddate=None):
+        super().__init__(instrument, startdate, enddate)
+        self.store = store if isinstance(store, BarStore) else BarStore(store)
+
+    def load_data(self):
+        return self.store.open(self.instrument)
@@ -1,11 +1,35 @@
 # coding:utf-8
 from abc import ABC, abstractmethod
+from collections import namedtuple
+import numpy as np
 from quant.event import events, FillEvent
 from quant.logging_backtest import logger
 from quant.context import Context
 
 fill_event = Context().FillEvent
 
+PENDING_TYPES = frozenset(['LIMIT', 'STOP'])  # 挂单，提交时不改变仓位，不占用保证金
+EXIT_TYPES = frozenset(['CLOSE_ALL', 'STOP_LOSS_ORDER', 'TAKE_PROFIT_ORDER', 'TRAILING_STOP_ORDER'])
+
+# 资金检查的结果，reason 为 'MARGIN'（资金不足，拒绝）或 'SCALED'（资金不足，减少开仓手数）
+Rejection = namedtuple('Rejection', [
+    'date', 'order_id', 'instrument', 'order_type', 'lots', 'accepted_lots',
+    'required', 'available', 'reason'])
+
+
+def group_cumsum(codes, values):
+    """按分组codes分别计算values的累加和，结果与values顺序一致"""
+    order = np.argsort(codes, kind='mergesort')
+    sorted_values = values[order]
+    total = np.cumsum(sorted_values)
+    sorted_codes = codes[order]
+    first = np.ones(len(codes), dtype=bool)
+    first[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    base = np.maximum.accumulate(np.where(first, np.arange(len(codes)), 0))
+    result = np.empty_like(total)
+    result[order] = total - (total[base] - sorted_values[base])
+    return result
+
 
 class BrokerBase(ABC):
     """broker的基类"""
@@ -53,36 +77,126 @@ class BrokerBase(ABC):
         self.prenext()
         self.next()
 
+    def flush(self):
+        """处理收集的订单，返回处理的订单数，逐个处理订单时无需收集"""
+        return 0
+
     def set_notify(self):
         self._notify = True
 
 
 class Broker(BrokerBase):
-    """"""
+    """
+    batch 为 True 时，同一时间片的订单先收集起来，事件队列清空后由 flush 一次性检查资金：
+    按优先级（平仓类订单、减仓订单、其余按到达顺序）依次占用可用资金，
+    开仓部分需要的保证金超过可用资金时拒绝订单，scale 为 True 时市价单改为可负担的手数；
+    检查结果记录在 rejections 中，订单仍按到达顺序发出
+    """
+    batch = True
+    scale = False
 
     def __init__(self):
         super().__init__()
+        self.rejections = []
+        self._order_events = []
+        self._checked = False
+
+    def run_broker(self, order_event):
+        if self.batch:
+            self._order_events.append(order_event)
+        else:
+            super().run_broker(order_event)
+
+    def flush(self):
+        """检查并发出本时间片收集的订单，返回处理的订单数"""
+        order_events = self._order_events
+        self._order_events = []
+        if not order_events:
+            return 0
+        for order_event, accepted in zip(order_events, self.check_orders(order_events)):
+            self.order_event = order_event
+            self._checked = accepted
+            self.start()
+            self.prenext()
+            self.next()
+        return len(order_events)
 
     def submit_order(self):
         """发送交易指令"""
         fill_order = fill_event(self.order_event.order)
         events.put(fill_order)
 
+    def priority(self, order_events, closing):
+        """占用资金的优先级，返回排序后的序号：平仓类订单、减仓订单在前，其余按到达顺序"""
+        exits = np.array([i.execute_type in EXIT_TYPES for i in order_events])
+        return np.lexsort((np.arange(len(order_events)), ~closing, ~exits))
+
+    def check_orders(self, order_events):
+        """
+        一次检查多个订单的资金，返回是否接受的列表，与order_events顺序一致
+        开仓手数为订单使持仓绝对值增加的部分，所需保证金 = 保证金比例 × 单位 × 价格 × 开仓手数，
+        减仓部分按持仓均价释放保证金；被缩减手数的订单直接修改lots
+        """
+        n = len(order_events)
+        names, codes = np.unique([i.instrument for i in order_events], return_inverse=True)
+        lots = np.array([i.lots for i in order_events], dtype=np.float64)
+        direction = np.array([i.direction for i in order_events], dtype=np.float64)
+        pending = np.array([i.execute_type in PENDING_TYPES for i in order_events])
+        unit_margin = np.array([i.per_margin * i.units * i.price for i in order_events], dtype=np.float64)
+        unit_release = np.array([i.per_margin * i.units for i in order_events], dtype=np.float64)
+        positions = np.array([self.fill.position.latest(i) for i in names], dtype=np.float64)
+        unit_release *= np.array([self.fill.avg_price.latest(i) for i in names], dtype=np.float64)[codes]
+        delta = np.where(pending, 0, lots * direction)
+        order = self.priority(order_events, delta * positions[codes] < 0)
+        available = self.fill.cash.latest('all')
+        accepted = np.ones(n, dtype=bool)
+
+        start = 0
+        while start < n:
+            index = order[start:]
+            c, d = codes[index], delta[index]
+            before = positions[c] + group_cumsum(c, d) - d
+            opening = np.maximum(np.abs(before + d) - np.abs(before), 0)
+            released = np.maximum(np.abs(before) - np.abs(before + d), 0)
+            need = np.cumsum(opening * unit_margin[index] - released * unit_release[index])
+            failed = np.flatnonzero(need > available)
+            k = failed[0] if len(failed) else len(index)
+            np.add.at(positions, c[:k], d[:k])
+            if k:
+                available -= need[k - 1]
+            if k == len(index):
+                break
+
+            i = index[k]
+            order_event = order_events[i]
+            free = available + released[k] * unit_release[i]
+            affordable = int(max(free, 0) // unit_margin[i]) if unit_margin[i] > 0 else 0
+            accepted_lots = lots[i] - opening[k] + affordable
+            if self.scale and order_event.execute_type == 'MARKET' and accepted_lots > 0:
+                reason = 'SCALED'
+                order_event.lots = int(accepted_lots) if float(accepted_lots).is_integer() else accepted_lots
+                positions[codes[i]] += accepted_lots * direction[i]
+                available = free - affordable * unit_margin[i]
+            else:
+                reason = 'MARGIN'
+                accepted_lots = 0
+                accepted[i] = False
+            self.rejections.append(Rejection(
+                order_event.date, order_event.order.order_ID, order_event.instrument,
+                order_event.order_type, lots[i], accepted_lots, opening[k] * unit_margin[i],
+                free, reason))
+            logger.info('{} {} 资金不足: 需要 {:.2f}, 可用 {:.2f}, {} 手 -> {} 手'.format(
+                order_event.date, order_event.instrument, opening[k] * unit_margin[i], free,
+                lots[i], accepted_lots))
+            start += k + 1
+        return accepted.tolist()
+
     def check_before(self):
         """
         检查钱是否足够支持Order执行
         Return： True / False
         """
-        execute_type = [
-            'MARKET', 'LIMIT', 'STOP', 'CLOSE_ALL', 'STOP_LOSS_ORDER',
-            'TAKE_PROFIT_ORDER', 'TRAILING_STOP_ORDER'
-        ]
-        check_results = self.fill.cash[-1] > (
-            self.order_event.per_margin * self.order_event.lots *
-            self.order_event.price * self.order_event.units +
-            self.fill.margin[-1] * self.order_event.direction
-        ) or self.order_event.execute_type in execute_type
-        return check_results
+        return self.check_orders([self.order_event])[0]
 
     def check_after(self):
         """检查Order发送后是否执行成功"""
@@ -97,29 +211,36 @@ class Broker(BrokerBase):
         self.order_event.status = status
 
     def start(self):
+        """检查资金，批量处理时已在 flush 中检查过，只检查一次"""
         self.notify()
-        if self.check_before():
+        if not self.batch:
+            self._checked = self.check_before()
+        if self._checked:
             self.change_status('SUBMITTED')
             self.notify()
         else:
+            self.change_status('MARGIN')
             logger.debug('现金不够，本次交易取消')
 
     def prenext(self):
         pass
 
     def next(self):
+        if self._checked and self.check_after():
+            self.execute()
+
+    def execute(self):
         """
         如果order执行类型为限价或停止，将状态改为PENDING（等待）；
         否则，状态改为FILLED（执行）；
         发送交易指令，发出通知
         """
-        if self.check_before() and self.check_after():
-            if self.order_event.execute_type in ['LIMIT', 'STOP']:
-                self.change_status('PENDING')
-            else:
-                self.change_status('FILLED')
-            self.submit_order()
-            self.notify()
+        if self.order_event.execute_type in PENDING_TYPES:
+            self.change_status('PENDING')
+        else:
+            self.change_status('FILLED')
+        self.submit_order()
+        self.notify()
 
     def notify(self):
         if self._notify:
@@ -0,0 +1,192 @@
+# coding:utf-8
+import json
+import os
+from itertools import count
+
+import numpy as np
+
+from quant import order as order_module
+from quant.event import FillEvent
+from quant.logging_backtest import logger
+
+VERSION = 1
+FILL_SERIES = (
+    'position', 'margin', 'avg_price', 'commission', 'long_commission',
+    'short_commission', 'cash', 'realized_gain_and_loss',
+    'long_realized_gain_and_loss', 'short_realized_gain_and_loss',
+    'unrealized_gain_and_loss', 'equity')
+ORDER_LISTS = ('_trade_list', '_order_list', '_completed_list')
+# 订单中需要保存的数值和字符串属性
+ORDER_FLOATS = ('_per_comm', '_per_margin', '_units', '_lots', '_slippage', '_price',
+                '_take_profit', '_stop_loss', '_direction', '_trailing_stop')
+ORDER_STRINGS = ('_status', '_instrument', '_execute_mode', '_execute_type', '_order_type')
+
+
+def _split(obj, key, arrays):
+    """将状态中的numpy数组取出放入arrays，其余部分可直接转为json"""
+    if isinstance(obj, np.ndarray):
+        arrays[key] = obj
+        return {'__array__': key}
+    if isinstance(obj, dict):
+        return {str(k): _split(v, '{}/{}'.format(key, k), arrays) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_split(v, '{}/{}'.format(key, i), arrays) for i, v in enumerate(obj)]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def _join(obj, arrays):
+    """_split的逆过程"""
+    if isinstance(obj, dict):
+        if '__array__' in obj:
+            return arrays[obj['__array__']]
+        return {k: _join(v, arrays) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_join(v, arrays) for v in obj]
+    return obj
+
+
+def _get_id_counter():
+    """读取订单编号计数器的下一个值，不改变计数"""
+    next_id = next(order_module.OrderBase.unique_id)
+    order_module.OrderBase.unique_id = count(next_id)
+    return next_id
+
+
+def _get_orders_state(fill):
+    """
+    将 trade_list、order_list、completed_list 中的订单按列保存，
+    多个事件共用同一订单时只保存一次，列表中保存订单的序号
+    """
+    orders = []
+    index = {}
+    lists = {}
+    for name in ORDER_LISTS:
+        positions = []
+        for event in getattr(fill, name):
+            key = id(event.order)
+            if key not in index:
+                index[key] = len(orders)
+                orders.append(event.order)
+            positions.append(index[key])
+        lists[name] = np.array(positions, dtype=np.int64)
+
+    state = {'lists': lists, 'class': np.array([type(i).__name__ for i in orders], dtype=str),
+             'order_id': np.array([i.order_ID for i in orders], dtype=np.int64),
+             'date': np.array([i.date for i in orders], dtype=np.int64),
+             'trailing_stop_type': [], 'trailing_stop_value': []}
+    for name in ORDER_FLOATS:
+        state[name] = np.array([np.nan if getattr(i, name) is None else getattr(i, name)
+                                for i in orders], dtype=np.float64)
+    for name in ORDER_STRINGS:
+        state[name] = np.array(['' if getattr(i, name, None) is None else getattr(i, name)
+                                for i in orders], dtype=str)
+    for i in orders:
+        calc = getattr(i, '_trailing_stop_calc', None)
+        state['trailing_stop_type'].append(calc.type if calc else '')
+        state['trailing_stop_value'].append(getattr(calc, calc.type) if calc else np.nan)
+    state['trailing_stop_type'] = np.array(state['trailing_stop_type'], dtype=str)
+    state['trailing_stop_value'] = np.array(state['trailing_stop_value'], dtype=np.float64)
+    return state
+
+
+def _set_orders_state(fill, state, feeds):
+    """由_get_orders_state的结果重建订单，订单的feed、cur_bar按instrument重新关联"""
+    orders = []
+    lots = state['_lots'].tolist()
+    for row, class_name in enumerate(state['class'].tolist()):
+        order = getattr(order_module, class_name).__new__(getattr(order_module, class_name))
+        order.order_ID = int(state['order_id'][row])
+        order._parent = None
+        order._order_data = None
+        order.trailing_stop_calc = None
+        order._date = int(state['date'][row])
+        for name in ORDER_FLOATS:
+            value = state[name][row].item()
+            setattr(order, name, None if np.isnan(value) else value)
+        if lots[row] is not None and float(lots[row]).is_integer():
+            order._lots = int(lots[row])
+        for name in ORDER_STRINGS:
+            value = state[name][row].item()
+            setattr(order, name, value if value else None)
+        calc_type = state['trailing_stop_type'][row].item()
+        order._trailing_stop_calc = None
+        if calc_type:
+            calc = type(calc_type, (), {calc_type: state['trailing_stop_value'][row].item()})
+            calc.type = calc_type
+            order._trailing_stop_calc = calc
+        feed = feeds[order._instrument]
+        order._instrument = feed.instrument  # backtestfill 中用 is 比较 instrument，须为同一对象
+        order._feed = feed
+        order._cur_bar = feed.cur_bar
+        orders.append(order)
+
+    for name in ORDER_LISTS:
+        setattr(fill, name, [FillEvent(orders[i]) for i in state['lists'][name].tolist()])
+
+
+def get_state(quant):
+    """收集回测的全部状态"""
+    fill = quant.fill
+    state = {
+        'version': VERSION,
+        'count': quant.context.count,
+        'next_order_id': _get_id_counter(),
+        'fill': {
+            'initial_cash': fill.initial_cash,
+            'first_open': fill.first_open,
+            'series': {name: getattr(fill, name).get_state() for name in FILL_SERIES},
+            'orders': _get_orders_state(fill),
+        },
+        'feeds': [feed.get_state() for feed in quant.feed_list],
+        'strategies': [strategy.get_state() for strategy in quant.strategy_list],
+    }
+    return state
+
+
+def set_state(quant, state):
+    """将get_state的结果恢复到quant中，须在feed加载、dataseries初始化之后调用"""
+    if state['version'] != VERSION:
+        raise ValueError('不支持的快照版本: {}'.format(state['version']))
+    if len(state['feeds']) != len(quant.feed_list):
+        raise ValueError('快照中的feed数量与当前回测不一致')
+    fill = quant.fill
+    quant.context.count = state['count']
+    order_module.OrderBase.unique_id = count(state['next_order_id'])
+    fill.initial_cash = state['fill']['initial_cash']
+    fill.first_open = state['fill']['first_open']
+    for name in FILL_SERIES:
+        getattr(fill, name).set_state(state['fill']['series'][name])
+    feeds = {}
+    for feed, feed_state in zip(quant.feed_list, state['feeds']):
+        if feed.instrument != feed_state['instrument']:
+            raise ValueError('快照中的feed与当前回测不一致: {}'.format(feed_state['instrument']))
+        feed.set_state(feed_state)
+        feeds[feed.instrument] = feed
+    _set_orders_state(fill, state['fill']['orders'], feeds)
+    for strategy, strategy_state in zip(quant.strategy_list, state['strategies']):
+        strategy.set_state(strategy_state)
+
+
+def save(quant, path):
+    """
+    保存快照：numpy数组写入npz（不压缩、不使用pickle），
+    其余信息以json写入其中的 __header__，先写临时文件再替换，防止写到一半时中断
+    """
+    arrays = {}
+    header = _split(get_state(quant), 'state', arrays)
+    arrays['__header__'] = np.frombuffer(json.dumps(header).encode('utf-8'), dtype=np.uint8)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+    logger.info('快照已保存: {}'.format(path))
+
+
+def load(path):
+    """读取快照，返回状态"""
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {key: data[key] for key in data.files}
+    header = json.loads(arrays.pop('__header__').tobytes().decode('utf-8'))
+    return _join(header, arrays)
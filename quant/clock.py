@@ -0,0 +1,87 @@
+# coding:utf-8
+import numpy as np
+import pandas as pd
+
+NS_PER_SECOND = 10 ** 9
+NS_PER_MINUTE = 60 * NS_PER_SECOND
+NS_PER_DAY = 86400 * NS_PER_SECOND
+
+# 行情数据中常见的时间格式，可直接用名称指定
+TIME_FORMATS = {
+    'daily': '%Y/%m/%d',
+    'minute': '%Y/%m/%d %H:%M',
+    'tick': '%Y/%m/%d %H:%M:%S.%f',
+}
+# 输出报告时使用的时间格式
+REPORT_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def parse_timestamps(values, date_format=None) -> np.ndarray:
+    """
+    将一列时间一次性（向量化）转换为 int64 的纳秒时间戳，
+    date_format 可以是 strptime 格式或 TIME_FORMATS 中的名称，
+    为 None 时表示 values 已经是纳秒时间戳
+    """
+    if date_format is None:
+        return np.asarray(values, dtype=np.int64)
+    date_format = TIME_FORMATS.get(date_format, date_format)
+    datetimes = pd.to_datetime(pd.Series(values), format=date_format)
+    return datetimes.values.astype('datetime64[ns]').astype(np.int64)
+
+
+def to_timestamp(value, date_format='%Y-%m-%d'):
+    """将单个时间（字符串、datetime 或时间戳）转换为纳秒时间戳，用于设置起止时间等"""
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        return int(parse_timestamps([value], date_format)[0])
+    return pd.Timestamp(value).value
+
+
+def to_datetime(timestamp):
+    """纳秒时间戳（单个或数组）转换为 pandas 时间类型，只在输出报告时调用"""
+    if np.ndim(timestamp) == 0:
+        return pd.Timestamp(np.datetime64(int(timestamp), 'ns'))
+    values = np.asarray(timestamp)
+    if values.dtype.kind in 'iu':
+        return pd.DatetimeIndex(values.astype(np.int64).astype('datetime64[ns]'))
+    return pd.DatetimeIndex(values)
+
+
+def to_str(timestamp, date_format=REPORT_FORMAT):
+    """纳秒时间戳转换为字符串，只在输出报告时调用"""
+    return to_datetime(timestamp).strftime(date_format)
+
+
+class Clock(object):
+    """
+    时钟，保存当前bar的int64纳秒时间戳，feed产生新行情时更新，
+    订单、成交和各数据序列都直接保存整数时间戳，只在输出报告时才转换为字符串或时间；
+    每个feed有自己的时钟（feed.clock），订单和成交取下单品种feed时钟的时间，
+    模块级的 clock 为引擎时钟，加载完一个时间片后为 feed_list 中最后一个feed的时间，账户的时间序列取该时间
+    """
+
+    def __init__(self):
+        self._time = None
+
+    def set_time(self, timestamp):
+        self._time = timestamp
+
+    def reset(self):
+        self._time = None
+
+    @property
+    def time(self):
+        return self._time
+
+    @property
+    def datetime(self):
+        return None if self._time is None else to_datetime(self._time)
+
+    def __str__(self):
+        return 'None' if self._time is None else to_str(self._time)
+
+
+clock = Clock()  # 各模块共用的引擎时钟
@@ -0,0 +1,188 @@
+# coding:utf-8
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from quant.barstore import BarStore, StoreDataReader
+from quant.clock import TIME_FORMATS, to_str, to_timestamp
+from quant.digest import file_digest
+from quant.feedbase import load_csv_columns
+from quant.logging_backtest import logger
+
+VERSION = 1
+PRICE_FIELDS = ('open', 'high', 'low', 'close')  # 需要复权调整的字段，成交量、持仓量等不调整
+SOURCE = 'continuous.json'  # 缓存目录中记录数据来源及换月信息的文件
+METHODS = ('ratio', 'difference', None)
+
+
+class ContinuousBuilder(object):
+    """
+    由各月合约拼接连续合约，并向后复权：最新一段为真实价格，之前各段按换月时新旧合约的价差调整；
+    contracts 为有序的 {合约: csv路径或列数据}，按到期顺序排列；
+    schedule 为换月表 [(时间, 合约), ...]，表示从该时间起使用该合约，第一项的时间可为None；
+    不给出 schedule 时按 rule 换月，rule 为 'volume'、'open_interest' 等字段名，
+    每根bar取该字段最大的合约，且只向后换月；
+    method 为 'ratio' 按比例调整，'difference' 按价差调整，None 为不调整直接拼接
+    """
+
+    def __init__(self, contracts, schedule=None, rule=None, method='ratio',
+                 date_format=TIME_FORMATS['daily'], price_fields=PRICE_FIELDS):
+        if method not in METHODS:
+            raise ValueError('method 须为 ratio、difference 或 None: {}'.format(method))
+        if schedule is None and rule is None:
+            raise ValueError('schedule 和 rule 至少给出一个')
+        self.contracts = OrderedDict(contracts)
+        self.schedule = schedule
+        self.rule = rule
+        self.method = method
+        self.date_format = date_format
+        self.price_fields = price_fields
+        self.rolls = None  # build 之后的换月记录
+
+    def load(self):
+        """读取各合约的列数据"""
+        data = OrderedDict()
+        for name, source in self.contracts.items():
+            data[name] = load_csv_columns(source, self.date_format) if isinstance(source, str) else source
+        return data
+
+    def key(self):
+        """数据来源的摘要：各合约的数据内容、换月表或规则及调整方法"""
+        sha1 = hashlib.sha1()
+        sha1.update(repr((VERSION, self.method, self.rule, self.date_format, self.price_fields)).encode())
+        if self.schedule is not None:
+            sha1.update(repr([(to_timestamp(t), c) for t, c in self.schedule]).encode())
+        for name, source in self.contracts.items():
+            sha1.update(name.encode())
+            if isinstance(source, str):
+                sha1.update(file_digest(source).encode())
+            else:
+                for field in sorted(source):
+                    sha1.update(field.encode())
+                    sha1.update(np.ascontiguousarray(source[field]).tobytes())
+        return sha1.hexdigest()
+
+    def roll_schedule(self, data):
+        """
+        换月表，返回 (times, index)：从 times[k] 起使用第 index[k] 个合约，times[0] 为最早的时间；
+        按 rule 换月时，在全部合约的时间轴上取每根bar该字段最大的合约，只向后换月，
+        该字段在bar结束时才知道，所以从下一根bar起才换到该合约，第一根bar用该bar最大的合约
+        """
+        names = list(data)
+        if self.schedule is not None:
+            times = np.array([np.iinfo(np.int64).min if t is None else to_timestamp(t)
+                              for t, _ in self.schedule], dtype=np.int64)
+            index = np.array([names.index(c) for _, c in self.schedule])
+            if np.any(times[1:] <= times[:-1]):
+                raise ValueError('换月表的时间须为升序')
+            return times, index
+        axis = np.unique(np.concatenate([columns['time'] for columns in data.values()]))
+        matrix = np.full((len(names), len(axis)), -np.inf)
+        for i, columns in enumerate(data.values()):
+            if self.rule not in columns:
+                raise ValueError('{} 没有 {} 列，无法按此换月'.format(names[i], self.rule))
+            values = np.asarray(columns[self.rule], dtype=np.float64)
+            matrix[i, np.searchsorted(axis, columns['time'])] = np.where(np.isnan(values), -np.inf, values)
+        active = np.maximum.accumulate(matrix.argmax(axis=0))  # 只向后换月
+        active = np.concatenate((active[:1], active[:-1]))  # 下一根bar起换月，不用当根bar的数据
+        change = np.concatenate(([0], np.flatnonzero(np.diff(active)) + 1))
+        return axis[change], active[change]
+
+    def build(self):
+        """
+        拼接并复权，返回列数据 {'time': int64数组, 'open': 数组, ...}，
+        换月记录保存在 self.rolls：[{'time', 'from', 'to', 'gap'}, ...]，gap 为比例或价差
+        """
+        data = self.load()
+        names = list(data)
+        fields = [i for i in data[names[0]] if i != 'time']
+        times, index = self.roll_schedule(data)
+        bounds = np.append(times, np.iinfo(np.int64).max)
+        segments = []  # 各段在所属合约中的行号范围
+        for k, i in enumerate(index):
+            columns = data[names[i]]
+            missing = [f for f in fields if f not in columns]
+            if missing:
+                raise ValueError('{} 缺少字段: {}'.format(names[i], missing))
+            start, stop = np.searchsorted(columns['time'], bounds[k:k + 2])
+            segments.append((i, start, stop))
+        segments = [s for s in segments if s[2] > s[1]]
+        if not segments:
+            raise ValueError('换月表范围内没有行情')
+
+        # 换月时新旧合约的价差：取旧合约最后一根bar的时间，新合约在该时间（或之前最近）的收盘价
+        gaps = []
+        self.rolls = []
+        for (old, _, old_stop), (new, new_start, _) in zip(segments[:-1], segments[1:]):
+            old_columns, new_columns = data[names[old]], data[names[new]]
+            time = old_columns['time'][old_stop - 1]
+            row = np.searchsorted(new_columns['time'], time, 'right') - 1
+            if row < 0:
+                raise ValueError('{} 在 {} 之前没有行情，无法计算换月价差'.format(names[new], to_str(time)))
+            old_close, new_close = old_columns['close'][old_stop - 1], new_columns['close'][row]
+            gap = new_close / old_close if self.method == 'ratio' else new_close - old_close
+            gaps.append(gap)
+            self.rolls.append(OrderedDict([('time', int(new_columns['time'][new_start])),
+                                           ('from', names[old]), ('to', names[new]),
+                                           ('gap', float(gap))]))
+
+        # 向后复权：每段的调整为其后各次换月的累计比例或价差，最后一段不调整
+        lengths = np.array([stop - start for _, start, stop in segments])
+        gaps = np.array(gaps + [1.0 if self.method == 'ratio' else 0.0])
+        if self.method == 'ratio':
+            adjustment = np.cumprod(gaps[::-1])[::-1]
+        else:
+            adjustment = np.cumsum(gaps[::-1])[::-1]
+        adjustment = np.repeat(adjustment, lengths)
+
+        result = OrderedDict()
+        for field in ['time'] + fields:
+            values = np.concatenate([np.asarray(data[names[i]][field][start:stop])
+                                     for i, start, stop in segments])
+            if self.method and field in self.price_fields:
+                values = values * adjustment if self.method == 'ratio' else values + adjustment
+            result[field] = values
+        logger.info('拼接连续合约: {} 段，{} 条行情，换月 {} 次'.format(
+            len(segments), len(result['time']), len(self.rolls)))
+        return result
+
+    def cached(self, store, instrument):
+        """
+        从BarStore中读取已拼接的连续合约，数据来源改变或尚未拼接时重新拼接并写入，
+        返回以memmap打开的列数据，换月记录保存在 self.rolls
+        """
+        store = store if isinstance(store, BarStore) else BarStore(store)
+        key = self.key()
+        path = os.path.join(store.path(instrument), SOURCE)
+        if instrument in store.instruments() and os.path.exists(path):
+            with open(path) as f:
+                source = json.load(f, object_pairs_hook=OrderedDict)
+            if source['key'] == key:
+                self.rolls = source['rolls']
+                return store.open(instrument)
+        store.write(instrument, self.build())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(OrderedDict([('key', key), ('rolls', self.rolls)]), f, indent=2)
+        os.replace(path + '.tmp', path)
+        return store.open(instrument)
+
+
+class ContinuousDataReader(StoreDataReader):
+    """
+    连续合约行情：第一次读取时由builder拼接并写入BarStore，之后直接以memmap读取，
+    合约文件、换月表或调整方法改变时自动重新拼接
+    """
+
+    def __init__(self, builder, store, instrument, startdate=None, enddate=None):
+        super().__init__(store, instrument, startdate, enddate)
+        self.builder = builder
+
+    def load_data(self):
+        return self.builder.cached(self.store, self.instrument)
+
+    @property
+    def rolls(self):
+        return self.builder.rolls
@@ -2,66 +2,124 @@
 import numpy as np
 import pandas as pd
 from quant.logging_backtest import logger
+from quant.clock import to_datetime
 
 
 class DataSeriesBase(object):
+    """
+    按instrument保存时间序列，日期和数值分两列（列表）储存，
+    未添加数据前，日期为 'start'，数值为初始值；
+    流式模式下内存中只保留最近的数据，较旧的写入磁盘，只能用负索引访问最近的数据，
+    list、date、df 等读取全部数据的属性用memmap读取已写入磁盘的部分
+    """
     _name = None  # 后面必须先设置名字
     _instrument = None
 
     def __init__(self):
-        self._dict = {}
+        self._dates = {}
+        self._values = {}
+        self._sums = {}  # 除最后一个数值外全部数值之和，含已写入磁盘的部分
+        self._spilled = {}  # 已写入磁盘的条数
+        self._spill = None
         self.old_date = None
 
     def __getitem__(self, key):
-        # print('self._instrument: {}'.format(self._instrument))
-        # print(key)
-        # print(self._name)
-        # logger.debug(
-        #     'self._dict[self._instrument][key][self._name]: {}'.format(
-        #         self._dict[self._instrument][key][self._name]))
-        return self._dict[self._instrument][key][self._name]
+        return self._values[self._instrument][key]
+
+    def __len__(self):
+        """当前instrument的总条数，含已写入磁盘的部分"""
+        return self._spilled.get(self._instrument, 0) + len(self._values[self._instrument])
+
+    def set_spill(self, store):
+        """流式模式：内存中只保留最近的部分，较旧的数据写入store"""
+        self._spill = store
 
     def initialize(self, instrument, initial):
-        self._dict[instrument] = [{'date': 'start', self._name: initial}]
+        self._dates[instrument] = ['start']
+        self._values[instrument] = [initial]
+        self._sums[instrument] = 0
+        self._spilled[instrument] = 0
 
     def set_instrument(self, instrument):
         self._instrument = instrument
 
     def add(self, date, value):
-        logger.debug('self.old_date, date in add dataseries: {} {}'.format(self.old_date, date))
         if self.old_date != date:
-            if self._dict[self._instrument][0]['date'] == 'start':
-                self._dict[self._instrument] = []
-            self._dict[self._instrument].append({'date': date, self._name: value})
-            # logger.debug('self._dict in dataseries: {}'.format(self._dict))
+            if self._dates[self._instrument][0] == 'start':
+                self._dates[self._instrument] = []
+                self._values[self._instrument] = []
+                self._sums[self._instrument] = 0
+            else:
+                self._sums[self._instrument] += self._values[self._instrument][-1]
+            self._dates[self._instrument].append(date)
+            self._values[self._instrument].append(value)
             self.old_date = date
+            self.__check_spill()
         else:
-            logger.debug('self.old_date, date in add dataseries: {} {}'.format(self.old_date, date))
             logger.debug('date in dataseries.add: {}'.format(date))
             logger.debug('value in add: {}'.format(value))
-            self._dict[self._instrument][-1][self._name] = value
+            self._values[self._instrument][-1] = value
+
+    def __check_spill(self):
+        """流式模式下，数据达到 store.limit 条时将 window 条之前的数据写入磁盘"""
+        if self._spill is None:
+            return
+        dates = self._dates[self._instrument]
+        if len(dates) < self._spill.limit:
+            return
+        n = len(dates) - self._spill.window
+        name = '{}.{}'.format(self._name, self._instrument)
+        self._spill.file(name + '.date', np.int64).append(dates[:n])
+        self._spill.file(name + '.value', np.float64).append(self._values[self._instrument][:n])
+        del dates[:n]
+        del self._values[self._instrument][:n]
+        self._spilled[self._instrument] += n
+
+    def history(self, instrument=None):
+        """instrument（默认为当前instrument）的全部日期（int64纳秒）和数值数组，还没有数据时为空数组"""
+        instrument = self._instrument if instrument is None else instrument
+        dates = self._dates[instrument]
+        if dates and dates[0] == 'start':
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+        dates = np.array(dates, dtype=np.int64)
+        values = np.array(self._values[instrument], dtype=np.float64)
+        if self._spilled.get(instrument):
+            name = '{}.{}'.format(self._name, instrument)
+            dates = np.concatenate([self._spill.file(name + '.date', np.int64).read(), dates])
+            values = np.concatenate([self._spill.file(name + '.value', np.float64).read(), values])
+        return dates, values
+
+    def __full(self, instrument):
+        """instrument的全部日期和数值列表，没有数据写入磁盘时为内存中的列表本身"""
+        if not self._spilled.get(instrument):
+            return self._dates[instrument], self._values[instrument]
+        dates, values = self.history(instrument)
+        return dates.tolist(), values.tolist()
 
     @property
     def dict(self):
-        return self._dict[self._instrument]
+        """[{'date': date, name: value}, ...]"""
+        dates, values = self.__full(self._instrument)
+        return [{'date': date, self._name: value} for date, value in zip(dates, values)]
 
     @property
     def keys(self):
-        return self._dict.keys()
+        return self._values.keys()
 
     @property
     def date(self):
-        return [i['date'] for i in self._dict[self._instrument]]
+        return self.__full(self._instrument)[0]
 
     @property
     def list(self):
-        return [i[self._name] for i in self._dict[self._instrument]]
+        return self.__full(self._instrument)[1]
 
     @property
     def df(self):  # 转换数据为DataFrame格式
-        df = pd.DataFrame(self._dict[self._instrument][:])  # 从 1 开始会少一个数
+        dates, values = self.__full(self._instrument)
+        df = pd.DataFrame({'date': dates, self._name: values})
         df.set_index('date', inplace=True)
-        df.index = pd.DatetimeIndex(df.index)
+        df.index = to_datetime(df.index.values)  # 纳秒时间戳只在此处转换为时间
         return df
 
     @property
@@ -74,28 +132,69 @@ class DataSeriesBase(object):
 
     @property
     def total_dict(self):
-        return self._dict
+        return {instrument: [{'date': date, self._name: value} for date, value in zip(
+            *self.__full(instrument))] for instrument in self._values}
 
     def plot(self):
         self.df.plot()
 
+    def get_date(self, key):
+        """当前instrument第key个日期，流式模式下只能用负索引"""
+        return self._dates[self._instrument][key]
+
     def del_last(self):  # 此处待测试
-        self._dict[self._instrument].pop(-2)
+        self._dates[self._instrument].pop(-2)
+        value = self._values[self._instrument].pop(-2)
+        self._sums[self._instrument] -= value
 
     def copy_last(self, new_date):  # 更新日期
         logger.debug('new_date in dataseries copy_last: {}'.format(new_date))
-        self._dict[self._instrument].append(self._dict[self._instrument][-1])
-        self._dict[self._instrument][-1]['date'] = new_date
+        self._sums[self._instrument] += self._values[self._instrument][-1]
+        self._dates[self._instrument].append(new_date)
+        self._values[self._instrument].append(self._values[self._instrument][-1])
+        self.__check_spill()
 
-    def total(self, key=-1, name=None):
+    def latest(self, instrument):
+        """instrument的最新数值"""
+        return self._values[instrument][-1]
+
+    def sum(self):
+        """当前instrument全部数值之和，含已写入磁盘的部分，用累计值计算，结果与 sum(self.list) 相同"""
+        return self._sums[self._instrument] + self._values[self._instrument][-1]
+
+    def total(self, key=-1):
         """全部instrument合起来的value"""
-        if name is None:
-            name = self._name
         value = 0
-        for i in self._dict.values():  # 多个self._instrument列表
-            value += i[key][name]
+        for i in self._values.values():  # 多个self._instrument列表
+            value += i[key]
         return value
 
+    def get_state(self):
+        """保存数据，日期和数值均转换为numpy数组"""
+        state = {'old_date': self.old_date, 'instrument': self._instrument, 'series': {}}
+        for instrument, dates in self._dates.items():
+            started = dates[0] != 'start'
+            state['series'][instrument] = {
+                'started': started,
+                'date': np.array(dates if started else [], dtype=np.int64),
+                'value': np.array(self._values[instrument]),
+            }
+        return state
+
+    def set_state(self, state):
+        """从get_state的结果恢复数据"""
+        self.old_date = state['old_date']
+        self._instrument = state['instrument']
+        for instrument, series in state['series'].items():
+            values = series['value'].tolist()
+            self._values[instrument] = values
+            self._sums[instrument] = sum(values[:-1])
+            self._spilled[instrument] = 0
+            if series['started']:
+                self._dates[instrument] = series['date'].tolist()
+            else:
+                self._dates[instrument] = ['start'] * len(values)
+
 
 class PositionSeries(DataSeriesBase):
     """仓位"""
@@ -0,0 +1,63 @@
+# coding:utf-8
+import hashlib
+import os
+
+import numpy as np
+
+_file_digests = {}  # {(路径, 大小, 修改时间): 摘要}，文件未改动时不重复读取
+
+
+def file_digest(path):
+    """文件内容的sha1，按 (路径, 大小, 修改时间) 缓存"""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if key not in _file_digests:
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        _file_digests[key] = sha1.hexdigest()
+    return _file_digests[key]
+
+
+def feed_digest(feed):
+    """
+    feed数据内容的摘要：有数据文件（csv、SQLite、BarStore）时对文件内容求摘要，
+    否则加载数据后对各列求摘要；起止时间等读取参数也计入
+    """
+    sha1 = hashlib.sha1()
+    sha1.update(repr((type(feed).__name__, feed.instrument, feed.startdate, feed.enddate,
+                      getattr(feed, 'date_format', None), getattr(feed, 'table', None),
+                      getattr(feed, 'preload_rows', None))).encode())
+    if hasattr(feed, 'datapath'):
+        paths = [feed.datapath]
+    elif hasattr(feed, 'store'):
+        directory = feed.store.path(feed.instrument)
+        paths = [os.path.join(directory, i) for i in sorted(os.listdir(directory))]
+    elif isinstance(getattr(feed, 'path', None), str):
+        paths = [feed.path]
+    else:
+        paths = None
+    if paths is not None:
+        for path in paths:
+            sha1.update(file_digest(path).encode())
+    elif hasattr(feed, 'load_once'):
+        feed.load_once()
+        for name, values in sorted(feed.columns.items()):
+            sha1.update(name.encode())
+            sha1.update(np.ascontiguousarray(values).tobytes())
+    else:
+        raise TypeError('{} 的数据无法计算摘要，不能缓存'.format(feed.instrument))
+    return sha1.hexdigest()
+
+
+def package_digest():
+    """quant 包全部源码的摘要，引擎代码改动后缓存的结果即失效"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    sha1 = hashlib.sha1()
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.py'):
+            sha1.update(name.encode())
+            sha1.update(file_digest(os.path.join(directory, name)).encode())
+    return sha1.hexdigest()
@@ -0,0 +1,414 @@
+# coding:utf-8
+import importlib
+import ipaddress
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from multiprocessing.managers import BaseManager
+
+import numpy as np
+import pandas as pd
+
+from quant.barstore import StoreDataReader
+from quant.context import Context
+from quant.digest import feed_digest
+from quant.feedbase import ColumnDataReader, CSVDataReader
+from quant.logging_backtest import logger
+from quant.main import Quant
+from quant.sink import NullSink
+from quant.sqlitedata import SQLiteDataReader
+from quant.walkforward import CONTEXT_FIELDS, param_grid, score
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+
+def strategy_reference(strategy):
+    """策略类（或feed读取器类）的引用 'module:Class'，工作进程据此导入，须定义在可导入的模块中"""
+    if isinstance(strategy, str):
+        return strategy
+    return '{}:{}'.format(strategy.__module__, strategy.__qualname__)
+
+
+def resolve_strategy(reference):
+    """由 'module:Class' 导入策略类或feed读取器类"""
+    module, _, name = reference.partition(':')
+    obj = importlib.import_module(module)
+    for attr in name.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def feed_spec(feed):
+    """
+    feed的读取参数：读取器类的引用、数据文件（csv、SQLite库或BarStore目录）的绝对路径、
+    品种、起止时间、读取选项及 resample 设置的周期 [[rule, offset], ...]，
+    工作进程据此在本地重建feed，任务中不传递数据；
+    其他主机上的工作进程须能以同一路径读取数据文件，不从文件读取的feed不能分发
+    """
+    if isinstance(feed, CSVDataReader):
+        path, options = feed.datapath, {'date_format': feed.date_format}
+    elif isinstance(feed, SQLiteDataReader):
+        path, options = feed.path, {'table': feed.table, 'date_format': feed.date_format,
+                                    'preload_rows': feed.preload_rows, 'batch_size': feed.batch_size}
+    elif type(feed) is StoreDataReader:
+        path, options = feed.store.root, {}
+    else:
+        raise TypeError('{} 的行情不是从文件读取的，不能分发给工作进程'.format(feed.instrument))
+    return OrderedDict([('reader', strategy_reference(type(feed))), ('path', os.path.abspath(path)),
+                        ('instrument', feed.instrument), ('startdate', feed.startdate),
+                        ('enddate', feed.enddate), ('options', options),
+                        ('timeframes', [[rule, i.offset] for rule, i in feed.timeframes.items()])])
+
+
+def build_feed(spec):
+    """由 feed_spec 重建feed，含合成的大周期"""
+    reader = resolve_strategy(spec['reader'])
+    feed = reader(spec['path'], spec['instrument'], spec['startdate'], spec['enddate'], **spec['options'])
+    for rule, offset in spec['timeframes']:
+        feed.resample(rule, offset)
+    return feed
+
+
+def make_jobs(context, grid, metric='equity'):
+    """
+    由模板context和参数网格生成任务，每个任务为可序列化的字典：
+    策略引用、参数、context参数、feed的读取参数及评分方式，数据由工作进程自行加载；
+    只支持单个feed的回测
+    """
+    if len(context.feed_list) != 1:
+        raise ValueError('分布式参数遍历只支持单个feed，当前有 {} 个'.format(len(context.feed_list)))
+    strategy = context.strategy[0] if isinstance(context.strategy, list) else context.strategy
+    settings = {name: getattr(context, name) for name in CONTEXT_FIELDS}
+    settings['start_date'] = context.start_date
+    settings['end_date'] = context.end_date
+    feed = context.feed_list[0]
+    settings['instrument'] = feed.instrument
+    spec = feed_spec(feed)
+    params_list = param_grid(grid) if isinstance(grid, dict) else list(grid)
+    return [OrderedDict([('id', i), ('strategy', strategy_reference(strategy)), ('params', params),
+                         ('settings', settings), ('feed', spec), ('metric', metric)])
+            for i, params in enumerate(params_list)]
+
+
+class Scheduler(object):
+    """
+    manager服务进程中的任务表，协调进程和各工作进程都通过代理访问；
+    工作进程领取任务时获得租约，定期心跳续约，租约过期（进程退出或失联）的任务重新排队，
+    任务出错时也重新排队，超过 retries 次后记为失败
+    """
+
+    def __init__(self, lease=30.0, retries=2):
+        self.lease = lease
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()  # {任务id: 任务}
+        self.state = OrderedDict()  # {任务id: {'status', 'worker', 'attempts', 'error'}}
+        self.queue = []  # 待执行的任务id
+        self.rows = OrderedDict()  # {任务id: 结果行}
+        self.seen = {}  # {工作进程: 最近一次心跳的时间}
+        self.closed = False
+
+    def add(self, jobs):
+        with self.lock:
+            for job in jobs:
+                self.jobs[job['id']] = job
+                self.state[job['id']] = {'status': PENDING, 'worker': None, 'attempts': 0, 'error': None}
+                self.queue.append(job['id'])
+
+    def take(self, worker):
+        """领取一个任务，暂时没有任务时返回None，全部完成后返回 'stop'"""
+        with self.lock:
+            self.seen[worker] = time.time()
+            self.__expire()
+            if self.closed or self.__finished():
+                return 'stop'
+            if not self.queue:
+                return None
+            job_id = self.queue.pop(0)
+            state = self.state[job_id]
+            state.update(status=RUNNING, worker=worker)
+            state['attempts'] += 1
+            return self.jobs[job_id]
+
+    def heartbeat(self, worker):
+        with self.lock:
+            self.seen[worker] = time.time()
+
+    def done(self, worker, job_id, row):
+        with self.lock:
+            state = self.state[job_id]
+            if state['status'] == RUNNING and state['worker'] == worker:
+                state['status'] = DONE
+                self.rows[job_id] = row
+
+    def fail(self, worker, job_id, error):
+        with self.lock:
+            state = self.state[job_id]
+            if state['status'] == RUNNING and state['worker'] == worker:
+                logger.warning('任务 {} 在 {} 上出错（第 {} 次）: {}'.format(
+                    job_id, worker, state['attempts'], error.strip().splitlines()[-1]))
+                self.__retry(job_id, error)
+
+    def lost(self, worker):
+        """已知退出的工作进程，其任务立即重新排队，不必等租约过期"""
+        with self.lock:
+            self.seen.pop(worker, None)
+            self.__expire()
+
+    def __expire(self):
+        """心跳超时的工作进程上的任务重新排队"""
+        now = time.time()
+        for job_id, state in self.state.items():
+            if state['status'] == RUNNING and now - self.seen.get(state['worker'], 0) > self.lease:
+                logger.warning('工作进程 {} 失联，任务 {} 重新排队'.format(state['worker'], job_id))
+                self.__retry(job_id, '工作进程 {} 失联'.format(state['worker']))
+
+    def __retry(self, job_id, error):
+        state = self.state[job_id]
+        state['error'] = error
+        if state['attempts'] > self.retries:
+            state['status'] = FAILED
+        else:
+            state['status'] = PENDING
+            state['worker'] = None
+            self.queue.append(job_id)
+
+    def __finished(self):
+        return all(i['status'] in (DONE, FAILED) for i in self.state.values())
+
+    def finished(self):
+        with self.lock:
+            self.__expire()
+            return self.__finished()
+
+    def close(self):
+        """通知工作进程退出"""
+        with self.lock:
+            self.closed = True
+
+    def progress(self):
+        """各状态的任务数"""
+        with self.lock:
+            counts = OrderedDict((i, 0) for i in (PENDING, RUNNING, DONE, FAILED))
+            for state in self.state.values():
+                counts[state['status']] += 1
+            return counts
+
+    def results(self):
+        """按任务id排列的结果行，失败的任务只有参数和错误信息"""
+        with self.lock:
+            rows = []
+            for job_id, state in self.state.items():
+                row = OrderedDict([('id', job_id)])
+                row.update(self.jobs[job_id]['params'])
+                row.update(self.rows.get(job_id, {}))
+                row['worker'] = state['worker']
+                row['attempts'] = state['attempts']
+                row['error'] = None if state['status'] == DONE else state['error']
+                rows.append(row)
+            return rows
+
+
+_scheduler = None  # manager服务进程中唯一的任务表
+
+
+def _init_scheduler(lease, retries):
+    """manager服务进程启动时创建任务表"""
+    global _scheduler
+    _scheduler = Scheduler(lease, retries)
+
+
+def _get_scheduler():
+    return _scheduler
+
+
+class _Manager(BaseManager):
+    pass
+
+
+_Manager.register('scheduler', callable=_get_scheduler)
+
+
+def is_loopback(host):
+    """host 是否只能从本机连接，'' 和 '0.0.0.0' 监听全部网卡，不算本机地址"""
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def connect(address, authkey):
+    """连接协调进程，返回Scheduler的代理"""
+    manager = _Manager(address=tuple(address), authkey=authkey)
+    manager.connect()
+    return manager.scheduler()
+
+
+class Worker(object):
+    """
+    工作进程：从协调进程领取任务并回测，返回简略的结果行；
+    由任务中的读取参数在本地重建feed，已加载的行情按数据文件内容的摘要缓存，同一数据的后续任务不再解析；
+    另开一个连接定期发送心跳，回测耗时超过租约时任务也不会被收回
+    """
+
+    def __init__(self, address, authkey, name=None, poll=0.2):
+        self.address = tuple(address)
+        self.authkey = authkey
+        self.name = name or '{}-{}'.format(socket.gethostname(), os.getpid())
+        self.poll = poll
+        self.columns = {}  # {feed摘要: 列数据}
+        self.stopped = threading.Event()
+
+    def load(self, feed):
+        """feed的列数据，摘要只读取数据文件，未缓存时才解析一次"""
+        key = feed_digest(feed)
+        if key not in self.columns:
+            self.columns[key] = feed.load_data()
+            logger.info('{} 加载 {} 的行情'.format(self.name, feed.instrument))
+        return self.columns[key]
+
+    def execute(self, job):
+        """执行一个任务，返回结果行"""
+        started = time.time()
+        settings = job['settings']
+        feed = build_feed(job['feed'])
+        context = Context()
+        for name, value in settings.items():
+            setattr(context, name, value)
+        data = ColumnDataReader(feed.instrument, feed.startdate, feed.enddate, columns=self.load(feed))
+        for rule, resampler in feed.timeframes.items():
+            data.resample(rule, resampler.offset)
+        context.feed_list = [data]
+        strategy = resolve_strategy(job['strategy'])
+        context.strategy = [type(strategy.__name__, (strategy,), dict(job['params']))]
+        quant = Quant(context)
+        quant.get_ready()
+        quant.set_result_sink(NullSink())
+        quant.run()
+        equity = np.array(quant.fill.equity.list, dtype=np.float64)
+        row = OrderedDict()
+        row['score'] = score(quant.fill, job['metric'])
+        row['final_equity'] = equity[-1]
+        row['max_drawdown'] = (np.maximum.accumulate(equity) - equity).max()
+        row['trades'] = len(quant.fill.completed_list)
+        row['seconds'] = round(time.time() - started, 3)
+        return row
+
+    def __heartbeat(self):
+        scheduler = connect(self.address, self.authkey)
+        while not self.stopped.wait(self.poll):
+            try:
+                scheduler.heartbeat(self.name)
+            except (EOFError, OSError):
+                return
+
+    def run(self):
+        """领取并执行任务，直到协调进程通知退出或连接断开"""
+        scheduler = connect(self.address, self.authkey)
+        thread = threading.Thread(target=self.__heartbeat, daemon=True)
+        thread.start()
+        try:
+            while True:
+                job = scheduler.take(self.name)
+                if job == 'stop':
+                    break
+                if job is None:
+                    time.sleep(self.poll)
+                    continue
+                try:
+                    row = self.execute(job)
+                except Exception:
+                    scheduler.fail(self.name, job['id'], traceback.format_exc())
+                else:
+                    scheduler.done(self.name, job['id'], row)
+        except (EOFError, OSError):
+            logger.info('{} 与协调进程的连接已断开'.format(self.name))
+        finally:
+            self.stopped.set()
+
+
+def run_worker(address, authkey, name=None):
+    """工作进程的入口，远程主机上以协调进程的地址和 authkey 调用"""
+    Worker(address, authkey, name).run()
+
+
+class DistributedSweep(object):
+    """
+    多主机的参数遍历：协调进程在 address 上启动manager服务进程保存任务表，工作进程连接后领取任务；
+    workers 为在本机启动的工作进程数，其他主机上调用 run_worker(address, authkey) 加入，
+    本机启动的工作进程意外退出时重新启动，共超过 respawns 次（默认为 workers × (retries + 1)）时停止遍历；
+    任务出错或工作进程失联时重试 retries 次；
+    authkey 为连接时验证的密钥，不指定时随机生成，此时只能监听本机地址
+    """
+
+    def __init__(self, context, grid, metric='equity', address=('127.0.0.1', 0), authkey=None,
+                 workers=None, lease=30.0, retries=2, timeout=None, respawns=None):
+        if authkey is None:
+            if not is_loopback(address[0]):
+                raise ValueError('监听非本机地址 {} 时须指定 authkey'.format(address[0]))
+            authkey = os.urandom(32)
+        self.jobs = make_jobs(context, grid, metric)
+        self.address = address
+        self.authkey = authkey
+        self.workers = multiprocessing.cpu_count() if workers is None else workers
+        self.lease = lease
+        self.retries = retries
+        self.timeout = timeout
+        self.respawns = self.workers * (retries + 1) if respawns is None else respawns
+        self.spawned = 0  # 已启动的本机工作进程数，用于命名
+        self.results = None  # 每组参数一行，pd.DataFrame
+
+    def __serve(self):
+        """启动manager服务进程，返回manager和任务表的代理"""
+        manager = _Manager(address=self.address, authkey=self.authkey)
+        manager.start(_init_scheduler, (self.lease, self.retries))
+        self.address = manager.address
+        logger.info('参数遍历协调进程监听 {}，共 {} 个任务'.format(self.address, len(self.jobs)))
+        return manager, manager.scheduler()
+
+    def __spawn(self):
+        name = 'local-{}'.format(self.spawned)
+        self.spawned += 1
+        process = multiprocessing.Process(target=run_worker, args=(self.address, self.authkey, name))
+        process.daemon = True
+        process.start()
+        return name, process
+
+    def run(self):
+        manager, scheduler = self.__serve()
+        processes = []
+        try:
+            scheduler.add(self.jobs)
+            processes = [self.__spawn() for _ in range(self.workers)]
+            started = time.time()
+            while not scheduler.finished():
+                if self.timeout is not None and time.time() - started > self.timeout:
+                    raise RuntimeError('参数遍历超时，进度: {}'.format(dict(scheduler.progress())))
+                for i, (name, process) in enumerate(processes):
+                    if not process.is_alive():
+                        scheduler.lost(name)
+                        if self.spawned - self.workers >= self.respawns:
+                            raise RuntimeError('本机工作进程已重新启动 {} 次，仍然退出（{}），进度: {}'.format(
+                                self.respawns, process.exitcode, dict(scheduler.progress())))
+                        logger.warning('本机工作进程 {} 已退出（{}），重新启动'.format(name, process.exitcode))
+                        processes[i] = self.__spawn()
+                time.sleep(0.1)
+            rows = scheduler.results()
+        finally:
+            scheduler.close()
+            for _, process in processes:
+                process.join(5)
+                if process.is_alive():
+                    process.terminate()
+            manager.shutdown()
+        self.results = pd.DataFrame(rows)
+        return self
+
+    def best(self):
+        """评分最高的一行"""
+        done = self.results[self.results['error'].isnull()]
+        return done.loc[done['score'].idxmax()]
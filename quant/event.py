@@ -163,13 +163,21 @@ class EventBase(object):
 class MarketEvent(object):
     """
     市场信息事件，该事件会被传给Strategy
+    timeframe为None时是基础周期的行情；否则为feed.resample合成的大周期，
+    此时bar为该周期已完成的bar，cur_bar仍为基础周期的当前行情，用于下单成交
     """
-    def __init__(self, feed):
+    def __init__(self, feed, timeframe=None):
         self.type = 'Market'
         self.feed = feed
+        self.timeframe = timeframe
         self.instrument = feed.instrument
         self.cur_bar = feed.cur_bar
-        self.bar = feed.bar
+        if timeframe is None:
+            self.bar = feed.bar
+            self.preload_bar_list = feed.preload_bar_list
+        else:
+            self.bar = feed.timeframes[timeframe].bar
+            self.preload_bar_list = []
         # logger.debug('self.bar.open[:] in event: {}'.format(self.bar.open[:]))
         self.per_comm = feed.per_comm
         self.per_margin = feed.per_margin
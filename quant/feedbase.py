@@ -1,11 +1,15 @@
 # coding=utf-8
+import io
 from abc import ABC, abstractmethod
-from datetime import datetime
-import csv
+import numpy as np
+import pandas as pd
 from quant.barbase import Current_bar, Bar
+from quant.resample import Resampler
 from quant.event import events, MarketEvent
 from quant.logging_backtest import logger
 from quant.context import Context
+from quant.indicator import IndicatorCache, PrecomputedIndicators
+from quant.clock import TIME_FORMATS, Clock, clock, parse_timestamps, to_timestamp
 
 
 class DataHandler(ABC):
@@ -20,6 +24,10 @@ class DataHandler(ABC):
         self.bar = Bar(instrument)
         self.preload_bar_list = []
         self.continue_backtest = True
+        self.clock = Clock()  # 本feed的时钟，本品种的订单和成交取其时间
+        self.timeframes = {}  # 合成的大周期，{rule: Resampler}
+        self.indicator_cache = IndicatorCache()  # 本feed上各策略共用的指标缓存
+        self.precomputed = PrecomputedIndicators()  # 回测前预计算的指标
 
         self._per_comm = None
         self._per_margin = None
@@ -147,10 +155,33 @@ class DataHandler(ABC):
     def load_once(self):  # 加载一次，使cur_bar缓存数据
         self._iteration_data = self.load_data()
 
-    def __update_bar(self):  # 更新bar
+    def resample(self, rule, offset=None):
+        """
+        增加一个由本feed合成的大周期，如 '5min'、'30min'、'1D'，
+        offset 为周期划分的偏移，如夜盘品种日线可设为 '-3h'，
+        返回该周期的Bar，每当一条大周期bar完成时会产生 timeframe=rule 的MarketEvent
+        """
+        if rule not in self.timeframes:
+            self.timeframes[rule] = Resampler(self.instrument, rule, offset)
+        return self.timeframes[rule].bar
+
+    def __update_bar(self):  # 更新bar，并拨动本feed的时钟和引擎时钟
+        self.clock.set_time(self.cur_bar.cur_date)
+        clock.set_time(self.clock.time)
         self.bar.set_instrument(self.instrument)
         self.bar.add_new_bar(self.cur_bar.cur_data)
 
+    def __update_timeframes(self):
+        """用新bar更新各大周期，完成的大周期bar先于基础周期发出MarketEvent，行情结束时发出未完成的bar"""
+        market_event = Context().MarketEvent
+        for rule, resampler in self.timeframes.items():
+            if self.continue_backtest:
+                completed = resampler.update(self.cur_bar.cur_data)
+            else:
+                completed = resampler.flush()
+            if completed is not None:
+                events.put(market_event(self, timeframe=rule))
+
     def start(self):
         pass
 
@@ -163,134 +194,246 @@ class DataHandler(ABC):
         #     self.skipped = True
         #     return
         self.__update_bar()
+        if self.timeframes:
+            self.__update_timeframes()
         market_event = Context().MarketEvent
         events.put(market_event(self))
         logger.debug('---------------------feedbase.next--------------------')
 
 
-class CSVDataReader(DataHandler):
-    """识别csv数据中的数据，包括date、open、high、low、close"""
-    date_format = '%Y-%m-%d %H:%M:%S'
+class ColumnDataReader(DataHandler):
+    """
+    以列的形式（numpy数组）保存全部行情，time列为int64的纳秒时间戳，其余为float，
+    用游标逐条产生new_bar，回测循环中不再做任何时间解析
+    """
 
-    def __init__(self, datapath, instrument, startdate=None, enddate=None):
+    def __init__(self, instrument, startdate=None, enddate=None, columns=None):
         super().__init__(instrument, startdate, enddate)
-
-        self.datapath = datapath
+        self._columns = columns
+        self._fields = []
+        self._start = 0  # 起始时间对应的行号
+        self._stop = 0  # 结束时间之后的第一行
+        self._cursor = 0  # 下一条new_bar的行号
+        self._base = 0  # 第0行在完整数据中的行号，只加载了新增部分时不为0
         self.__set_date()
 
     def __set_date(self):
-        """将输入的日期转换成datetime对象"""
-        if self.startdate:
-            # logger.debug('self.startdate: {}'.format(self.startdate))  # 转换前
-            self.startdate = datetime.strptime(self.startdate, "%Y-%m-%d")
-            logger.debug('self.startdate: {}'.format(self.startdate))  # 转换后
-        if self.enddate:
-            # logger.debug('self.enddate: {}'.format(self.enddate))  # 转换前
-            self.enddate = datetime.strptime(self.enddate, "%Y-%m-%d")
-            logger.debug("self.enddate: {}".format(self.enddate))  # 转换后
-
-    def __set_bar_date(self, bar):
-        """将bar中的time识别为日期格式"""
-        date = bar['time']  #time
-        # logger.debug('date: {}'.format(date))
-        return datetime.strptime(str(date), self.date_format).strftime(
-            self.date_format)
+        """将输入的日期转换成纳秒时间戳"""
+        self.startdate = to_timestamp(self.startdate)
+        self.enddate = to_timestamp(self.enddate)
+        logger.debug('self.startdate, self.enddate: {} {}'.format(
+            self.startdate, self.enddate))
+
+    def _set_range(self):
+        """根据起止时间，用二分查找确定回测数据的行号范围"""
+        self._fields = [i for i in self._columns if i != 'time']
+        self._start, self._stop = search_range(self._columns['time'], self.startdate, self.enddate)
+        self._cursor = self._start
+
+    def _make_bar(self, row):
+        """将第row行数据组装成bar"""
+        bar = {'time': int(self._columns['time'][row])}
+        for name in self._fields:
+            value = self._columns[name][row]
+            bar[name] = float(value) if isinstance(value, np.floating) else value
+        return bar
+
+    def load_data(self):
+        """返回列数据 {'time': int64数组, 'open': float数组, ...}，子类可重写以从其他来源读取"""
+        return self._columns
+
+    def load_once(self):
+        if self._iteration_data is None:
+            self._columns = self.load_data()
+            self._iteration_data = self._columns
+            self._set_range()
+
     def get_new_bar(self):
-        def __update():
-            new_bar = next(self._iteration_data)  # 获取迭代数据的下一组数据
-            new_bar['time'] = self.__set_bar_date(new_bar)
-            # time.sleep(5)
-            # 将new_bar中的OHLC等数值转换为float
-            for i in new_bar:
-                try:
-                    new_bar[i] = float(new_bar[i])
-                except ValueError:
-                    pass
-            # logger.debug('new_bar: {}'.format(new_bar))
-            return new_bar
-
-        try:
-            # logger.info('---self.skipped---: {}'.format(self.skipped))
-            # if not self.skipped:
-            #     self.skipped = True
-            new_bar = __update()
-            new_bar_date = datetime.strptime(new_bar['time'], self.date_format)
-            logger.debug('---new_bar_date---: {}'.format(new_bar_date))
-            # 根据输入的日期判断数据的范围，从起始时间开始，不断产生new_bar，到结束时间为止
-            if self.startdate:
-                # logger.debug("new_bar['time']: {}".format(new_bar['time']))
-                # if new_bar_date == self.startdate:
-                #     logger.info('---startdate in feedbase---: {}'.format(new_bar_date))
-                #     self.cur_bar.add_new_bar(new_bar)
-                while new_bar_date < self.startdate:
-                    new_bar = __update()
-                    new_bar_date = datetime.strptime(new_bar['time'], self.date_format)
-                    # logger.debug('self.enddate: {}'.format(self.enddate))
-                    logger.debug('---new_bar_date---: {}'.format(new_bar_date))
-
-            if self.enddate:
-                while new_bar_date > self.enddate:
-                    raise StopIteration
-            logger.debug('new_bar_date in feedbase: {}'.format(new_bar_date))
-            self.cur_bar.add_new_bar(new_bar)
-
-        except StopIteration:
+        if self._cursor >= self._stop:
             self.continue_backtest = False
+            return
+        new_bar = self._make_bar(self._cursor)
+        self._cursor += 1
+        logger.debug('new_bar in feedbase: {}'.format(new_bar))
+        self.cur_bar.add_new_bar(new_bar)
 
-    def load_data(self):
+    def preload(self):
+        """缓存起始时间之前的数据，按时间倒序排列"""
+        self.load_once()
+        self.preload_bar_list = [
+            self._make_bar(i) for i in range(self._start - 1, -1, -1)]
+
+    def get_state(self):
+        """保存游标、bar历史及合成的大周期，游标为在完整数据中的行号"""
+        return {
+            'instrument': self.instrument,
+            'cursor': self._base + self._cursor,
+            'continue_backtest': self.continue_backtest,
+            'bar': self.bar.get_state(),
+            'timeframes': {rule: i.get_state() for rule, i in self.timeframes.items()},
+        }
+
+    def set_state(self, state):
+        """恢复到get_state时的位置，须先load_once，且数据须与保存时一致"""
+        self.load_once()
+        self.bar.set_instrument(self.instrument)
+        self.bar.set_state(state['bar'])
+        data = self.bar.data
+        if data:
+            row = state['cursor'] - self._base - 1  # 小于0时该行不在已加载的数据中，由子类检查
+            if row >= len(self._columns['time']) or (
+                    row >= 0 and self._columns['time'][row] != data[-1]['time']):
+                raise ValueError('{} 的数据与快照不一致'.format(self.instrument))
+            self.cur_bar.add_new_bar(data[-1])
+            self.clock.set_time(data[-1]['time'])
+        self._cursor = state['cursor'] - self._base
+        self.continue_backtest = state['continue_backtest']
+        for rule, resampler_state in state['timeframes'].items():
+            self.resample(rule)
+            self.timeframes[rule].set_state(resampler_state)
+
+    def full_columns(self):
         """
-        产生一个OrderedDict，第一行作为filedname，即OHLC
-        每次调用产生一个新的OrderedDict
-        OrderedDict([('time', '2017/5/27 1:32:00'),
-                     ('open', '222.2'), ('high', '333.3'),
-                     ('low', '111.1'), ('close', '230.4')])
+        预计算指标用的数据列，返回 (columns, begin, offset)，
+        begin 为第一根回测bar所在的行，offset 为 self.cursor 与行号的差；
+        与逐条计算的指标一样从第一根回测bar开始，不使用起始时间之前的数据预热，
+        增量回测只加载了新增部分时，将bar中已有的数据拼接在前面
         """
-        return csv.DictReader(open(self.datapath))
+        if not self._base:
+            columns = {name: values[self._start:] for name, values in self._columns.items()}
+            return columns, 0, -self._start
+        self.bar.set_instrument(self.instrument)
+        history = len(self.bar.time)
+        columns = {name: np.concatenate([self.bar.get_column(name).array, values])
+                   for name, values in self._columns.items()}
+        return columns, 0, history
 
-    def preload(self):
-        self.set_iteration_buffer(self.load_data())
-
-        def _update():
-            bar = next(self._iteration_buffer)  # 每次读取一组数据
-            logger.debug('bar: {}'.format(bar))
-            bar['time'] = self.__set_bar_date(bar)
-
-            for i in bar:
-                try:
-                    bar[i] = float(bar[i])
-                except ValueError:
-                    pass
-            return bar
-
-        try:
-            bar = _update()
-            self.preload_bar_list.append(bar)  # 添加第一个数据
-            self.preload_bar_list.append(bar)  # 添加第一个数据
-            logger.debug('barr: {}'.format(bar))
-            new_bar_date = datetime.strptime(bar['time'],
-                                             self.date_format)
-            if self.startdate:
-                while new_bar_date < self.startdate:
-                    bar = _update()
-                    self.preload_bar_list.append(bar)
-                # else:
-                    # self.preload_bar_list.pop(-1)  # 经过验证bug检查的，最后删除掉一个重复(暂未证实)
-
-            elif self.startdate is None:
-                pass
-            else:
-                raise SyntaxError("语法错误")
+    @property
+    def columns(self):
+        return self._columns
 
-        except IndexError:
-            pass
+    @property
+    def exhausted(self):
+        """数据已全部产生，下一次get_new_bar将结束回测"""
+        return self._cursor >= self._stop
 
-        except StopIteration:
-            logger.debug("不可能的")
+    @property
+    def cursor(self):
+        return self._cursor
+
+
+def search_range(time, startdate=None, enddate=None):
+    """用二分查找确定 [startdate, enddate] 在升序的time列中的行号范围 [start, stop)"""
+    start, stop = 0, len(time)
+    if startdate is not None:
+        start = int(time.searchsorted(to_timestamp(startdate), 'left'))
+    if enddate is not None:
+        stop = int(time.searchsorted(to_timestamp(enddate), 'right'))
+    return start, stop
+
+
+def load_csv_columns(datapath, date_format=None):
+    """
+    一次性读取csv并向量化解析time列，返回列数据：
+    {'time': int64纳秒时间戳数组, 'open': float数组, ...}
+    date_format为None时，time列须为纳秒时间戳
+    """
+    df = pd.read_csv(datapath)
+    columns = {'time': parse_timestamps(df['time'].values, date_format)}
+    for name in df.columns:
+        if name == 'time':
+            continue
+        values = df[name].values
+        if values.dtype.kind in 'iuf':
+            values = values.astype(np.float64)
+        columns[name] = values
+    return columns
+
+
+class CSVDataReader(ColumnDataReader):
+    """
+    识别csv数据中的数据，包括time、open、high、low、close，
+    date_format可以是strptime格式或'daily'/'minute'/'tick'，为None时time列为纳秒时间戳
+    """
+    date_format = '%Y-%m-%d %H:%M:%S'
 
-        self.preload_bar_list.reverse()
+    def __init__(self, datapath, instrument, startdate=None, enddate=None,
+                 date_format=''):
+        super().__init__(instrument, startdate, enddate)
+        self.datapath = datapath
+        self._source = None  # 已读取文件的信息，见__set_source
+        if date_format != '':
+            self.date_format = date_format
 
+    def load_data(self):
+        with open(self.datapath, 'rb') as f:
+            content = f.read()
+        columns = load_csv_columns(io.BytesIO(content), self.date_format)
+        self.__set_source(content, len(columns['time']), content[:content.find(b'\n') + 1])
+        return columns
 
+    def __set_source(self, content, rows, header):
+        """
+        记录已读取的文件大小、行数、表头和最后一行，
+        用于增量回测时判断文件是否只是在末尾追加了新行
+        """
+        last_line = content[content.rstrip(b'\r\n').rfind(b'\n') + 1:]
+        self._source = {'size': len(content), 'rows': rows,
+                        'header': np.frombuffer(header, dtype=np.uint8),
+                        'last_line': np.frombuffer(last_line, dtype=np.uint8)}
+
+    def __load_tail(self, state):
+        """
+        快照保存于数据末尾，且文件只是在末尾追加了新行时，只读取并解析新增的行，
+        成功时返回True，否则返回False，由调用者重新读取整个文件
+        """
+        source = state.get('source')
+        if source is None or state['cursor'] != source['rows']:
+            return False
+        last_line = source['last_line'].tobytes()
+        with open(self.datapath, 'rb') as f:
+            f.seek(source['size'] - len(last_line))
+            if f.read(len(last_line)) != last_line:
+                return False
+            tail = f.read()
+        header = source['header'].tobytes()
+        columns = load_csv_columns(io.BytesIO(header + tail), self.date_format)
+        rows = len(columns['time'])
+        if rows and state['bar']['columns']['time'][-1] >= columns['time'][0]:
+            return False
+        logger.info('{} 增量读取新增行情 {} 条'.format(self.instrument, rows))
+        self._columns = columns
+        self._iteration_data = columns
+        self._set_range()
+        self._base = source['rows']
+        if rows:
+            self.__set_source(last_line + tail, source['rows'] + rows, header)
+            self._source['size'] += source['size'] - len(last_line)
+        else:
+            self._source = source
+        return True
+
+    def get_state(self):
+        state = super().get_state()
+        state['source'] = self._source
+        return state
+
+    def set_state(self, state):
+        if not self.__load_tail(state):
+            self.load_once()
+        super().set_state(state)
 
 
 class CSV(CSVDataReader):
-    date_format = '%Y/%m/%d'
+    """日线数据，如 2013/1/4"""
+    date_format = TIME_FORMATS['daily']
+
+
+class MinuteCSV(CSVDataReader):
+    """分钟数据，如 2017/5/27 9:31"""
+    date_format = TIME_FORMATS['minute']
+
+
+class TickCSV(CSVDataReader):
+    """tick数据，如 2017/5/27 9:31:02.500"""
+    date_format = TIME_FORMATS['tick']
@@ -3,47 +3,225 @@ import talib
 import numpy as np
 from copy import copy, deepcopy
 from quant.logging_backtest import logger
-from collections import deque
+from collections import deque, OrderedDict
+
+
+class IndicatorCache(object):
+    """
+    指标缓存，每个feed一个，同一feed上的多个策略、多个账户共用；
+    键为 (instrument, 周期, 指标名, 参数)，值记录计算时的bar序号，
+    bar序号相同时直接返回，bar前进后旧值失效，下次访问时被新值替换，
+    hits、misses 为命中和未命中的次数
+    """
+
+    def __init__(self):
+        self._data = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, bar_index, func, *args):
+        """取得 key 在第 bar_index 根bar上的值，没有时调用 func(*args) 计算并保存"""
+        entry = self._data.get(key)
+        if entry is not None and entry[0] == bar_index:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value = func(*args)
+        self._data[key] = (bar_index, value)
+        return value
+
+    def clear(self):
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """命中次数、未命中次数和命中率"""
+        results = OrderedDict()
+        results['命中'] = self.hits
+        results['未命中'] = self.misses
+        total = self.hits + self.misses
+        results['命中率'] = round(self.hits / total, 4) if total else 0
+        return results
+
+
+def sma_array(columns, period):
+    """收盘价的简单移动平均，与 Indicator.SMA 相同"""
+    return talib.SMA(columns['close'], period)
+
+
+def atr_array(columns, period):
+    """平均真实波幅，真实波幅的算法与 Indicator.average_true_range 相同"""
+    high, low, open = columns['high'], columns['low'], columns['open']
+    true_range = np.full(len(high), np.nan)
+    last_open = open[:-1]
+    true_range[1:] = np.maximum(high[1:] - low[1:], np.maximum(high[1:] - last_open, last_open - low[1:]))
+    return talib.SMA(true_range, period)
+
+
+def max_high_array(columns, period, index=0):
+    """period 个周期内的最高价，index 为 1 时不含当前周期，与 Indicator.max_high 相同"""
+    values = talib.MAX(columns['high'], period)
+    return shift(values, index)
+
+
+def min_low_array(columns, period, index=0):
+    """period 个周期内的最低价，index 为 1 时不含当前周期，与 Indicator.min_low 相同"""
+    values = talib.MIN(columns['low'], period)
+    return shift(values, index)
+
+
+def shift(values, n):
+    """整体后移 n 个周期，前面补nan"""
+    if not n:
+        return values
+    shifted = np.full(len(values), np.nan)
+    shifted[n:] = values[:-n]
+    return shifted
+
+
+# 可预计算的指标，{名称: func(columns, *params)}，返回与columns等长的数组
+VECTORIZED = {
+    'SMA': sma_array,
+    'ATR': atr_array,
+    'max_high': max_high_array,
+    'min_low': min_low_array,
+}
+
+
+class IndicatorCursor(object):
+    """
+    预计算指标的游标，只暴露当前bar及之前的值，索引方式与bar的数据列相同：
+    [-1] 为当前bar，[-2] 为上一根bar，[t] 为第 t 根回测bar，切片返回只读视图；
+    单个值为nan（数据不足）时 raise Warning，与 Indicator.SMA 相同
+    """
+
+    def __init__(self, values, feed, begin, offset):
+        self._values = values
+        self._feed = feed
+        self._begin = begin  # 第一根回测bar在values中的位置
+        self._offset = offset  # feed.cursor 与values中位置的差
+
+    def __len__(self):
+        return max(self._feed.cursor + self._offset - self._begin, 0)
+
+    def __getitem__(self, item):
+        data = self.array[item]
+        if isinstance(data, np.ndarray):
+            return data
+        if np.isnan(data):
+            raise Warning
+        return data
+
+    def __repr__(self):
+        return repr(self.array)
+
+    @property
+    def array(self):
+        """第一根回测bar到当前bar的只读视图"""
+        data = self._values[self._begin:self._feed.cursor + self._offset]
+        data.flags.writeable = False
+        return data
+
+
+class PrecomputedIndicators(object):
+    """
+    预计算的指标，每个feed一个，回测开始前对feed的全部数据一次性计算，
+    同一feed上参数相同的指标只计算一次，各策略、各账户共用，
+    回测中通过IndicatorCursor读取，不会读到当前bar之后的数据
+    """
+
+    def __init__(self):
+        self._values = {}  # {(指标名, 参数): 数组}
+        self._cursors = {}  # {策略类: {名称: IndicatorCursor}}
+
+    def add(self, strategy, feed):
+        """计算strategy.precompute中声明的指标，strategy 为策略类"""
+        columns, begin, offset = feed.full_columns()
+        cursors = OrderedDict()
+        for name, spec in strategy.precompute.items():
+            func, params = spec[0], tuple(spec[1:])
+            key = (func, params)
+            if key not in self._values:
+                if not callable(func):
+                    if func not in VECTORIZED:
+                        raise ValueError('无法预计算指标 {}，可选 {}'.format(func, list(VECTORIZED)))
+                    func = VECTORIZED[func]
+                values = np.asarray(func(columns, *params), dtype=np.float64)
+                if len(values) != len(columns['time']):
+                    raise ValueError('预计算指标 {} 的长度与数据不一致'.format(name))
+                values.flags.writeable = False
+                self._values[key] = values
+            cursors[name] = IndicatorCursor(self._values[key], feed, begin, offset)
+        self._cursors[strategy] = cursors
+
+    def get(self, strategy):
+        """strategy 的全部游标，{名称: IndicatorCursor}"""
+        return self._cursors.get(strategy, {})
+
+    def clear(self):
+        self._values.clear()
+        self._cursors.clear()
+
+    def __len__(self):
+        return len(self._values)
+
+
+def check_window(column, period):
+    """流式模式下，用到的bar数超过内存中保留的条数时报错，而不是当作数据不足"""
+    if column.window is not None and period > column.window:
+        raise ValueError('需要 {} 条bar，超过流式模式保留的 {} 条，请增大 lookback'.format(
+            period, column.window))
 
 
 class IndicatorBase(object):
-    """指标基类"""
+    """指标基类，直接读取bar中的数据列，不再复制bar"""
 
     def __init__(self, market_event):
         self.market_event = market_event
-        self.preload_bar_list = []
         self.instrument = market_event.instrument
         self.iteration_buffer = market_event.feed.iteration_buffer
-        # 备份bar中的数据，格式为[{'date', 'open', 'high', 'low', 'close'}, {}, ...]
-        self.bar_list = copy(market_event.bar.data)
-        self.bar_list2 = copy(self.bar_list)
-        self.preload_bar_list = market_event.feed.preload_bar_list
+        self.preload_bar_list = market_event.preload_bar_list
+        self.cache = market_event.feed.indicator_cache
+
+    def cached(self, name, func, *args):
+        """通过缓存计算指标，同一根bar上相同参数的指标只计算一次"""
+        key = (self.instrument, self.market_event.timeframe, name, args)
+        bar_index = self.market_event.bar.get_column('time').count  # 流式模式下len不再增长
+        return self.cache.get(key, bar_index, func, *args)
+
+    @property
+    def bar_list(self):
+        """bar中的数据，格式为[{'time', 'open', 'high', 'low', 'close'}, {}, ...]"""
+        return self.market_event.bar.data
 
     def get_preload(self, period, index, ohlc='close'):
         """
-        将preload插入到bar_dict前，然后根据当前时间点动态
+        将preload插入到bar数据前，然后根据当前时间点动态
         获取固定长度(|-period+index|)的数据
         """
-        preload = self.preload_bar_list[:period]
-        self.bar_list = copy(self.bar_list2)
-        for i in preload:
-            self.bar_list.insert(0, i)
-
-        data = [i[ohlc] for i in self.bar_list][-period + index:]
-        return np.array(data)
+        column = self.market_event.bar.get_column(ohlc)
+        start = -period + index
+        check_window(column, -start)
+        if start < 0 and len(column) >= -start:
+            return column[start:]
+        preload = [i[ohlc] for i in reversed(self.preload_bar_list[:period])]
+        return np.concatenate([np.array(preload, dtype=np.float64), column[:]])[start:]
 
     def get_basic_data(self, period, ohlc='close'):
         """
         获取基础的数据，如 open, high, low, close 等，
-        最后取得一个列表，长度为period，
+        最后取得一个numpy数组（只读视图），长度为period，
         period为 1 表示当前bar的数据
         """
-        if len(self.bar_list) < period:
+        column = self.market_event.bar.get_column(ohlc)
+        check_window(column, period)
+        if len(column) < period:
             raise IndexError
-        data_list = self.bar_list[-period:]
-        logger.debug('len(data_list): {}'.format(len(data_list)))
-        data = [i[ohlc] for i in data_list]
-        return np.array(data)
+        return column[-period:]
 
 
 class Indicator(IndicatorBase):
@@ -55,13 +233,15 @@ class Indicator(IndicatorBase):
         self.fill = market_event.fill
 
     def simple_moving_average(self, period, index=-1):
+        sma = self.cached('SMA', self.__simple_moving_average, period, index)
+        if np.isnan(sma):
+            raise Warning
+        return sma
+
+    def __simple_moving_average(self, period, index):
         close = self.get_preload(period, index, 'close')
-        logger.debug('---close in sma---: {}'.format(close))
         sma_close = talib.SMA(close, period)  # 返回array，period个数前计算会得到nan，需处理
-        if np.isnan(sma_close[index]):
-            raise Warning
-        else:
-            return sma_close[index]
+        return sma_close[index]
 
     def open(self, period=1):
         open = self.get_basic_data(period, ohlc='open')
@@ -88,6 +268,9 @@ class Indicator(IndicatorBase):
 
     def average_true_range(self, period: int) -> float:
         """period个周期内的平均真实波幅，一般称为ATR"""
+        return self.cached('ATR', self.__average_true_range, period)
+
+    def __average_true_range(self, period):
         if not isinstance(period, int):
             logger.info('period must be int, please input int')
         high = self.high(period)  # type：numpy.ndarray，可以直接进行列表计算
@@ -120,7 +303,9 @@ class Indicator(IndicatorBase):
         index 为 1 表示 period 日前到昨日的最高价，也是 period 个周期内的最高价，
         index 是为比较函数 cross_up 和 cross_down 设置的
         """
-        logger.debug('period, index : {} {}'.format(period, index))
+        return self.cached('max_high', self.__max_high, period, index)
+
+    def __max_high(self, period, index):
         if index not in [0, 1]:
             logger.warning('index must be 0 or 1, please choose the right index')
             logger.info('index set to 0 by default')
@@ -139,6 +324,9 @@ class Indicator(IndicatorBase):
         +2 是因为要与上一个 index 的周期相同，便于比较，
         用于计算 cross up 和 cross down
         """
+        return self.cached('min_low', self.__min_low, period, index)
+
+    def __min_low(self, period, index):
         if index not in [0, 1]:
             logger.warning('index must be 0 or 1, please choose the right index')
             logger.info('index set to 0 by default')
@@ -254,9 +442,9 @@ class Indicators(IndicatorBase):
         period为2，获取前一天的数据，以此类推
         返回一个数
         """
-        if self.field is 'money':
+        if self.field == 'money':
             data = self.fill.equity[-1]['equity']
-        elif self.field is 'unit':
+        elif self.field == 'unit':
             data = self.field.units
         else:
             data = self.get_basic_data(self.period, ohlc=self.field)[0]
@@ -422,7 +610,7 @@ class Evaluate(object):
 
     def get_func(self):
         for key, value in self.data_dict.items():
-            if value is 'func':
+            if value == 'func':
                 self.func_list.append(value)
 
     def evaluate(self):
@@ -486,9 +674,9 @@ class FindMaxPeriod(object):
 
     def find(self, dic):
         for key, value in dic.items():
-            if key is 'func':
+            if key == 'func':
                 pass
-            if key is 'arg':  # value 是一个列表
+            if key == 'arg':  # value 是一个列表
                 # logger.debug('lenth of value: {}'.format(value))
                 for i in value:
                     logger.debug('i:', i)
@@ -0,0 +1,240 @@
+# coding:utf-8
+import asyncio
+import time
+from collections import OrderedDict
+from copy import copy
+
+import numpy as np
+
+from quant.broker import Broker
+from quant.clock import to_timestamp
+from quant.context import Context
+from quant.event import events
+from quant.feedbase import DataHandler
+from quant.logging_backtest import logger
+
+FIELDS = ('time', 'open', 'high', 'low', 'close')
+
+fill_event = Context().FillEvent
+
+
+class AsyncDataHandler(DataHandler):
+    """
+    从TCP连接异步接收行情，每行一条bar或tick，csv格式，字段顺序由fields给出，
+    date_format为None时time为纳秒时间戳；接收在后台任务中进行，
+    收到的bar放入最多maxsize条的缓冲队列，主循环用 wait_bar 等待下一条bar，
+    连接断开即行情结束
+    """
+
+    def __init__(self, instrument, host='127.0.0.1', port=None, fields=FIELDS,
+                 date_format=None, maxsize=10000):
+        super().__init__(instrument, None, None)
+        self.host = host
+        self.port = port
+        self.fields = fields
+        self.date_format = date_format
+        self.maxsize = maxsize
+        self.received_time = None  # 当前bar收到时的 time.perf_counter()
+        self._queue = None
+        self._next = None  # 已收到、尚未加载的 (bar, 收到时间)
+        self._closed = False
+        self._writer = None
+        self._task = None
+
+    async def connect(self):
+        """连接行情服务器，开始在后台接收行情"""
+        self._queue = asyncio.Queue(self.maxsize)
+        reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._task = asyncio.ensure_future(self.__receive(reader))
+        logger.info('{} 已连接行情服务器 {}:{}'.format(self.instrument, self.host, self.port))
+
+    def parse(self, line):
+        """将一行csv解析为bar"""
+        bar = {}
+        for name, value in zip(self.fields, line.decode('utf-8').rstrip('\r\n').split(',')):
+            if name != 'time':
+                bar[name] = float(value)
+            elif self.date_format is None:
+                bar[name] = int(value)
+            else:
+                bar[name] = to_timestamp(value, self.date_format)
+        return bar
+
+    async def __receive(self, reader):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    await self._queue.put((self.parse(line), time.perf_counter()))
+        except ConnectionError as e:
+            logger.info('{} 行情连接断开: {}'.format(self.instrument, e))
+        await self._queue.put(None)  # 行情结束
+
+    async def wait_bar(self):
+        """等待下一条bar到达，行情结束时直接返回"""
+        if self._next is None and not self._closed:
+            item = await self._queue.get()
+            if item is None:
+                self._closed = True
+            else:
+                self._next = item
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+    def load_data(self):
+        return None
+
+    def get_new_bar(self):
+        if self._next is None:
+            self.continue_backtest = False
+            return
+        new_bar, self.received_time = self._next
+        self._next = None
+        logger.debug('new_bar in live: {}'.format(new_bar))
+        self.cur_bar.add_new_bar(new_bar)
+
+    def preload(self):
+        self.preload_bar_list = []
+
+    @property
+    def exhausted(self):
+        """行情已结束且没有未加载的bar"""
+        return self._closed and self._next is None
+
+
+class AsyncPaperBroker(Broker):
+    """
+    模拟交易的broker，订单提交后不立即成交：
+    经过 ack_latency 秒后订单被确认，之后每隔 fill_latency 秒成交一部分，
+    成交在其到达时的bar上记账，
+    市价单每次最多成交 max_fill_lots 手（None 为一次全部成交），其余订单一次成交；
+    成交回报由事件循环按时放入事件队列，主循环不会因此阻塞
+    """
+
+    def __init__(self, ack_latency=0.001, fill_latency=0.001, max_fill_lots=None):
+        super().__init__()
+        self.ack_latency = ack_latency
+        self.fill_latency = fill_latency
+        self.max_fill_lots = max_fill_lots
+        self._pending = 0  # 还未全部成交的订单数
+
+    def submit_order(self):
+        """提交订单，确认和成交均延迟进行"""
+        self._pending += 1
+        asyncio.get_event_loop().call_later(
+            self.ack_latency, self.__accept, self.order_event.order)
+
+    def __split(self, order):
+        """市价单按 max_fill_lots 拆分为多次成交的手数"""
+        lots = order.lots
+        if order.execute_type != 'MARKET' or not self.max_fill_lots or lots <= self.max_fill_lots:
+            return [lots]
+        parts = [self.max_fill_lots] * int(lots // self.max_fill_lots)
+        if lots % self.max_fill_lots:
+            parts.append(lots % self.max_fill_lots)
+        return parts
+
+    def __accept(self, order):
+        order.set_status('ACCEPTED')
+        parts = self.__split(order)
+        loop = asyncio.get_event_loop()
+        for i, lots in enumerate(parts):
+            loop.call_later(self.fill_latency * (i + 1), self.__fill, order, lots, len(parts) > 1,
+                            i == len(parts) - 1)
+
+    def __fill(self, order, lots, partial, last):
+        """
+        发出一次成交回报，成交价为下单时的价格，日期为成交时的当前bar，
+        部分成交时用订单的副本，原订单状态为 PARTIAL
+        """
+        order.set_date(order.feed.clock.time)
+        if partial:
+            part = copy(order)
+            part.set_lots(lots)
+            part.set_status('FILLED')
+            order.set_status('FILLED' if last else 'PARTIAL')
+        else:
+            part = order
+            order.set_status('PENDING' if order.execute_type in ['LIMIT', 'STOP'] else 'FILLED')
+        events.put(fill_event(part))
+        if last:
+            self._pending -= 1
+
+    def execute(self):
+        self.submit_order()
+        self.notify()
+
+    async def join(self):
+        """等待已提交的订单全部成交"""
+        while self._pending:
+            await asyncio.sleep(self.fill_latency)
+
+    @property
+    def pending(self):
+        return self._pending
+
+
+class LatencyStats(object):
+    """记录延迟（秒），统计次数、均值、分位数和最大值（毫秒）"""
+
+    def __init__(self):
+        self._values = []
+
+    def record(self, seconds):
+        self._values.append(seconds)
+
+    def __len__(self):
+        return len(self._values)
+
+    def summary(self, percentiles=(50, 90, 99)):
+        values = np.array(self._values) * 1000
+        results = OrderedDict()
+        results['次数'] = len(values)
+        if len(values):
+            results['平均(ms)'] = round(float(values.mean()), 3)
+            for p, value in zip(percentiles, np.percentile(values, percentiles)):
+                results['p{}(ms)'.format(p)] = round(float(value), 3)
+            results['最大(ms)'] = round(float(values.max()), 3)
+        return results
+
+
+class ReplayServer(object):
+    """
+    本地行情回放服务器，用于测试：客户端连接后，将列数据逐行以csv格式发送，发送完毕后断开；
+    每次发送batch行，interval为每批之间的间隔秒数，0为尽快发送
+    """
+
+    def __init__(self, columns, fields=FIELDS, host='127.0.0.1', port=0, batch=100, interval=0):
+        self.host = host
+        self.port = port
+        self.batch = batch
+        self.interval = interval
+        text = [np.asarray(columns[name]).astype(str) for name in fields]
+        self._lines = [(','.join(row) + '\n').encode('utf-8') for row in zip(*text)]
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self.__handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info('行情回放服务器已启动: {}:{}'.format(self.host, self.port))
+
+    async def __handle(self, reader, writer):
+        try:
+            for i in range(0, len(self._lines), self.batch):
+                writer.write(b''.join(self._lines[i:i + self.batch]))
+                await writer.drain()
+                if self.interval:
+                    await asyncio.sleep(self.interval)
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
@@ -1,9 +1,14 @@
 # coding:utf-8
+import asyncio
+import os
 import queue
-from collections import OrderedDict
+import time
+from bisect import bisect_right
+from collections import OrderedDict, deque
 
 import pandas as pd
 
+from quant.account import Account
 from quant.analysis import (create_drawdowns, create_sharpe_ratio, create_trade_log,
                             stats)
 from quant.backtestfill import BacktestFill
@@ -13,23 +18,99 @@ from quant.dict_to_table import dict_to_table
 from quant.event import events
 from quant.logging_backtest import logger
 from quant import plotter
+from quant import checkpoint
 from datetime import datetime
 from quant.portfolio import Portfolio
+from quant.clock import clock, to_datetime, to_str
+from quant.live import AsyncPaperBroker, LatencyStats
+from quant.sink import DirectorySink
+from quant.spill import SpillStore
 # from quant.context import Context
 
-date = datetime.now().strftime('%Y-%m-%d-%H-%M')
 # context = Context()
 
 
 class Quant(object):
     def __init__(self, context):
         self.feed_list = []
-        self.strategy_list = []
         self.bar = None
-        self.portfolio = None
-        self.broker = None
-        self.fill = None
+        self.account = Account('default')  # 当前处理的账户，strategy_list、portfolio、broker、fill 均属于它
+        self.accounts = OrderedDict([(self.account.name, self.account)])
+        self._account_index = 0  # 当前时间片中正在处理的账户序号
+        self._market_events = []  # 当前时间片的行情事件，多账户时依次交给各账户
         self.context = context
+        self._checkpoint_path = None
+        self._checkpoint_every = None
+        self._checkpoint_count = 0
+        self._resume_path = None
+        self._resume_date = None  # 恢复快照时最后一条行情的时间
+        self._final_checkpoint_path = None
+        self.latency = None  # run_async 中行情到策略运行完毕的延迟
+        self._streaming = None  # 流式模式的 (目录, 内存中保留的条数, 每次写入磁盘的条数)
+        self.sink = DirectorySink()  # 回测结果的输出目标，默认写入当前目录
+
+    @property
+    def strategy_list(self):
+        return self.account.strategy_list
+
+    @property
+    def portfolio(self):
+        return self.account.portfolio
+
+    @portfolio.setter
+    def portfolio(self, value):
+        self.account.portfolio = value
+
+    @property
+    def broker(self):
+        return self.account.broker
+
+    @broker.setter
+    def broker(self, value):
+        self.account.broker = value
+
+    @property
+    def fill(self):
+        return self.account.fill
+
+    @fill.setter
+    def fill(self, value):
+        self.account.fill = value
+
+    def add_account(self, name, strategy_list, initial_cash=None, broker=None):
+        """
+        增加一个账户，在 get_ready 之后调用，各账户共用行情、bar和指标，
+        资金、仓位和交易记录互不影响，一次遍历行情即可回测多个策略；
+        portfolio、broker、fill 与默认账户同类，initial_cash 默认与默认账户相同，
+        默认账户没有策略时不参与回测；
+        回测结束后各账户的结果以 '{账户名}_results' 等名字输出，汇总见 get_accounts_summary
+        """
+        if name in self.accounts:
+            raise ValueError('账户已存在: {}'.format(name))
+        if not isinstance(strategy_list, list):
+            strategy_list = [strategy_list]
+        fill = type(self.fill)()
+        fill.set_cash(self.fill.initial_cash if initial_cash is None else initial_cash)
+        account = Account(name, strategy_list, fill, type(self.portfolio)(),
+                          broker or type(self.broker)())
+        self.accounts[name] = account
+        return account
+
+    def set_account(self, name):
+        """切换当前账户，回测结束后用于查看各账户的 fill、get_analysis、plot 等"""
+        self.account = self.accounts[name]
+        self.context.fill = self.fill
+        self.portfolio.fill = self.fill
+        self.broker.fill = self.fill
+
+    def get_accounts_summary(self):
+        """各账户的简略结果，每个账户一行"""
+        return pd.DataFrame([account.results for account in self.accounts.values()],
+                            index=list(self.accounts))
+
+    def get_indicator_cache_stats(self):
+        """各feed指标缓存的命中次数、未命中次数和命中率"""
+        return OrderedDict((feed.instrument, feed.indicator_cache.stats()) for feed in self.feed_list)
 
     def get_ready(self):
         """准备数据，设置参数"""
@@ -54,74 +135,222 @@ class Quant(object):
         while True:
             try:
                 event = events.get(False)  # 当 queue 为空时，raise queue.Empty
-                logger.debug('events.qsize(): {}'.format(events.qsize()))
             except queue.Empty:
-                self.__load_all_feed()  # 加载新行情
-                logger.debug('self.__check_backtest_finished(): {}'.format(
-                    self.__check_backtest_finished()))
-                if not self.__check_backtest_finished():
-                    # cur_bar中数据不足两条，不开始计算
-                    if len(self.feed_list[-1].cur_bar._cur_bar_list) < 1:
-                        # logger.debug('events.qsize(): {}'.format(events.qsize()))
-                        continue
-                    else:
-                        self.__update_time_index()  # 更新基本信息
-                        logger.debug('self.feed_list[-1].cur_bar.cur_date: {}'.format(
-                            self.feed_list[-1].cur_bar.cur_date))
-                        self.__check_pending_order()  # 检查订单是否成交
-
+                # 本时间片的信号、订单处理完毕，合并信号、检查资金后发出
+                if not (self.portfolio.flush() or self.broker.flush()):
+                    self.__next_bar()
             else:
-                if event.type == 'Market':
-                    self.context.market_event.append(event)
-                    self.__pass_to_market(event)  # 传递账户基本信息
-
-                    for strategy in self.strategy_list:
-                        strategy(event).run_strategy()
-
-                elif event.type == 'Signal':
-                    self.context.signal_event.append(event)
-                    self.portfolio.run_portfolio(event)
-
-                elif event.type == 'Order':
-                    self.context.order_event.append(event)
-                    self.broker.run_broker(event)
+                self.__dispatch(event)
+                if self.__check_backtest_finished():
+                    self.__output_accounts()
+                    break
 
-                elif event.type == 'Fill':
-                    self.context.fill_event.append(event)
-                    self.fill.run_fill(event)
+    async def run_async(self):
+        """
+        异步主循环，feed 须为 live.AsyncDataHandler，broker 可用 set_broker 换成 live.AsyncPaperBroker；
+        等待行情和成交回报时不阻塞事件循环，收到行情后策略照常同步运行，
+        每条行情从收到到策略运行完毕的延迟记录在 self.latency 中
+        """
+        self.latency = LatencyStats()
+        await asyncio.gather(*[feed.connect() for feed in self.feed_list])
+        self.__initialization()
 
+        while True:
+            try:
+                event = events.get(False)
+            except queue.Empty:
+                # 本时间片的信号、订单处理完毕，合并信号、检查资金后发出
+                if self.portfolio.flush() or self.broker.flush():
+                    continue
+                await asyncio.sleep(0)  # 让出事件循环，使接收行情、发出成交回报的任务得以运行
+                if events.empty():
+                    await asyncio.gather(*[feed.wait_bar() for feed in self.feed_list])
+                    if all(feed.exhausted for feed in self.feed_list) and isinstance(
+                            self.broker, AsyncPaperBroker):
+                        await self.broker.join()  # 行情结束前，等待已提交订单全部成交
+                if events.empty():  # 等待期间到达的成交回报先于新行情处理
+                    self.__next_bar()
+            else:
+                self.__dispatch(event)
+                if event.type == 'Market' and event.timeframe is None and event.feed.continue_backtest:
+                    self.latency.record(time.perf_counter() - event.feed.received_time)
                 if self.__check_backtest_finished():
-                    self.__output_summary()
+                    self.__output_accounts()
                     break
+        for feed in self.feed_list:
+            feed.close()
+
+    def __next_bar(self):
+        """
+        事件队列为空时，保存快照并加载新行情，更新账户信息，检查挂单；
+        多账户时，同一时间片的行情依次交给各账户处理，全部处理完才加载新行情，已爆仓的账户跳过
+        """
+        index = self.__next_account(self._account_index + 1)
+        if index is not None:
+            self.__switch_account(index)
+            return
+        if (self._checkpoint_every and
+                self.context.count - self._checkpoint_count >= self._checkpoint_every):
+            self.save_checkpoint()  # 事件处理完毕，状态完整，保存快照
+        if self._final_checkpoint_path and all(feed.exhausted for feed in self.feed_list):
+            self.save_checkpoint(self._final_checkpoint_path)  # 行情全部处理完毕，保存结束时的状态
+        self.__load_all_feed()  # 加载新行情
+        if len(self.accounts) > 1:
+            self._market_events = []
+            while not events.empty():
+                self._market_events.append(events.get(False))
+            self.context.market_event.extend(self._market_events)
+            self.__switch_account(self.__next_account(0))
+        else:
+            self.__update_account()
+
+    def __next_account(self, start):
+        """从第start个账户起，第一个未结束的账户序号，没有时返回None"""
+        for index, account in enumerate(list(self.accounts.values())[start:], start):
+            if not account.finished:
+                return index
+        return None
+
+    def __switch_account(self, index):
+        """切换到第index个账户，将本时间片的行情交给它处理"""
+        self._account_index = index
+        self.set_account(list(self.accounts)[index])
+        for event in self._market_events:
+            events.put(event)
+        self.__update_account()
+
+    def __update_account(self):
+        """根据新行情更新当前账户的信息，检查挂单，爆仓时结束该账户"""
+        if not self.__check_backtest_finished():
+            # cur_bar中数据不足两条，不开始计算
+            if len(self.feed_list[-1].cur_bar._cur_bar_list) >= 1:
+                self.__update_time_index()  # 更新基本信息
+                self.__check_pending_order()  # 检查订单是否成交
+                if self.fill.bankrupt:
+                    self.__finish_account()
+
+    def __finish_account(self):
+        """
+        当前账户爆仓，与单独回测时一样，该账户的记录到本条行情为止；
+        全部账户都已结束时停止回测，否则丢弃本时间片交给该账户的行情，其余账户继续
+        """
+        self.account.finished = True
+        if all(account.finished for account in self.accounts.values()):
+            for feed in self.feed_list:
+                feed.continue_backtest = False
+        else:
+            while not events.empty():
+                events.get(False)
+            logger.info('账户 {} 已爆仓，其余账户继续回测'.format(self.account.name))
+
+    def __dispatch(self, event):
+        """将事件交给对应的模块处理"""
+        if event.type == 'Market':
+            if len(self.accounts) == 1:  # 多账户时在加载行情时记录
+                self.context.market_event.append(event)
+            self.__pass_to_market(event)  # 传递账户基本信息
+
+            for strategy in self.strategy_list:
+                if event.timeframe in strategy.timeframes:
+                    strategy(event).run_strategy()
+
+        elif event.type == 'Signal':
+            self.context.signal_event.append(event)
+            self.portfolio.run_portfolio(event)
+
+        elif event.type == 'Order':
+            self.context.order_event.append(event)
+            self.broker.run_broker(event)
+
+        elif event.type == 'Fill':
+            self.context.fill_event.append(event)
+            self.fill.run_fill(event)
 
     def __initialization(self):
         """对所有 feed 和 fill 内各项数据进行初始化"""
         logger.debug('feed_list in main initialization: {}'.format(self.feed_list))
+        while not events.empty():  # 清除上一次回测残留的事件，同一进程中可多次回测
+            events.get(False)
+        clock.reset()
         for feed in self.feed_list:
-            feed.load_once()
-            instrument = feed.instrument
-            self.fill.position.initialize(instrument, 0)
-            self.fill.margin.initialize(instrument, 0)
-            self.fill.commission.initialize(instrument, 0)
-            self.fill.long_commission.initialize(instrument, 0)
-            self.fill.short_commission.initialize(instrument, 0)
-            self.fill.avg_price.initialize(instrument, 0)
-            self.fill.unrealized_gain_and_loss.initialize(instrument, 0)
-            self.fill.realized_gain_and_loss.initialize(instrument, 0)
-            self.fill.long_realized_gain_and_loss.initialize(instrument, 0)
-            self.fill.short_realized_gain_and_loss.initialize(instrument, 0)
-        self.fill.cash.initialize('all', self.fill.initial_cash)
-        self.fill.equity.initialize('all', self.fill.initial_cash)
+            feed.clock.reset()
+        if len(self.accounts) > 1 and not self.accounts['default'].strategy_list:
+            del self.accounts['default']  # 只使用 add_account 增加的账户
+        if len(self.accounts) > 1 and (
+                self._checkpoint_path or self._resume_path or self._final_checkpoint_path):
+            raise ValueError('多账户回测不支持快照')
+        if self._streaming:
+            self.__set_streaming()
+        for feed in self.feed_list:
+            if not self._resume_path:
+                feed.load_once()  # 从快照恢复时由feed.set_state加载，csv可只读取新增的行
+            feed.indicator_cache.clear()
+        for account in self.accounts.values():
+            account.finished = False
+            self.__initialize_fill(account.fill)
+        self.set_account(list(self.accounts)[0])
+        self._account_index = len(self.accounts) - 1  # 第一次 __next_bar 时加载行情
+        if self._resume_path:
+            checkpoint.set_state(self, checkpoint.load(self._resume_path))
+            self._checkpoint_count = self.context.count
+            self._resume_date = self.fill.equity.date[-1]
+            logger.info('从快照恢复: {}, K 线数: {}'.format(self._resume_path, self.context.count))
+        self.__precompute_indicators()
 
         self.__combine_all_feed()
 
+    def __precompute_indicators(self):
+        """回测开始前，对各feed的全部数据一次性计算策略声明的指标"""
+        strategies = [strategy for account in self.accounts.values()
+                      for strategy in account.strategy_list if strategy.precompute]
+        for feed in self.feed_list:
+            feed.precomputed.clear()
+            if strategies and not hasattr(feed, 'full_columns'):
+                raise TypeError('{} 的数据不能预先取得，无法预计算指标'.format(feed.instrument))
+            for strategy in strategies:
+                feed.precomputed.add(strategy, feed)
+
+    def __set_streaming(self):
+        """流式模式下，bar和各账户的数据超过保留条数后写入磁盘，事件记录只保留最近的部分"""
+        if self._checkpoint_path or self._resume_path or self._final_checkpoint_path:
+            raise ValueError('流式模式不支持快照')
+        directory, lookback, chunk = self._streaming
+        window = max([lookback or 0, 2] + [strategy.lookback for account in self.accounts.values()
+                                           for strategy in account.strategy_list])
+        store = SpillStore(directory, window, chunk)
+        for feed in self.feed_list:
+            feed.bar.set_spill(store.child('bar'))
+        for account in self.accounts.values():
+            account.fill.set_spill(store.child(account.name))
+        for name in ('market_event', 'signal_event', 'order_event', 'fill_event'):
+            setattr(self.context, name, deque(maxlen=window))
+        logger.info('流式模式: {}, 内存中保留 {} 条'.format(directory, window))
+
+    def __initialize_fill(self, fill):
+        """初始化fill中各品种的数据"""
+        for feed in self.feed_list:
+            instrument = feed.instrument
+            fill.position.initialize(instrument, 0)
+            fill.margin.initialize(instrument, 0)
+            fill.commission.initialize(instrument, 0)
+            fill.long_commission.initialize(instrument, 0)
+            fill.short_commission.initialize(instrument, 0)
+            fill.avg_price.initialize(instrument, 0)
+            fill.unrealized_gain_and_loss.initialize(instrument, 0)
+            fill.realized_gain_and_loss.initialize(instrument, 0)
+            fill.long_realized_gain_and_loss.initialize(instrument, 0)
+            fill.short_realized_gain_and_loss.initialize(instrument, 0)
+        fill.cash.initialize('all', fill.initial_cash)
+        fill.equity.initialize('all', fill.initial_cash)
+        fill.bankrupt = False
+
     def __combine_all_feed(self):
         """只运行一次，创建一个空Bar，然后将所有feed都整合到一起"""
         self.bar = Bar('')
         self.bar._initialize()
         for feed in self.feed_list:
             logger.debug('feed.bar.total_dict in main: {}'.format(feed.bar.total_dict))
-            self.bar._combine_all_feed(feed.bar.total_dict)
+            self.bar._combine_all_feed(feed.bar)
 
     def __load_all_feed(self):
         """加载新行情"""
@@ -134,17 +363,17 @@ class Quant(object):
     def __update_time_index(self):
         """每次更新行情后，根据新行情更新仓位、现金、保证金等账户基本信息"""
         self.fill.update_time_index(self.feed_list)
-        logger.debug('len(self.feed_list) in main: {}'.format(len(self.feed_list)))
-        logger.debug('self.feed_list in main: {}'.format(self.feed_list))
         date_dict = {}
         if len(self.feed_list) > 1:
             for index, feed in enumerate(self.feed_list):
-                date_dict[str(index)] = feed.cur_bar.cur_date
+                date_dict[str(index)] = feed.clock.time
                 if self.feed_list.count(feed) > 1:
                     raise SyntaxError('行情中出现了相同的日期，数据有误')
 
     def __check_pending_order(self):
         """检查止盈、止损、移动止损、挂单是否成交"""
+        if self.fill.idle():
+            return
         for feed in self.feed_list:
             self.fill.check_trade_list(feed)
             self.fill.check_order_list(feed)
@@ -166,9 +395,9 @@ class Quant(object):
             self.feed_list.append(data)
 
     def __add_strategy(self, strategy_list):
-        """添加策略到列表"""
+        """添加策略到默认账户"""
         for strategy in strategy_list:
-            self.strategy_list.append(strategy)
+            self.accounts['default'].strategy_list.append(strategy)
 
     def __set_portfolio(self, portfolio):
         """添加处理信号模块"""
@@ -178,6 +407,10 @@ class Quant(object):
         """添加确认信号模块"""
         self.broker = broker()
 
+    def set_broker(self, broker):
+        """替换确认信号模块，broker 为实例，如 live.AsyncPaperBroker(max_fill_lots=1)"""
+        self.broker = broker
+
     def __set_fill(self, fill):
         """添加交易记录模块"""
         self.fill = fill()
@@ -221,6 +454,76 @@ class Quant(object):
         self.set_trailing_stop_price('open')
         self.set_buffer(10)
 
+    def set_result_sink(self, sink):
+        """
+        设置回测结果的输出目标，如 sink.DirectorySink('results', formats={'equity': 'pickle'})、
+        sink.MemorySink()、sink.NullSink()
+        """
+        self.sink = sink
+
+    def set_checkpoint(self, path, every=None):
+        """
+        设置快照路径，every 为每隔多少条 K 线自动保存一次快照，
+        path 中可包含 {count}，用 K 线数区分不同的快照
+        """
+        self._checkpoint_path = path
+        self._checkpoint_every = every
+
+    def save_checkpoint(self, path=None):
+        """保存快照，须在事件队列为空时调用，如回测结束后或两条行情之间"""
+        if not events.empty():
+            raise RuntimeError('事件队列不为空，无法保存快照')
+        path = path or self._checkpoint_path
+        checkpoint.save(self, path.format(count=self.context.count))
+        self._checkpoint_count = self.context.count
+
+    def set_streaming(self, directory, lookback=None, chunk=4096):
+        """
+        流式模式：bar、账户数据和事件记录在内存中只保留最近的部分，回测占用的内存不随K线数增长，
+        较旧的bar和账户数据只追加写入 directory 下的文件，输出结果、作图时用memmap读取；
+        lookback 为内存中至少保留的条数，默认取各策略 lookback 的最大值，
+        策略用到的历史数据不能超过它，不支持快照；chunk 为每次写入磁盘的最少条数
+        """
+        self._streaming = (directory, lookback, chunk)
+
+    def resume(self, path):
+        """从快照继续回测，在 get_ready 之后、run 之前调用，feed 和策略须与保存快照时相同"""
+        self._resume_path = path
+
+    def run_incremental(self, path):
+        """
+        每日增量回测：path 为回测结束时的快照，存在时从快照恢复，只回测数据中新增的行情，
+        不存在时完整回测一次；结束后更新快照，返回本次新增行情的简要报告
+        """
+        if os.path.exists(path):
+            self.resume(path)
+        self._final_checkpoint_path = path
+        self.run()
+        return self.get_incremental_summary()
+
+    def get_incremental_summary(self):
+        """从快照恢复以来新增行情的简要报告：K线数、权益变化、当前持仓及新成交"""
+        dates = self.fill.equity.date
+        values = self.fill.equity.list
+        start = 0
+        if dates[0] == 'start':  # 还没有行情
+            start = len(dates)
+        elif isinstance(self._resume_date, int):
+            start = bisect_right(dates, self._resume_date)
+        results = OrderedDict()
+        results['新增K线数'] = len(dates) - start
+        if start < len(dates):
+            results['新增开始时间'] = to_str(dates[start])
+            results['新增结束时间'] = to_str(dates[-1])
+        results['最新权益'] = round(float(values[-1]), 2)
+        results['权益变化'] = round(float(values[-1] - (values[start - 1] if start else self.fill.initial_cash)), 2)
+        for feed in self.feed_list:
+            results['{} 持仓'.format(feed.instrument)] = self.fill.position.latest(feed.instrument)
+        results['新信号数'] = len(self.context.signal_event)
+        results['新成交数'] = len(self.context.fill_event)
+        logger.info('增量回测报告: {}'.format(results))
+        return results
+
     def set_commission(self, commission, margin, units, lots, slippage, instrument=None):
         """
         设置手续费、保证金、合约单位及合约品种等参数
@@ -246,6 +549,20 @@ class Quant(object):
         """设置交易提醒"""
         self.broker.set_notify()
 
+    def __output_accounts(self):
+        """输出各账户的简略结果，之后当前账户为第一个账户"""
+        for name in self.accounts:
+            self.set_account(name)
+            self.__output_summary()
+        if len(self.accounts) > 1:
+            self.sink.write('accounts', self.get_accounts_summary())
+        self._account_index = 0
+        self.set_account(list(self.accounts)[0])
+
+    def result_name(self, name):
+        """输出结果的名字，多账户时加上账户名"""
+        return name if len(self.accounts) == 1 else '{}_{}'.format(self.account.name, name)
+
     def __output_summary(self):
         """输出简略的回测结果"""
         total = pd.DataFrame(self.fill.equity.dict)
@@ -257,6 +574,7 @@ class Quant(object):
         logger.debug('-----------total.index----------: {}'.format(total.index))
         logger.debug('-----------total.columns----------: {}'.format(total.columns))
         drawdown = create_drawdowns(total)
+        self.sink.write(self.result_name('drawdown'), drawdown, index=False)
         logger.debug('----------------drawdown done----------')
         # 计算列中的后一个元素与前一个元素差的百分比
         total.set_index('date', inplace=True)  # 去掉 date，保留 equity
@@ -286,9 +604,9 @@ class Quant(object):
         results['夏普比率'] = round(create_sharpe_ratio(pct_returns), 2)
         results['盈利率'] = str(round(total_return * 100, 2)) + '%'
         results['最大回撤'] = drawdown['drawdown'].max()
-        results['最大回撤时间'] = drawdown['date'][drawdown['drawdown'].idxmax()]  # 只能找出一个 index
+        results['最大回撤时间'] = str(drawdown['date'][drawdown['drawdown'].idxmax()])  # 只能找出一个 index
         results['最大回撤比'] = str(round(drawdown['pct'].max() * 100, 2)) + '%'
-        results['最大回撤比时间'] = drawdown['date'][drawdown['pct'].idxmax()]
+        results['最大回撤比时间'] = str(drawdown['date'][drawdown['pct'].idxmax()])
         logger.debug('----short_realized_gain_and_loss----: {}'.format(
             self.fill.short_realized_gain_and_loss.dict))
         logger.debug('---type of short_realized_gain_and_loss.list---: {}'.format(
@@ -316,25 +634,25 @@ class Quant(object):
         results['空头总亏损'] = round(sum(short_loss), 2)
         results['手续费'] = sum(long_commission) + sum(short_commission)
         logger.info('---------results---------: {}'.format(results))
+        self.account.results = results
         results_table = dict_to_table(results)
-        with open(date + '_results.txt', 'w') as f:
-            f.write(results_table)
+        self.sink.write(self.result_name('results'), results_table)
 
     def get_trade_log(self, instrument):
         """获取交易记录"""
         completed_list = self.fill.completed_list
         for feed in self.feed_list:
-            if feed.instrument is instrument:
+            if feed.instrument == instrument:
                 return create_trade_log(completed_list, self.context)
 
     def get_analysis(self, instrument):
-        """输出详细的结果分析"""
+        """输出详细的结果分析，返回各项统计数据"""
         logger.info('-----get_analysis-----')
         ohlc_data = self.feed_list[0].bar.df
         ohlc_data = ohlc_data.drop(len(ohlc_data) - 1)  # 最后一条数据为重复的数据
         logger.debug('---feed_list---: {} {}'.format(self.feed_list, self.feed_list[0].bar))
         ohlc_data.set_index('time', inplace=True)  # 设立新索引
-        ohlc_data.index = pd.DatetimeIndex(ohlc_data.index)  # 将新索引转换为 DatetimeIndex
+        ohlc_data.index = to_datetime(ohlc_data.index.values)  # 将纳秒时间戳索引转换为 DatetimeIndex
         logger.debug('------ohlc_data.index------: {}'.format(ohlc_data.index))
         logger.debug('------type of ohlc_data.index------: {}'.format(type(ohlc_data.index)))
         self.context.ohlc_data = ohlc_data  # pd.DataFrame
@@ -352,7 +670,7 @@ class Quant(object):
         trade_log = self.get_trade_log(instrument)
         # logger.info('------trade_log-----: {}'.format(trade_log))
         trade_log = trade_log[trade_log['lots'] != 0]
-        trade_log.to_csv(date + '_trade_log.csv')
+        self.sink.write(self.result_name('trade_log'), trade_log)
         self.context.trade_log = trade_log
         logger.info('------trade_log-----: {}'.format(trade_log))
         logger.debug('------context.fill-----: {}'.format(
@@ -362,26 +680,28 @@ class Quant(object):
         logger.info('----------------------stats-----------------------')
         logger.debug('---analysis_table---: {}'.format(analysis))
         equity = self.context.fill.equity.df
-        equity.to_csv(date + '_equity.csv')
+        self.sink.write(self.result_name('equity'), equity)
         analysis_table = dict_to_table(analysis)
-        with open(date + '_analysis_table.txt', 'w') as f:
-            f.write(str(analysis_table))
+        self.sink.write(self.result_name('analysis_table'), str(analysis_table))
         logger.info('analysis_table: {}'.format(analysis_table))
+        return analysis
 
-    def plot(self, instrument, engine='plotly', notebook=False):
-        """画图展示"""
+    def plot(self, instrument, engine='plotly', notebook=False, max_points=plotter.MAX_POINTS):
+        """画图展示，每条曲线最多画约 max_points 个点，None 为不降采样"""
         data = plotter.Plotter(
             instrument=instrument,
             bar=self.bar,
-            fill=self.fill
+            fill=self.fill,
+            max_points=max_points
         )
         data.plot(instrument=instrument, engine=engine, notebook=notebook)
 
-    def plot_partly(self, instrument, engine='plotly', notebook=False):
-        """画图展示"""
+    def plot_partly(self, instrument, engine='plotly', notebook=False, max_points=plotter.MAX_POINTS):
+        """画图展示，每条曲线最多画约 max_points 个点，None 为不降采样"""
         data = plotter.Plotter(
             instrument=instrument,
             bar=self.bar,
-            fill=self.fill
+            fill=self.fill,
+            max_points=max_points
         )
         data.plot_partly(instrument=instrument, engine=engine, notebook=notebook)
@@ -7,7 +7,7 @@ class OrderData(object):
     """处理Order数据，计算止盈、止损、追踪止损的价格"""
 
     def __init__(self, instrument, lots, price, take_profit, stop_loss,
-                 trailing_stop, cur_bar, execute_mode, order_type):
+                 trailing_stop, cur_bar, clock, execute_mode, order_type):
         self.lots = lots
         self.price = price
         self.take_profit = take_profit
@@ -16,6 +16,7 @@ class OrderData(object):
         self.trailing_stop_calc = trailing_stop  # 作更新用
         self.instrument = instrument
         self._cur_bar = cur_bar
+        self._clock = clock
         self.execute_mode = execute_mode
         self.order_type = order_type
         self.execute_mode_price = None
@@ -31,14 +32,14 @@ class OrderData(object):
         self.__set_trailing_stop()
 
     def __set_date(self):
-        """设置时间，cur_bar_list中第一个date"""
-        self.date = self._cur_bar.cur_date
+        """设置时间，为下单品种feed时钟的纳秒时间戳，多个feed的交易日历不同时也与该品种一致"""
+        self.date = self._clock.time
 
     def __set_direction(self):
         """判断方向，买为1.0，卖为-1.0"""
-        if self.order_type is 'BUY':
+        if self.order_type == 'BUY':
             self.direction = 1.0
-        elif self.order_type is 'SELL':
+        elif self.order_type == 'SELL':
             self.direction = -1.0
 
     def __set_price(self):
@@ -47,19 +48,19 @@ class OrderData(object):
         更改结算价为当条bar的收盘价
         """
         logger.debug('self.execute_mode: {}'.format(self.execute_mode))
-        if self.execute_mode is 'open':
+        if self.execute_mode == 'open':
             # self.execute_mode_price = self._cur_bar.next_open
             self.execute_mode_price = self._cur_bar.cur_close
-        elif self.execute_mode is 'close':
+        elif self.execute_mode == 'close':
             self.execute_mode_price = self._cur_bar.cur_close
 
         logger.debug('self.price: {}'.format(self.price))
         if self.price in ['open', 'close', None]:
             self.price = self.execute_mode_price
         elif type(self.price) is type:
-            if self.price.type is 'points':
+            if self.price.type == 'points':
                 self.price = self.price.points + self.execute_mode_price
-            elif self.price.type is 'pct':
+            elif self.price.type == 'pct':
                 self.price = self.execute_mode_price * self.price.pct  # ???
             else:
                 raise SyntaxError('价格必须为点数或百分数!')
@@ -68,12 +69,12 @@ class OrderData(object):
     def __set_take_profit(self, cur_price):
         """计算止盈价格"""
         if self.take_profit:
-            if self.take_profit.type is 'points':
+            if self.take_profit.type == 'points':
                 if self.take_profit.points < 0:
                     raise SyntaxError('止盈中的点数必须大于0！')
                 points = self.take_profit.points * self.direction
                 self.take_profit = cur_price + points
-            elif self.take_profit.type is 'pct':
+            elif self.take_profit.type == 'pct':
                 if self.take_profit.pct < 0:
                     raise SyntaxError('止盈中的百分比必须大于0！')
                 pct = 1 + self.take_profit.pct * self.direction
@@ -84,12 +85,12 @@ class OrderData(object):
     def __set_stop_loss(self, cur_price):
         """计算止损价格"""
         if self.stop_loss:
-            if self.stop_loss.type is 'points':
+            if self.stop_loss.type == 'points':
                 if self.stop_loss.points < 0:
                     raise SyntaxError('止损中的点数必须大于0！')
                 points = self.stop_loss.points * self.direction
                 self.stop_loss = cur_price - points
-            elif self.stop_loss.type is 'pct':
+            elif self.stop_loss.type == 'pct':
                 if self.stop_loss.pct < 0:
                     raise SyntaxError('止损中的百分比必须大于0！')
                 pct = 1 - self.stop_loss.pct * self.direction
@@ -100,12 +101,12 @@ class OrderData(object):
     def __set_trailing_stop(self):
         """计算追踪止损价格"""
         if self.trailing_stop_calc:
-            if self.trailing_stop_calc.type is 'points':
+            if self.trailing_stop_calc.type == 'points':
                 if self.trailing_stop_calc.points < 0:
                     raise SyntaxError('追踪止损中的点数必须大于0！')
                 points = self.trailing_stop_calc.points * self.direction
                 self.trailing_stop = self.price - points
-            elif self.trailing_stop_calc.type is 'pct':
+            elif self.trailing_stop_calc.type == 'pct':
                 if self.trailing_stop_calc.pct < 0:
                     raise SyntaxError('追踪止损中的百分比必须大于0！')
                 pct = 1 - self.trailing_stop_calc.pct * self.direction
@@ -299,6 +300,7 @@ class Order(OrderBase):
             stop_loss=stop_loss,
             trailing_stop=trailing_stop,
             cur_bar=self._cur_bar,
+            clock=self._feed.clock,
             execute_mode=self._execute_mode,
             order_type=self.order_type)
         self.__set_order_data()
@@ -1,11 +1,83 @@
 # coding:utf-8
-import pandas as pd
+import numpy as np
 from quant.logging_backtest import logger
+from quant.clock import to_datetime
 from plotly import graph_objs as go, offline as py
 from datetime import datetime
 
 date = datetime.now().strftime('%Y-%m-%d-%H-%M')
 
+MAX_POINTS = 5000  # 每条曲线默认最多画的点数
+WEBGL_THRESHOLD = 1000  # 原始点数超过此值时用 Scattergl
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets 降采样，保留曲线形状，返回选中点的下标；
+    首尾两点总被保留，中间的点均分为 n_out - 2 个桶，每个桶中选与前一个选中点、
+    下一个桶均值所组成三角形面积最大的点
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64) - float(x[0])
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    edges = np.append(edges, n)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_start, next_stop = edges[i + 1], max(edges[i + 2], edges[i + 1] + 1)
+        avg_x = x[next_start:next_stop].mean()
+        avg_y = y[next_start:next_stop].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:stop] - y[a]) -
+                      (x[a] - x[start:stop]) * (avg_y - y[a]))
+        a = start + int(area.argmax()) if stop > start else a
+        selected[i + 1] = a
+    return np.unique(selected)
+
+
+def min_max(y, n_out):
+    """
+    按桶保留最小值和最大值的降采样，返回选中点的下标，
+    (n_out - 2) // 2 个等长的桶，每桶保留最小和最大两个点，并保留首尾两点，全部向量化计算
+    """
+    n = len(y)
+    buckets = (n_out - 2) // 2
+    if n <= n_out or buckets < 1:
+        return np.arange(n)
+    size = -(-n // buckets)  # 向上取整
+    padded = np.full(size * buckets, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, size)
+    offset = np.arange(buckets) * size
+    rows = ~np.isnan(padded).all(axis=1)
+    low = np.nanargmin(padded[rows], axis=1) + offset[rows]
+    high = np.nanargmax(padded[rows], axis=1) + offset[rows]
+    return np.unique(np.concatenate([[0, n - 1], low, high]))
+
+
+def downsample(x, y, max_points=MAX_POINTS, method='lttb'):
+    """将 (x, y) 降采样到最多约 max_points 个点，method 为 'lttb' 或 'minmax'，max_points 为 None 时不降采样"""
+    if max_points is None or len(y) <= max_points:
+        return x, y
+    if method == 'lttb':
+        index = lttb(x, y, max_points)
+    elif method == 'minmax':
+        index = min_max(y, max_points)
+    else:
+        raise ValueError('未知的降采样方法: {}'.format(method))
+    return x[index], y[index]
+
+
+def series_arrays(series, instrument=None):
+    """取出dataseries中instrument（默认为当前instrument）的日期（int64纳秒）和数值数组，不生成DataFrame"""
+    if instrument not in series.keys:
+        instrument = series._instrument
+    return series.history(instrument)
+
 
 class PlotBase(object):
     """作图的基类，处理数据"""
@@ -15,78 +87,58 @@ class PlotBase(object):
 
 
 class Plotter(PlotBase):
-    """作图展示"""
+    """
+    作图展示，各曲线直接由数组生成，点数超过 max_points 时降采样（method 为 'lttb' 或 'minmax'），
+    原始点数超过 webgl_threshold 时用 Scattergl 绘制
+    """
 
-    def __init__(self, instrument, bar, fill):
+    def __init__(self, instrument, bar, fill, max_points=MAX_POINTS, method='lttb',
+                 webgl_threshold=WEBGL_THRESHOLD):
         super().__init__()
 
-        self.bar = bar.total_dict
-        self.equity_df = fill.equity.df
-        self.cash_df = fill.cash.df
-        self.position_df = fill.position.df
-        self.realized_G_L_df = fill.realized_gain_and_loss.df
-        self.unrealized_g_l_df = fill.unrealized_gain_and_loss.df
-        self.commission_df = fill.commission.df
+        self.bar = bar.total_columns
+        self.max_points = max_points
+        self.method = method
+        self.webgl_threshold = webgl_threshold
+        self.equity = series_arrays(fill.equity)
+        self.cash = series_arrays(fill.cash)
+        self.position = series_arrays(fill.position, instrument)
+        self.realized_g_l = series_arrays(fill.realized_gain_and_loss, instrument)
+        self.unrealized_g_l = series_arrays(fill.unrealized_gain_and_loss, instrument)
+        self.commission = series_arrays(fill.commission, instrument)
         self.data = []
         self.update_menus = []
         self.data_dict = {
-            '权益': self.equity_df,
-            '现金': self.cash_df,
-            '平仓盈亏': self.realized_G_L_df,
-            '浮动盈亏': self.unrealized_g_l_df,
+            '权益': self.equity,
+            '现金': self.cash,
+            '平仓盈亏': self.realized_g_l,
+            '浮动盈亏': self.unrealized_g_l,
         }
 
+    def trace(self, arrays, name, xaxis, yaxis):
+        """由 (日期, 数值) 数组生成一条曲线，先降采样，再只转换保留下来的日期"""
+        x, y = arrays
+        scatter = go.Scattergl if len(y) > self.webgl_threshold else go.Scatter
+        x, y = downsample(x, y, self.max_points, self.method)
+        return scatter(x=to_datetime(x), y=y, xaxis=xaxis, yaxis=yaxis, name=name)
+
+    def price(self, instrument):
+        """instrument 的收盘价数组"""
+        columns = self.bar[instrument]
+        return columns['time'].history(), columns['close'].history()
+
     def plot(self, instrument=None, engine='plotly', notebook=False):
         if engine == 'plotly':
             logger.debug('type(instrument): {}'.format(type(instrument)))
             if isinstance(instrument, str):
-                df = pd.DataFrame(self.bar[instrument])
-                df.set_index('time', inplace=True)
-                df.index = pd.DatetimeIndex(df.index)
-                p_symbol = go.Scatter(
-                    x=df.index,
-                    y=df.close,
-                    xaxis='x2',
-                    yaxis='y2',
-                    name=instrument)
+                p_symbol = self.trace(self.price(instrument), instrument, 'x2', 'y2')
                 self.data.append(p_symbol)
 
-        # 调试用
-        for position in self.position_df:
-            p_position = go.Scatter(
-                x=self.position_df.index,
-                y=self.position_df[position],
-                xaxis='x7',
-                yaxis='y7',
-                name='仓位')
-
-        p_equity = go.Scatter(
-            x=self.equity_df.index,
-            y=self.equity_df.equity,
-            xaxis='x3',
-            yaxis='y3',
-            name='权益')
-
-        p_cash = go.Scatter(
-            x=self.cash_df.index,
-            y=self.cash_df.cash,
-            xaxis='x4',
-            yaxis='y4',
-            name='现金')
-
-        p_realized_gain_and_loss = go.Scatter(
-            x=self.realized_G_L_df.index,
-            y=self.realized_G_L_df.realized_gain_and_loss,
-            xaxis='x5',
-            yaxis='y5',
-            name='利润/亏损')
-
-        p_unrealized_gain_and_loss = go.Scatter(
-            x=self.unrealized_g_l_df.index,
-            y=self.unrealized_g_l_df.unrealized_gain_and_loss,
-            xaxis='x6',
-            yaxis='y6',
-            name='浮动盈亏')
+        p_position = self.trace(self.position, '仓位', 'x7', 'y7')
+        p_equity = self.trace(self.equity, '权益', 'x3', 'y3')
+        p_cash = self.trace(self.cash, '现金', 'x4', 'y4')
+        p_realized_gain_and_loss = self.trace(self.realized_g_l, '利润/亏损', 'x5', 'y5')
+        p_unrealized_gain_and_loss = self.trace(self.unrealized_g_l, '浮动盈亏', 'x6', 'y6')
 
         # # 调试用，全是0？？？
         # p_commission = go.Scatter(
@@ -134,18 +186,7 @@ class Plotter(PlotBase):
             py.plot(fig, filename='Strategy_Results.html', validate=False)
 
     def plot_profit(self, instrument=None, engine='plotly', notebook=False):
-        if engine == 'plotly':
-            if isinstance(instrument, str):
-                df = pd.DataFrame(self.bar[instrument])
-                df.set_index('time', inplace=True)
-                df.index = pd.DatetimeIndex(df.index)
-
-        p_realized_gain_and_loss = go.Scatter(
-            x=self.realized_G_L_df.index,
-            y=self.realized_G_L_df.realized_gain_and_loss,
-            xaxis='x5',
-            yaxis='y5',
-            name='利润/亏损')
+        p_realized_gain_and_loss = self.trace(self.realized_g_l, '利润/亏损', 'x5', 'y5')
 
         self.data.append(p_realized_gain_and_loss)
         layout = go.Layout(
@@ -160,18 +201,7 @@ class Plotter(PlotBase):
             py.plot(fig, filename='Realized_gain_and_loss.html', validate=False)
 
     def _plot_partly(self, name, value, instrument=None, engine='plotly', notebook=False):
-        if engine == 'plotly':
-            if isinstance(instrument, str):
-                df = pd.DataFrame(self.bar[instrument])
-                df.set_index('time', inplace=True)
-                df.index = pd.DatetimeIndex(df.index)
-
-        p_data = go.Scatter(
-            x=value.index,
-            y=value[value.columns[0]],
-            xaxis='x2',
-            yaxis='y2',
-            name=name)
+        p_data = self.trace(value, name, 'x2', 'y2')
 
         self.data.append(p_data)
         layout = go.Layout(
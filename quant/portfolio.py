@@ -1,12 +1,25 @@
 # coding:utf-8
+from collections import OrderedDict
 from quant.event import OrderEvent, events
 from quant.context import Context
+from quant.logging_backtest import logger
 
 
 class PortfolioBase(object):
-    """处理信号的基类"""
+    """
+    处理信号的基类
+    netting 默认为 False，每个信号直接发出订单；
+    设为 True 时，同一时间片内的信号先收集起来，事件队列清空后由 flush 统一处理：
+    同一品种、不带止盈止损的市价单合并为一张净手数的订单，净手数为0则不发出订单，
+    同一品种的多个一键平仓单只发出一张；
+    挂单和带止盈、止损、移动止损的单需要单独记录，按原样发出
+    """
+    netting = False
+
     def __init__(self):
         self.signal_event = None
+        self.fill = None
+        self._signals = []
 
     def generate_order(self):
         order = self.signal_event.order
@@ -14,8 +27,49 @@ class PortfolioBase(object):
         events.put(order_event(order))
 
     def run_portfolio(self, signal_event):
-        self.signal_event = signal_event
-        self.generate_order()
+        if self.netting:
+            self._signals.append(signal_event)
+        else:
+            self.signal_event = signal_event
+            self.generate_order()
+
+    @staticmethod
+    def is_nettable(signal_event):
+        """是否可以与其他信号合并"""
+        return (signal_event.execute_type in ['MARKET', 'CLOSE_ALL'] and
+                signal_event.take_profit is signal_event.stop_loss is signal_event.trailing_stop is None)
+
+    def net(self, signals):
+        """
+        合并同一品种、同一执行类型的信号，返回合并后的信号，
+        只有一个信号或均为一键平仓单时返回第一个信号，
+        否则沿用第一个信号的订单，手数和买卖方向改为净手数，净手数为0时返回None
+        """
+        if len(signals) == 1 or signals[0].execute_type == 'CLOSE_ALL':
+            return signals[0]
+        lots = sum(signal.lots * signal.direction for signal in signals)
+        logger.debug('{} 个信号合并为 {} 手: {}'.format(len(signals), lots, signals[0].instrument))
+        if lots == 0:
+            return None
+        signal = signals[0]
+        signal.order.set_order_type('BUY' if lots > 0 else 'SELL')
+        signal.lots = abs(lots)
+        return signal
+
+    def flush(self):
+        """处理本时间片收集的信号，按信号到达的顺序发出订单，返回发出的订单数"""
+        groups = OrderedDict()
+        for signal in self._signals:
+            key = (signal.instrument, signal.execute_type) if self.is_nettable(signal) else id(signal)
+            groups.setdefault(key, []).append(signal)
+        self._signals = []
+        count = 0
+        for signals in groups.values():
+            self.signal_event = self.net(signals)
+            if self.signal_event is not None:
+                self.generate_order()
+                count += 1
+        return count
 
 
 class Portfolio(PortfolioBase):
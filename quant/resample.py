@@ -0,0 +1,84 @@
+# coding:utf-8
+import pandas as pd
+from quant.barbase import Bar
+from quant.logging_backtest import logger
+
+
+class Resampler(object):
+    """
+    将基础周期的bar增量合成为更大周期的bar（如1分钟合成5分钟、30分钟、日线），
+    每来一条基础bar只做一次O(1)的更新；
+    周期的划分为 (time - offset) // span，新周期的第一条基础bar到来时，上一周期完成，
+    完成的bar以周期起始时间为time，存入self.bar
+    """
+    sum_fields = ('volume', 'amount')  # 需要累加的字段，其余字段取最后一个值
+
+    def __init__(self, instrument, rule, offset=None):
+        self.instrument = instrument
+        self.rule = rule
+        self.span = pd.Timedelta(rule).value  # 周期长度，纳秒
+        self.offset = pd.Timedelta(offset).value if offset else 0
+        if self.span <= 0:
+            raise ValueError('周期必须大于0: {}'.format(rule))
+        self.bar = Bar(instrument)
+        self._bucket = None
+        self._forming = None  # 正在合成中的bar
+        self._last_time = None
+
+    def update(self, new_bar):
+        """
+        加入一条基础bar，若上一周期完成则返回完成的bar，否则返回None；
+        重复或时间倒退的bar会被忽略
+        """
+        time = new_bar['time']
+        if self._last_time is not None and time <= self._last_time:
+            return None
+        self._last_time = time
+
+        bucket = (time - self.offset) // self.span
+        completed = None
+        if bucket != self._bucket:
+            completed = self.flush()
+            self._bucket = bucket
+            self._forming = dict(new_bar)
+            self._forming['time'] = bucket * self.span + self.offset
+        else:
+            forming = self._forming
+            for name, value in new_bar.items():
+                if name == 'time' or name == 'open':
+                    continue
+                elif name == 'high':
+                    if value > forming['high']:
+                        forming['high'] = value
+                elif name == 'low':
+                    if value < forming['low']:
+                        forming['low'] = value
+                elif name in self.sum_fields:
+                    forming[name] += value
+                else:
+                    forming[name] = value
+        return completed
+
+    def flush(self):
+        """结束正在合成的bar并存入self.bar，返回该bar；没有时返回None"""
+        completed = self._forming
+        if completed is not None:
+            self.bar.add_new_bar(completed)
+            logger.debug('resample {} bar completed: {}'.format(self.rule, completed))
+        self._forming = None
+        return completed
+
+    def get_state(self):
+        return {'bucket': self._bucket, 'forming': self._forming,
+                'last_time': self._last_time, 'bar': self.bar.get_state()}
+
+    def set_state(self, state):
+        self._bucket = state['bucket']
+        self._forming = state['forming']
+        self._last_time = state['last_time']
+        self.bar.set_state(state['bar'])
+
+    @property
+    def forming(self):
+        """正在合成中、尚未完成的bar"""
+        return self._forming
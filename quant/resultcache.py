@@ -0,0 +1,277 @@
+# coding:utf-8
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from quant.broker import Broker
+from quant.clock import to_datetime
+from quant.digest import feed_digest, package_digest
+from quant.logging_backtest import logger
+from quant.main import Quant
+from quant.portfolio import Portfolio
+from quant.sink import NullSink
+
+VERSION = 3
+# 影响回测结果的context参数，与数据、策略源码一起组成缓存键
+CONTEXT_FIELDS = ('commission', 'margin', 'units', 'lots', 'slippage',
+                  'instrument', 'start_date', 'end_date', 'initial_cash')
+SUFFIX = '.npz'
+
+
+def strategy_source(strategy):
+    """
+    策略类及其自定义父类的源码和类属性（参数），quant 内置的类不计入；
+    type() 动态生成的子类没有源码，只计入类属性
+    """
+    parts = []
+    for cls in strategy.__mro__:
+        if cls is object or cls.__module__.split('.')[0] == 'quant':
+            continue
+        try:
+            parts.append(inspect.getsource(cls))
+        except (OSError, TypeError):
+            parts.append(cls.__name__)
+        parts.append(repr(sorted((name, repr(value)) for name, value in vars(cls).items()
+                                 if not name.startswith('__') and not callable(value))))
+    return '\n'.join(parts)
+
+
+def engine_settings():
+    """run_backtest 使用的 portfolio、broker 类及影响回测结果的类属性开关"""
+    return [('{}.{}'.format(Portfolio.__module__, Portfolio.__qualname__), Portfolio.netting),
+            ('{}.{}'.format(Broker.__module__, Broker.__qualname__), Broker.batch, Broker.scale)]
+
+
+def _split(obj, key, arrays):
+    """
+    将结果中的DataFrame按列、numpy数组放入arrays，其余部分可直接转为json，
+    时间列和时间索引保存为int64纳秒时间戳，与 checkpoint 的格式相同，不使用pickle
+    """
+    if isinstance(obj, pd.DataFrame):
+        columns = []
+        for i, name in enumerate(obj.columns):
+            columns.append([name, _split_column(obj[name].to_numpy(), '{}/{}'.format(key, i), arrays)])
+        index = None
+        if isinstance(obj.index, pd.DatetimeIndex):
+            index = [obj.index.name, _split_column(obj.index.values, key + '/index', arrays)]
+        return {'__frame__': columns, 'index': index}
+    if isinstance(obj, np.ndarray):
+        arrays[key] = obj
+        return {'__array__': key}
+    if isinstance(obj, dict):
+        return {'__dict__': [[str(k), _split(v, '{}/{}'.format(key, k), arrays)] for k, v in obj.items()]}
+    if isinstance(obj, (list, tuple)):
+        return [_split(v, '{}/{}'.format(key, i), arrays) for i, v in enumerate(obj)]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def _split_column(values, key, arrays):
+    """一列数据放入arrays，返回列的类型：时间、字符串或数值"""
+    if np.issubdtype(values.dtype, np.datetime64):
+        arrays[key] = values.astype('datetime64[ns]').view(np.int64)
+        return ['datetime', key]
+    if values.dtype == object or not np.issubdtype(values.dtype, np.number):
+        arrays[key] = np.asarray(values, dtype=str)
+        return ['str', key]
+    arrays[key] = values
+    return ['number', key]
+
+
+def _join_column(column, arrays):
+    kind, key = column
+    if kind == 'datetime':
+        return to_datetime(arrays[key])
+    if kind == 'str':
+        return arrays[key].astype(object)
+    return arrays[key]
+
+
+def _join(obj, arrays):
+    """_split的逆过程，dict按原来的顺序恢复为OrderedDict"""
+    if isinstance(obj, dict):
+        if '__frame__' in obj:
+            frame = pd.DataFrame(OrderedDict(
+                (name, _join_column(column, arrays)) for name, column in obj['__frame__']))
+            if obj['index'] is not None:
+                frame.index = _join_column(obj['index'][1], arrays)
+                frame.index.name = obj['index'][0]
+            return frame
+        if '__array__' in obj:
+            return arrays[obj['__array__']]
+        return OrderedDict((k, _join(v, arrays)) for k, v in obj['__dict__'])
+    if isinstance(obj, list):
+        return [_join(v, arrays) for v in obj]
+    return obj
+
+
+def _remove(path):
+    """删除文件，已被其他进程删除时忽略"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def run_backtest(context, analysis=True):
+    """
+    回测一次，返回要缓存的结果：equity 权益，trade_log 交易记录，
+    results 简略结果，stats 详细的统计分析（analysis 为 False 时为 None）
+    """
+    quant = Quant(context)
+    quant.get_ready()
+    quant.set_result_sink(NullSink())
+    quant.run()
+    result = OrderedDict()
+    result['equity'] = quant.fill.equity.df
+    result['results'] = quant.account.results
+    if analysis:
+        result['stats'] = quant.get_analysis(context.instrument)
+        result['trade_log'] = context.trade_log
+    else:
+        result['stats'] = None
+        trade_log = quant.get_trade_log(context.instrument)
+        result['trade_log'] = trade_log[trade_log['lots'] != 0].reset_index(drop=True)
+    return result
+
+
+class ResultCache(object):
+    """
+    回测结果的缓存，键为数据文件内容、重采样周期、策略源码、context参数、
+    portfolio和broker的类及开关、quant 包源码的摘要，
+    同样的组合再次回测时直接从磁盘读取权益、交易记录和统计结果；
+    每个结果一个npz文件，读取时更新修改时间，总大小超过 max_bytes 时删除最久未用的结果；
+    多个进程可共用一个目录：各自写入临时文件后替换，其他进程已删除的文件视为未命中
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, context):
+        """context的缓存键"""
+        strategy_list = context.strategy if isinstance(context.strategy, list) else [context.strategy]
+        sha1 = hashlib.sha1()
+        sha1.update(repr(VERSION).encode())
+        sha1.update(package_digest().encode())
+        sha1.update(repr(engine_settings()).encode())
+        for feed in context.feed_list:
+            sha1.update(feed_digest(feed).encode())
+            timeframes = getattr(feed, 'timeframes', {})  # 重采样周期影响策略收到的行情
+            sha1.update(repr(sorted((rule, i.offset) for rule, i in timeframes.items())).encode())
+        for strategy in strategy_list:
+            sha1.update(strategy_source(strategy).encode())
+        sha1.update(repr([(name, getattr(context, name)) for name in CONTEXT_FIELDS]).encode())
+        return sha1.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key):
+        """取出缓存的结果，没有时返回None；文件损坏或无法读取时删除并视为未命中"""
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+            header = json.loads(arrays.pop('__header__').tobytes().decode('utf-8'))
+            result = _join(header, arrays)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning('缓存文件无法读取，已删除: {} {!r}'.format(path, e))
+            _remove(path)
+            return None
+        try:
+            os.utime(path)  # 最近使用
+        except FileNotFoundError:
+            pass  # 读取后被其他进程淘汰，结果仍可用
+        return result
+
+    def put(self, key, result):
+        """保存结果，先写入本进程的临时文件再替换，之后按大小淘汰"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        arrays = {}
+        header = _split(result, 'result', arrays)
+        arrays['__header__'] = np.frombuffer(json.dumps(header).encode('utf-8'), dtype=np.uint8)
+        fd, tmp_path = tempfile.mkstemp(prefix=key + '.', suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+        except BaseException:
+            _remove(tmp_path)
+            raise
+        self.evict(keep=path)
+
+    def run(self, context, force=False, analysis=True):
+        """
+        回测 context，命中缓存时直接返回缓存的结果，force 为 True 时总是重新回测并更新缓存；
+        analysis 为 False 时不做详细的统计分析，结果中 stats 为 None，
+        这样缓存的结果不能用于需要 stats 的调用
+        """
+        key = self.key(context)
+        if not force:
+            result = self.get(key)
+            if result is not None and (result['stats'] is not None or not analysis):
+                self.hits += 1
+                logger.info('回测结果缓存命中: {}'.format(key))
+                return result
+        self.misses += 1
+        result = run_backtest(context, analysis)
+        self.put(key, result)
+        return result
+
+    def entries(self):
+        """缓存的全部文件，按最近使用时间从早到晚排列，[(路径, 大小, 修改时间), ...]"""
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # 已被其他进程删除
+                entries.append((path, stat.st_size, stat.st_mtime_ns))
+        return sorted(entries, key=lambda i: i[2])
+
+    @property
+    def size(self):
+        return sum(i[1] for i in self.entries())
+
+    def evict(self, keep=None):
+        """删除最久未用的结果，直到总大小不超过 max_bytes，keep 为不删除的文件"""
+        entries = self.entries()
+        size = sum(i[1] for i in entries)
+        for path, file_size, _ in entries:
+            if size <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            _remove(path)
+            size -= file_size
+            logger.info('回测结果缓存已满，删除: {}'.format(path))
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            _remove(path)
+
+    def stats(self):
+        """命中次数、未命中次数和命中率"""
+        results = OrderedDict()
+        results['命中'] = self.hits
+        results['未命中'] = self.misses
+        total = self.hits + self.misses
+        results['命中率'] = round(self.hits / total, 4) if total else 0
+        return results
@@ -0,0 +1,162 @@
+# coding:utf-8
+import os
+import queue
+import threading
+import weakref
+from collections import OrderedDict
+from datetime import datetime
+from itertools import count
+
+import pandas as pd
+
+from quant.logging_backtest import logger
+
+_run_counter = count(1)
+
+
+def make_run_id():
+    """每次回测唯一的编号：时间-进程号-序号，同一进程或并行的多个进程中互不重复"""
+    return '{}-{}-{}'.format(datetime.now().strftime('%Y-%m-%d-%H-%M-%S'),
+                             os.getpid(), next(_run_counter))
+
+
+def _write_text(obj, path, index):
+    with open(path, 'w') as f:
+        f.write(str(obj))
+
+
+# 各格式的写入函数 (obj, path, index)，DataFrame 可用全部格式，字符串只能写为 txt
+WRITERS = {
+    'csv': lambda obj, path, index: obj.to_csv(path, index=index),
+    'json': lambda obj, path, index: obj.to_json(path),
+    'pickle': lambda obj, path, index: obj.to_pickle(path),
+    'parquet': lambda obj, path, index: obj.to_parquet(path),
+    'txt': _write_text,
+}
+
+
+def _write_items(items, batch):
+    """后台线程：每次阻塞取一个结果后再取出队列中已有的结果，最多 batch 个一起写，取到 None 时写完本批后退出"""
+    while True:
+        batch_items = [items.get()]
+        while len(batch_items) < batch and batch_items[-1] is not None:
+            try:
+                batch_items.append(items.get_nowait())
+            except queue.Empty:
+                break
+        for item in batch_items:
+            if item is None:
+                items.task_done()
+                return
+            obj, path, file_format, index = item
+            try:
+                WRITERS[file_format](obj, path, index)
+            except Exception as e:
+                logger.error('写入 {} 失败: {}'.format(path, e))
+            items.task_done()
+
+
+def _stop_writer(items, thread):
+    """通知后台线程写完已提交的结果后退出，并等待其结束"""
+    items.put(None)
+    if thread is not threading.current_thread():
+        thread.join()
+
+
+class ResultSink(object):
+    """
+    回测结果的输出目标，Quant 通过 write(name, obj) 输出结果，
+    name 如 'results'、'drawdown'、'trade_log'、'equity'、'analysis_table'，
+    obj 为 DataFrame 或字符串；DataFrame 写入前会复制，调用者之后可以继续修改
+    """
+
+    def write(self, name, obj, index=True):
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            obj = obj.copy()
+        self._write(name, obj, index)
+
+    def _write(self, name, obj, index):
+        raise NotImplementedError
+
+    def flush(self):
+        """等待已提交的结果全部写完"""
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class NullSink(ResultSink):
+    """丢弃所有结果，用于参数遍历等不需要输出文件的场合"""
+
+    def write(self, name, obj, index=True):
+        pass
+
+
+class MemorySink(ResultSink):
+    """将结果保存在内存中，self.results 为 {name: obj}"""
+
+    def __init__(self):
+        self.results = OrderedDict()
+
+    def _write(self, name, obj, index):
+        self.results[name] = obj
+
+    def __getitem__(self, name):
+        return self.results[name]
+
+
+class DirectorySink(ResultSink):
+    """
+    将结果写入目录 path，文件名为 '{run_id}_{name}.{格式}'，run_id 默认由 make_run_id 生成；
+    formats 为 {name: 格式}，未指定的 DataFrame 用 default_format，字符串总是写为 txt；
+    写入在后台线程中进行，每次最多取 batch 个结果一起写，close 时写完已提交的结果并结束线程，
+    sink 被回收或程序退出时也会这样做，后台线程不引用sink，不会使其一直存活
+    """
+
+    def __init__(self, path='.', run_id=None, formats=None, default_format='csv', batch=16):
+        self.path = path
+        self.run_id = run_id or make_run_id()
+        self.formats = formats or {}
+        self.default_format = default_format
+        self.batch = batch
+        self.paths = OrderedDict()  # 已提交的结果 {name: 文件路径}
+        self._queue = queue.Queue()
+        self._thread = None
+        self._finalizer = None
+        self._lock = threading.Lock()
+        for name, file_format in list(self.formats.items()) + [(None, default_format)]:
+            if file_format not in WRITERS:
+                raise ValueError('不支持的格式 {}: {}'.format(name, file_format))
+
+    def get_path(self, name, obj):
+        file_format = 'txt' if isinstance(obj, str) else self.formats.get(name, self.default_format)
+        return os.path.join(self.path, '{}_{}.{}'.format(self.run_id, name, file_format)), file_format
+
+    def _write(self, name, obj, index):
+        path, file_format = self.get_path(name, obj)
+        self.paths[name] = path
+        self.__start()
+        self._queue.put((obj, path, file_format, index))
+
+    def __start(self):
+        """第一次写入（或close之后再写入）时启动后台线程"""
+        with self._lock:
+            if self._thread is None:
+                os.makedirs(self.path, exist_ok=True)
+                self._thread = threading.Thread(target=_write_items, args=(self._queue, self.batch),
+                                                name='DirectorySink', daemon=True)
+                self._thread.start()
+                self._finalizer = weakref.finalize(self, _stop_writer, self._queue, self._thread)
+
+    def flush(self):
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """写完已提交的结果并结束后台线程"""
+        with self._lock:
+            if self._thread is not None:
+                self._finalizer()
+                self._thread = None
+                self._finalizer = None
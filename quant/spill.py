@@ -0,0 +1,70 @@
+# coding:utf-8
+import os
+
+import numpy as np
+
+from quant.logging_backtest import logger
+
+
+class SpillFile(object):
+    """
+    单列数据的磁盘文件，按原始二进制只追加写入，
+    回测中写入内存中较旧的数据，输出结果时用memmap读取，不整体载入内存
+    """
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self._length = 0
+        with open(path, 'wb'):  # 清空上一次回测留下的数据
+            pass
+
+    def append(self, values):
+        values = np.asarray(values, dtype=self.dtype)
+        with open(self.path, 'ab') as f:
+            values.tofile(f)
+        self._length += len(values)
+
+    def read(self):
+        """已写入的全部数据，只读的memmap"""
+        if not self._length:
+            return np.empty(0, dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode='r', shape=(self._length,))
+
+    def __len__(self):
+        return self._length
+
+
+class SpillStore(object):
+    """
+    流式回测的磁盘存储，directory 下每列数据一个文件，
+    window 为内存中至少保留的条数，数据达到 limit = window + max(window, chunk) 条时，
+    window 条之前的数据一次写入磁盘，内存中的数据不超过limit条
+    """
+
+    def __init__(self, directory, window, chunk=4096):
+        if window < 1:
+            raise ValueError('window 须大于0')
+        self.directory = directory
+        self.window = window
+        self.chunk = chunk
+        self.limit = window + max(window, chunk)
+        self._files = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def file(self, name, dtype):
+        """名为name的列文件，同名只创建一次"""
+        if name not in self._files:
+            path = os.path.join(self.directory, '{}.bin'.format(name.replace(os.sep, '_')))
+            self._files[name] = SpillFile(path, dtype)
+            logger.debug('spill file: {}'.format(path))
+        return self._files[name]
+
+    def child(self, name):
+        """子目录中的存储，如各账户分开保存"""
+        return SpillStore(os.path.join(self.directory, name), self.window, self.chunk)
+
+    @property
+    def size(self):
+        """已写入磁盘的字节数"""
+        return sum(len(i) * i.dtype.itemsize for i in self._files.values())
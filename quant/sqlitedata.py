@@ -0,0 +1,122 @@
+# coding:utf-8
+import os
+import sqlite3
+from urllib.request import pathname2url
+
+import numpy as np
+
+from quant.clock import parse_timestamps, to_str
+from quant.feedbase import ColumnDataReader
+from quant.logging_backtest import logger
+
+_connections = {}  # {数据库路径: 连接}，同一数据库的多个feed共用一个连接
+
+
+def connect(path):
+    """以只读方式打开数据库，同一路径只打开一次"""
+    path = os.path.abspath(path)
+    if path not in _connections:
+        if not os.path.exists(path):
+            raise IOError('数据库不存在: {}'.format(path))
+        _connections[path] = sqlite3.connect('file:{}?mode=ro'.format(pathname2url(path)), uri=True)
+    return _connections[path]
+
+
+def close_all():
+    """关闭全部共用的连接"""
+    for connection in _connections.values():
+        connection.close()
+    _connections.clear()
+
+
+def write_sqlite(path, instrument, columns, table='bars'):
+    """
+    将列数据 {'time': int64纳秒时间戳, 'open': 数组, ...} 写入数据库的table表，
+    表不存在时创建，并建立 (instrument, time) 索引，用于准备SQLiteDataReader的数据
+    """
+    names = [i for i in columns if i != 'time']
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute('CREATE TABLE IF NOT EXISTS "{}" (instrument TEXT, time INTEGER, {})'.format(
+            table, ', '.join('"{}" REAL'.format(i) for i in names)))
+        connection.execute('CREATE INDEX IF NOT EXISTS "{0}_instrument_time" ON "{0}" (instrument, time)'.format(table))
+        rows = zip([instrument] * len(columns['time']), np.asarray(columns['time'], dtype=np.int64).tolist(),
+                   *[np.asarray(columns[i]).tolist() for i in names])
+        connection.executemany('INSERT INTO "{}" VALUES ({})'.format(
+            table, ', '.join('?' * (len(names) + 2))), rows)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+class SQLiteDataReader(ColumnDataReader):
+    """
+    从SQLite读取行情，表中须有instrument、time列，按 (instrument, time) 建立索引，
+    起止时间写入 WHERE 条件，只读取回测用到的行，fetchmany 成批读取后转为numpy列，
+    之后与CSVDataReader相同；
+    date_format 为 None 时time列为纳秒时间戳，否则为该格式的字符串，格式须可按字符串排序，
+    如 '%Y-%m-%d %H:%M:%S'；preload_rows 为起始时间之前额外读取的条数，用于预计算指标等
+    """
+
+    def __init__(self, path, instrument, startdate=None, enddate=None, table='bars',
+                 date_format=None, preload_rows=0, batch_size=10000):
+        super().__init__(instrument, startdate, enddate)
+        self.path = path
+        self.table = table
+        self.date_format = date_format
+        self.preload_rows = preload_rows
+        self.batch_size = batch_size
+
+    def __fields(self, connection):
+        """表中除instrument外的字段，time在第一列"""
+        fields = [i[1] for i in connection.execute('PRAGMA table_info("{}")'.format(self.table))]
+        if 'time' not in fields or 'instrument' not in fields:
+            raise ValueError('{} 表中须有instrument和time列'.format(self.table))
+        return ['time'] + [i for i in fields if i not in ('time', 'instrument')]
+
+    def __bound(self, timestamp):
+        return timestamp if self.date_format is None else to_str(timestamp, self.date_format)
+
+    def __fetch(self, cursor, fields):
+        """fetchmany 成批读取，每批转为numpy列，最后拼接"""
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                break
+            chunks.append(list(zip(*rows)))
+        columns = {}
+        for index, name in enumerate(fields):
+            values = [np.array(chunk[index]) for chunk in chunks]
+            values = np.concatenate(values) if values else np.array([])
+            if name == 'time':
+                values = parse_timestamps(values, self.date_format)
+            elif values.dtype.kind in 'iuf':
+                values = values.astype(np.float64)
+            columns[name] = values
+        return columns
+
+    def load_data(self):
+        connection = connect(self.path)
+        fields = self.__fields(connection)
+        select = 'SELECT {} FROM "{}" WHERE instrument = ?'.format(
+            ', '.join('"{}"'.format(i) for i in fields), self.table)
+        conditions, params = [], [self.instrument]
+        if self.startdate is not None:
+            conditions.append(' AND time >= ?')
+            params.append(self.__bound(self.startdate))
+        if self.enddate is not None:
+            conditions.append(' AND time <= ?')
+            params.append(self.__bound(self.enddate))
+        columns = self.__fetch(connection.execute(
+            select + ''.join(conditions) + ' ORDER BY time', params), fields)
+        if self.preload_rows and self.startdate is not None:
+            preload = self.__fetch(connection.execute(
+                select + ' AND time < ? ORDER BY time DESC LIMIT ?',
+                [self.instrument, self.__bound(self.startdate), self.preload_rows]), fields)
+        else:
+            preload = None
+        if preload is not None and len(preload['time']):
+            columns = {name: np.concatenate([preload[name][::-1], values]) for name, values in columns.items()}
+        logger.info('{} 从 {} 读取 {} 条行情'.format(self.instrument, self.path, len(columns['time'])))
+        return columns
@@ -10,7 +10,16 @@ signal_event = Context().SignalEvent
 
 
 class StrategyBase(ABC):
-    """策略基类"""
+    """
+    策略基类
+    timeframes：订阅的周期，None为基础周期，其余为feed.resample设置的周期，如 [None, '5min']
+    precompute：回测前对全部数据预计算的指标，{名称: (指标, 参数...)}，
+                如 {'fast': ('SMA', 5), 'upper': ('max_high', 20)}，指标可为 indicator.VECTORIZED 中的名称，
+                或 func(columns, *params) 形式的函数，按基础周期计算，回测中用 self.precomputed['fast'][-1] 读取当前值
+    """
+    timeframes = [None]
+    precompute = {}
+    lookback = 0  # 用到的最多的历史bar数，如指标的最大周期，流式模式下内存中至少保留这么多条
 
     def __init__(self, market_event):
         self._signal_list = []
@@ -18,6 +27,7 @@ class StrategyBase(ABC):
 
         self.units = market_event.units
         self.instrument = market_event.instrument
+        self.timeframe = market_event.timeframe
         self.bar = market_event.bar
         self.bar.set_instrument(self.instrument)
         self.position = market_event.fill.position
@@ -28,6 +38,7 @@ class StrategyBase(ABC):
         self.commission = market_event.fill.commission
         self.cash = market_event.fill.cash
         self.equity = market_event.fill.equity
+        self.precomputed = market_event.feed.precomputed.get(type(self))
 
     def __set_dataseries_instrument(self):
         """确保dataseries对应的instrument为正在交易的品种"""
@@ -50,6 +61,23 @@ class StrategyBase(ABC):
         # self.cross = Cross(self.market_event)
         # self.average_true_range = AverageTrueRange(self.market_event)
 
+    @classmethod
+    def get_state(cls):
+        """
+        策略的状态，用于保存快照。策略每次行情都会重新实例化，需要跨行情保存的状态
+        应放在类属性中，并重写此方法返回，值可以是数字、字符串、列表、字典或numpy数组
+        """
+        return {}
+
+    @classmethod
+    def set_state(cls, state):
+        """从快照恢复策略的状态，与get_state对应"""
+        pass
+
+    def get_timeframe_bar(self, rule):
+        """获取当前feed合成的大周期Bar，rule为feed.resample设置的周期"""
+        return self.market_event.feed.timeframes[rule].bar
+
     def points(self, n):
         """
         数值：在price中可正可负，判断是否为挂单。其余只可为正。
@@ -177,13 +205,13 @@ class StrategyBase(ABC):
         exit_all_order = ExitAllOrder(self.market_event)
         # 仓位为负，说明是卖出开仓的，需买入平仓
         if self.position[-1] < 0:
-            exit_all_order.set_order_type('Buy')
+            exit_all_order.set_order_type('BUY')
         # 仓位为正，说明是买入开仓的，需卖出平仓
         elif self.position[-1] > 0:
-            exit_all_order.set_order_type('Sell')
+            exit_all_order.set_order_type('SELL')
         # 仓位为0，不需要操作，但为防止触发其他单，返回空
         else:
-            exit_all_order.set_order_type('Sell')
+            exit_all_order.set_order_type('SELL')
             return
 
         lots = abs(self.position[-1])
@@ -222,7 +250,7 @@ class StrategyBase(ABC):
                 self._signal_list = [] if signal.lots == 0 else [signal]
                 break
         for signal in self._signal_list:
-            if signal.instrument is self.instrument:
+            if signal.instrument == self.instrument:
                 events.put(signal)
 
     def stop(self):
@@ -252,11 +280,6 @@ class StrategyBase(ABC):
 
 
 class Strategy(StrategyBase):
-    def __init__(self, market_event):
-        super().__init__(market_event)
-        position = self.position[-1]
-        logger.debug('position in strategy: {}'.format(position))
-
     def buy_even_and_open(self,
                           lots,
                           instrument=None,
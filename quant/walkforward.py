@@ -0,0 +1,216 @@
+# coding:utf-8
+import itertools
+import multiprocessing
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+from quant.analysis import create_drawdowns, create_sharpe_ratio
+from quant.clock import to_datetime
+from quant.context import Context
+from quant.dict_to_table import dict_to_table
+from quant.feedbase import ColumnDataReader
+from quant.logging_backtest import logger
+from quant.main import Quant
+from quant.sink import NullSink
+
+# 从模板context复制到每次回测的参数
+CONTEXT_FIELDS = ('commission', 'margin', 'units', 'lots', 'slippage',
+                  'instrument', 'initial_cash')
+
+_columns = None  # 工作进程中缓存的列数据，只在进程启动时传入一次
+
+
+def _init_worker(columns):
+    global _columns
+    _columns = columns
+
+
+def param_grid(grid):
+    """将 {'fast': [5, 10], 'slow': [20, 30]} 展开为参数字典的列表"""
+    names = list(grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[grid[i] for i in names])]
+
+
+def make_windows(start, end, in_sample, out_of_sample, anchored=False):
+    """
+    按月生成walk-forward窗口，返回 [(is_start, oos_start, oos_end), ...]，
+    样本内为 [is_start, oos_start)，样本外为 [oos_start, oos_end)，均为pd.Timestamp；
+    in_sample、out_of_sample 为月数，anchored 为 True 时样本内起点固定为 start
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    windows = []
+    is_start = start
+    oos_start = start + relativedelta(months=in_sample)
+    while oos_start < end:
+        oos_end = min(oos_start + relativedelta(months=out_of_sample), end)
+        windows.append((is_start, oos_start, oos_end))
+        oos_start = oos_end
+        if not anchored:
+            is_start = oos_start - relativedelta(months=in_sample)
+    return windows
+
+
+def score(fill, metric='equity'):
+    """
+    回测结果的评分，越大越好
+    metric：'equity' 最终权益，'sharpe' 夏普比率，或以 fill 为参数的可序列化函数
+    """
+    if callable(metric):
+        return metric(fill)
+    if metric == 'equity':
+        return fill.equity[-1]
+    if metric == 'sharpe':
+        ratio = create_sharpe_ratio(fill.equity.series.pct_change())
+        return -np.inf if np.isnan(ratio) else ratio
+    raise ValueError('未知的评分方式: {}'.format(metric))
+
+
+def run_backtest(strategy, params, start, end, settings, columns, timeframes=()):
+    """
+    用已解析的列数据回测 [start, end) 区间，参数作为策略子类的类属性传入，
+    timeframes 为模板feed用 resample 设置的周期 [(rule, offset), ...]，
+    与普通回测一样，指标在区间内重新积累数据；返回 Quant，区间内没有数据时返回 None
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    time = columns['time']
+    if time.searchsorted(start.value) == time.searchsorted(end.value):
+        return None
+    context = Context()
+    for name, value in settings.items():
+        setattr(context, name, value)
+    context.start_date = start.strftime('%Y-%m-%d')
+    context.end_date = end.strftime('%Y-%m-%d')
+    feed = ColumnDataReader(settings['instrument'], start.value, end.value - 1, columns=columns)
+    for rule, offset in timeframes:
+        feed.resample(rule, offset)
+    context.feed_list = [feed]
+    context.strategy = [type(strategy.__name__, (strategy,), dict(params))]
+    quant = Quant(context)
+    quant.get_ready()
+    quant.set_result_sink(NullSink())  # 参数遍历中不输出结果文件
+    quant.run()
+    return quant
+
+
+def _run_task(task):
+    """在工作进程中执行一次回测，返回评分及权益"""
+    strategy, params, start, end, settings, timeframes, metric = task
+    quant = run_backtest(strategy, params, start, end, settings, _columns, timeframes)
+    if quant is None:
+        return {'params': params, 'score': -np.inf, 'date': None, 'equity': None}
+    return {
+        'params': params,
+        'score': score(quant.fill, metric),
+        'date': np.array(quant.fill.equity.date, dtype=np.int64),
+        'equity': np.array(quant.fill.equity.list, dtype=np.float64),
+    }
+
+
+class WalkForward(object):
+    """
+    walk-forward分析：在样本内窗口遍历参数网格并选出最优参数，
+    用于紧接着的样本外窗口，滚动向前，最后拼接所有样本外的权益曲线；
+    context 为模板，取其中第一个feed和第一个策略，数据只解析一次并在各窗口间复用，
+    样本内的参数遍历用多进程并行执行，processes 为 1 时在当前进程中执行
+    """
+
+    def __init__(self, context, grid, windows, metric='equity', processes=None):
+        self.context = context
+        self.feed = context.feed_list[0]
+        self.strategy = context.strategy[0] if isinstance(context.strategy, list) else context.strategy
+        self.params_list = param_grid(grid) if isinstance(grid, dict) else list(grid)
+        self.windows = windows
+        self.metric = metric
+        self.processes = processes
+        self.settings = {name: getattr(context, name) for name in CONTEXT_FIELDS}
+        self.settings['instrument'] = self.feed.instrument
+        self.timeframes = [(rule, i.offset) for rule, i in self.feed.timeframes.items()]
+        self.results = None  # 每个窗口的结果，pd.DataFrame
+        self.equity = None  # 拼接后的样本外权益，pd.Series
+
+    def __map(self, tasks, columns):
+        if self.processes == 1:
+            _init_worker(columns)
+            return [_run_task(i) for i in tasks]
+        pool = multiprocessing.Pool(self.processes, _init_worker, (columns,))
+        try:
+            return pool.map(_run_task, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    def run(self):
+        columns = self.feed.load_data()
+        in_sample_tasks = [
+            (self.strategy, params, is_start, oos_start, self.settings, self.timeframes, self.metric)
+            for is_start, oos_start, oos_end in self.windows
+            for params in self.params_list]
+        in_sample = self.__map(in_sample_tasks, columns)
+
+        n = len(self.params_list)
+        best_list = []
+        for i in range(len(self.windows)):
+            sweep = in_sample[i * n:(i + 1) * n]
+            best_list.append(max(sweep, key=lambda x: x['score']))
+            logger.info('walk-forward 窗口 {} 最优参数: {}'.format(i, best_list[-1]['params']))
+
+        out_of_sample_tasks = [
+            (self.strategy, best['params'], oos_start, oos_end, self.settings, self.timeframes, self.metric)
+            for (is_start, oos_start, oos_end), best in zip(self.windows, best_list)]
+        out_of_sample = self.__map(out_of_sample_tasks, columns)
+
+        self.__stitch(best_list, out_of_sample)
+        return self
+
+    def __stitch(self, best_list, out_of_sample):
+        """样本外权益按盈亏累加拼接，每个窗口从上一窗口的最终权益开始"""
+        initial_cash = self.settings['initial_cash']
+        rows = []
+        curves = []
+        offset = 0
+        for (is_start, oos_start, oos_end), best, result in zip(self.windows, best_list, out_of_sample):
+            profit = 0
+            if result['equity'] is not None:
+                profit = result['equity'][-1] - initial_cash
+                curves.append(pd.Series(result['equity'] + offset, index=to_datetime(result['date'])))
+            offset += profit
+            rows.append(OrderedDict([
+                ('is_start', is_start), ('oos_start', oos_start), ('oos_end', oos_end),
+                ('params', best['params']), ('is_score', best['score']),
+                ('oos_score', result['score']), ('oos_profit', profit)]))
+        self.results = pd.DataFrame(rows)
+        if curves:
+            self.equity = pd.concat(curves)
+        else:
+            self.equity = pd.Series([], dtype=np.float64)
+        self.equity.name = 'equity'
+
+    def get_summary(self):
+        """样本外拼接权益的统计结果"""
+        initial_cash = self.settings['initial_cash']
+        summary = OrderedDict()
+        summary['窗口数'] = len(self.windows)
+        summary['参数组数'] = len(self.params_list)
+        summary['初始资金'] = initial_cash
+        if len(self.equity) == 0:
+            return summary
+        total = pd.DataFrame({'date': self.equity.index, 'equity': self.equity.values})
+        drawdown = create_drawdowns(total)
+        final = round(self.equity.iloc[-1], 2)
+        summary['样本外开始时间'] = str(self.equity.index[0])
+        summary['样本外结束时间'] = str(self.equity.index[-1])
+        summary['最终权益'] = final
+        summary['盈利率'] = str(round((final / initial_cash - 1) * 100, 2)) + '%'
+        summary['夏普比率'] = round(create_sharpe_ratio(self.equity.pct_change()), 2)
+        summary['最大回撤'] = drawdown['drawdown'].max()
+        summary['最大回撤时间'] = str(drawdown['date'][drawdown['drawdown'].idxmax()])
+        summary['最大回撤比'] = str(round(drawdown['pct'].max() * 100, 2)) + '%'
+        summary['盈利窗口数'] = int((self.results['oos_profit'] > 0).sum())
+        return summary
+
+    def get_summary_table(self):
+        return dict_to_table(self.get_summary())
@@ -0,0 +1,135 @@
+# coding:utf-8
+"""
+多账户回测与逐个回测的耗时：N 个策略分别回测一次，与作为 N 个账户一次遍历行情的耗时对比，
+均线策略一直持仓，指标分为逐条计算（共用指标缓存）和预计算两种；突破策略大部分时间空仓；
+通道策略的各账户只有持有期不同，指标相同，每条bar只计算一次，
+多账户共用的是行情和指标，各账户的策略、成交和数据序列仍逐个处理，
+指标越多、越贵，多账户越快，通道策略在 MIN_COUNT 个以上时耗时比须小于 MAX_RATIO，
+python accounts_benchmark.py [策略数 ...]
+"""
+import sys
+import time
+import pandas as pd
+from quant.context import Context
+from quant.feedbase import CSV
+from quant.main import Quant
+from quant.sink import NullSink
+from quant.strategy import Strategy
+
+DATA = '../data/CFFEX沪深300期货IF主连（修正）.csv'
+PAIRS = [(5, 10), (5, 20), (10, 20), (10, 30), (20, 60), (3, 10), (8, 30), (15, 40)]
+HOLDS = [5, 10, 15, 20, 30, 40, 60, 80]
+MIN_COUNT = 4
+MAX_RATIO = 0.7
+
+
+def moving_average(fast, slow, precompute):
+    """逐条计算指标时调用 Indicator.SMA，预计算时读取 self.precomputed"""
+    class MovingAverage(Strategy):
+        def next(self):
+            if precompute:
+                fast_sma, slow_sma = self.precomputed['fast'][-1], self.precomputed['slow'][-1]
+            else:
+                fast_sma = self.indicator.SMA(period=fast, index=-1)
+                slow_sma = self.indicator.SMA(period=slow, index=-1)
+            if fast_sma > slow_sma:
+                self.buy_open(1)
+            else:
+                self.sell_open(1)
+            if self.position[-1] > 0 and self.bar.close[-1] < slow_sma:
+                self.sell_close(1)
+            elif self.position[-1] < 0 and self.bar.close[-1] > slow_sma:
+                self.buy_close(1)
+    if precompute:
+        MovingAverage.precompute = {'fast': ('SMA', fast), 'slow': ('SMA', slow)}
+    return MovingAverage
+
+
+def breakout(period, hold):
+    """收盘价突破前 period 条的最高价时开多，持有 hold 条后平仓，大部分时间空仓"""
+    class Breakout(Strategy):
+        held = 0
+
+        def next(self):
+            close = self.bar.close
+            if self.position[-1] > 0:
+                Breakout.held += 1
+                if Breakout.held >= hold:
+                    self.sell_close(1)
+            elif len(close) > period and close[-1] > close[-period - 1:-1].max():
+                Breakout.held = 0
+                self.buy_open(1)
+    return Breakout
+
+
+def channel(hold, period=120):
+    """收盘价突破 period 条的通道时开多，持有 hold 条或跌破 2 倍ATR后平仓，各账户的指标相同"""
+    class Channel(Strategy):
+        held = 0
+
+        def next(self):
+            atr = self.indicator.average_true_range(period)
+            upper = self.indicator.max_high(period, 1)
+            close = self.bar.close[-1]
+            if self.position[-1] > 0:
+                Channel.held += 1
+                if Channel.held >= hold or close < upper - 2 * atr:
+                    self.sell_close(1)
+            elif close > upper and close > self.indicator.min_low(period, 1) + atr:
+                Channel.held = 0
+                self.buy_open(1)
+    return Channel
+
+
+def get_quant(strategy_list):
+    context = Context()
+    context.start_date = '2013-01-04'
+    context.end_date = '2017-12-31'
+    context.slippage = 0
+    context.feed_list = [CSV(DATA, 'IF', '2013-01-04', '2017-12-31')]
+    context.strategy = strategy_list
+    quant = Quant(context)
+    quant.get_ready()
+    quant.set_result_sink(NullSink())
+    return quant
+
+
+def timed(func, repeat=3):
+    """重复 repeat 次取最短耗时"""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+
+def benchmark(counts):
+    rows = []
+    for n in counts:
+        kinds = [('均线，逐条计算', [moving_average(fast, slow, False) for fast, slow in PAIRS[:n]]),
+                 ('均线，预计算', [moving_average(fast, slow, True) for fast, slow in PAIRS[:n]]),
+                 ('突破', [breakout(slow, fast) for fast, slow in PAIRS[:n]]),
+                 ('通道，共用指标', [channel(hold) for hold in HOLDS[:n]])]
+        for kind, strategies in kinds:
+            def separate():
+                for strategy in strategies:
+                    get_quant([strategy]).run()
+
+            def accounts():
+                quant = get_quant([])
+                for i, strategy in enumerate(strategies):
+                    quant.add_account('s{}'.format(i), strategy)
+                quant.run()
+
+            separate_time, accounts_time = timed(separate), timed(accounts)
+            ratio = accounts_time / separate_time
+            if kind == '通道，共用指标' and n >= MIN_COUNT:
+                assert ratio < MAX_RATIO, '{} 个账户共用指标时耗时比为 {:.3f}，没有加速'.format(n, ratio)
+            rows.append((kind, n, round(separate_time, 3), round(accounts_time, 3), round(ratio, 3)))
+    return pd.DataFrame(rows, columns=['策略', '策略数', '逐个回测（秒）', '多账户（秒）', '耗时比'])
+
+
+if __name__ == '__main__':
+    count_list = [int(i) for i in sys.argv[1:]] or [1, 5]
+    print(benchmark(count_list).to_string(index=False))
@@ -0,0 +1,71 @@
+# coding:utf-8
+from quant.context import Context
+from quant.feedbase import CSV
+from quant.main import Quant
+from quant.sink import NullSink
+from quant.strategy import Strategy
+
+DATA = '../data/CFFEX沪深300期货IF主连（修正）.csv'
+
+
+class MovingAverage(Strategy):
+    """
+    快线在慢线之上买入开仓，之下卖出开仓；
+    exit 为 True 时，有仓位且收盘价在慢线之上买入平仓，之下卖出平仓
+    """
+    fast = 5
+    slow = 10
+    exit = False
+
+    def next(self):
+        fast = self.indicator.SMA(period=self.fast)
+        slow = self.indicator.SMA(period=self.slow)
+        if fast > slow:
+            self.buy_open(1)
+        elif fast < slow:
+            self.sell_open(1)
+        if self.exit and self.position[-1] != 0:
+            if slow < self.bar.close[-1]:
+                self.buy_close(1)
+            elif slow > self.bar.close[-1]:
+                self.sell_close(1)
+
+
+def moving_average(**params):
+    """
+    参数不同的 MovingAverage，如 moving_average(fast=10, slow=30, exit=True)，
+    返回的类不能按名字导入，需要传给子进程的策略应在模块中定义 MovingAverage 的子类
+    """
+    return type('MovingAverage', (MovingAverage,), params)
+
+
+def make_context(strategy, feed_list=None, **settings):
+    """
+    测试用的context，默认回测 2013 年的IF主连，
+    settings 为要修改的context参数，如 end_date='2013-06-30', slippage=0
+    """
+    context = Context()
+    context.start_date = '2013-01-04'
+    context.end_date = '2013-12-31'
+    for name, value in settings.items():
+        setattr(context, name, value)
+    if feed_list is None:
+        feed_list = [CSV(DATA, 'IF', context.start_date, context.end_date)]
+    context.feed_list = feed_list
+    context.strategy = strategy if isinstance(strategy, list) else [strategy]
+    return context
+
+
+def make_quant(context, sink=None):
+    """准备好回测的Quant，结果默认不写入文件"""
+    quant = Quant(context)
+    quant.get_ready()
+    quant.set_result_sink(NullSink() if sink is None else sink)
+    return quant
+
+
+def run(strategy, feed_list=None, sink=None, **settings):
+    """回测一次，返回Quant"""
+    quant = make_quant(make_context(strategy, feed_list, **settings), sink)
+    quant.run()
+    return quant
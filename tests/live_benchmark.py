@@ -0,0 +1,85 @@
+# coding:utf-8
+"""
+实时行情回放的吞吐量和延迟：本地 ReplayServer 按给定速率发送tick，
+记录实际处理速率及每条tick从收到到策略运行完毕的延迟，
+python live_benchmark.py [tick数] [每秒tick数 ...]，速率为0时尽快发送，得到处理能力的上限
+"""
+import asyncio
+import sys
+import time
+import numpy as np
+import pandas as pd
+from quant import clock
+from quant.context import Context
+from quant.live import AsyncDataHandler, AsyncPaperBroker, ReplayServer
+from quant.main import Quant
+from quant.sink import NullSink
+from quant.strategy import Strategy
+
+
+class MovingAverage(Strategy):
+    """均线交叉时在多空1手之间切换，成交回报异步到达，上一个订单全部成交后才发出新订单"""
+    target = 0
+
+    def next(self):
+        if self.position[-1] != self.target:
+            return
+        fast = self.indicator.SMA(period=5, index=-1)
+        slow = self.indicator.SMA(period=20, index=-1)
+        if fast > slow and self.target <= 0:
+            self.buy(1 - self.target)
+            MovingAverage.target = 1
+        elif fast < slow and self.target >= 0:
+            self.sell(1 + self.target)
+            MovingAverage.target = -1
+
+
+def make_ticks(n):
+    """n 条每500毫秒一条的模拟tick"""
+    price = 3000 + np.cumsum(np.random.RandomState(0).normal(0, 0.5, n)).round(1)
+    time_ = clock.to_timestamp('2013-01-04 09:15:00', '%Y-%m-%d %H:%M:%S') + np.arange(n) * 500000000
+    return {'time': time_, 'open': price, 'high': price, 'low': price, 'close': price}
+
+
+async def replay(columns, rate, batch):
+    interval = batch / rate if rate else 0
+    MovingAverage.target = 0
+    server = ReplayServer(columns, batch=batch, interval=interval)
+    await server.start()
+    context = Context()
+    context.start_date = '2013-01-04'
+    context.end_date = '2013-01-05'
+    context.feed_list = [AsyncDataHandler('IF', port=server.port, maxsize=100000)]
+    context.strategy = [MovingAverage]
+    quant = Quant(context)
+    quant.get_ready()
+    quant.set_result_sink(NullSink())
+    quant.set_broker(AsyncPaperBroker(ack_latency=0.001, fill_latency=0.001))
+    start = time.perf_counter()
+    await quant.run_async()
+    seconds = time.perf_counter() - start
+    await server.close()
+    return quant, seconds
+
+
+def benchmark(n, rates, batch=20):
+    columns = make_ticks(n)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    rows = []
+    try:
+        for rate in rates:
+            quant, seconds = loop.run_until_complete(replay(columns, rate, batch))
+            row = [rate or '不限', n, round(n / seconds)]
+            row.extend(quant.latency.summary().values())
+            rows.append(row)
+    finally:
+        loop.close()
+    return pd.DataFrame(rows, columns=['发送速率', 'tick数', '处理速率', '次数', '平均(ms)', 'p50(ms)',
+                                       'p90(ms)', 'p99(ms)', '最大(ms)'])
+
+
+if __name__ == '__main__':
+    length = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rate_list = [int(i) for i in sys.argv[2:]] or [1000, 2000, 5000, 0]
+    print(benchmark(length, rate_list).to_string(index=False))
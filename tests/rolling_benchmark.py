@@ -0,0 +1,35 @@
+# coding:utf-8
+"""
+滚动最大回撤、最大回升及滚动夏普/索提诺/波动率的耗时，
+python rolling_benchmark.py [数据长度] [窗口长度 ...]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+from quant import analysis
+
+
+def benchmark(n, windows):
+    equity = pd.Series(500000 * np.cumprod(1 + np.random.RandomState(0).normal(0, 0.001, n)))
+    returns = equity.pct_change()
+    functions = [
+        ('rolling_max_dd', analysis.rolling_max_dd, equity),
+        ('rolling_max_ru', analysis.rolling_max_ru, equity),
+        ('rolling_volatility', analysis.rolling_volatility, returns),
+        ('rolling_sharpe_ratio', analysis.rolling_sharpe_ratio, returns),
+        ('rolling_sortino_ratio', analysis.rolling_sortino_ratio, returns),
+    ]
+    rows = []
+    for window in windows:
+        for name, func, data in functions:
+            start = time.perf_counter()
+            func(data, window)
+            rows.append((name, n, window, round(time.perf_counter() - start, 4)))
+    return pd.DataFrame(rows, columns=['函数', '数据长度', '窗口', '耗时（秒）'])
+
+
+if __name__ == '__main__':
+    length = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    window_list = [int(i) for i in sys.argv[2:]] or [1000, 10000, 100000]
+    print(benchmark(length, window_list).to_string(index=False))
@@ -0,0 +1,85 @@
+# coding:utf-8
+import unittest
+from quant.sink import MemorySink, NullSink
+from helpers import make_context, make_quant, moving_average
+
+
+FAST = moving_average(fast=5, slow=10, exit=True)
+SLOW = moving_average(fast=10, slow=30, exit=True)
+
+
+def get_quant(strategy_list, sink):
+    return make_quant(make_context(strategy_list, commission=0.0003, slippage=0), sink)
+
+
+class TestAccount(unittest.TestCase):
+    def test_accounts(self):
+        separate = []
+        for strategy in [FAST, SLOW]:
+            quant = get_quant([strategy], NullSink())
+            quant.run()
+            separate.append(quant.fill)
+
+        sink = MemorySink()
+        quant = get_quant([], sink)
+        quant.add_account('fast', FAST)
+        quant.add_account('slow', SLOW, initial_cash=500000)
+        quant.run()
+        self.assertEqual(list(quant.accounts), ['fast', 'slow'])
+        for fill, name in zip(separate, ['fast', 'slow']):
+            account = quant.accounts[name]
+            self.assertEqual(account.fill.equity.list, fill.equity.list)
+            self.assertEqual(account.fill.position.list, fill.position.list)
+            self.assertEqual(account.results['最终权益'], round(fill.equity[-1], 2))
+        self.assertIn('slow_results', sink.results)
+        self.assertEqual(list(quant.get_accounts_summary().index), ['fast', 'slow'])
+        quant.set_account('slow')
+        self.assertIs(quant.fill, quant.accounts['slow'].fill)
+        with self.assertRaises(ValueError):
+            quant.add_account('fast', FAST)
+
+    def test_shared_indicators(self):
+        """指标相同的账户共用指标缓存，每条bar只计算一次，增加的账户全部命中"""
+        quant = get_quant([FAST], NullSink())
+        quant.run()
+        misses = quant.get_indicator_cache_stats()['IF']['未命中']
+
+        hits = []
+        for count in [1, 2, 3]:
+            quant = get_quant([], NullSink())
+            for i in range(count):
+                quant.add_account(str(i), moving_average(fast=5, slow=10, exit=True))
+            quant.run()
+            stats = quant.get_indicator_cache_stats()['IF']
+            self.assertEqual(stats['未命中'], misses)
+            hits.append(stats['命中'])
+        self.assertGreater(hits[1] - hits[0], 0)
+        self.assertEqual(hits[2] - hits[1], hits[1] - hits[0])
+
+    def test_bankrupt(self):
+        """一个账户爆仓后只有它停止，其余账户与单独回测的结果相同"""
+        separate = []
+        for strategy, cash in [(FAST, 150000), (SLOW, 500000)]:
+            quant = get_quant([strategy], NullSink())
+            quant.set_cash(cash)
+            quant.run()
+            separate.append(quant.fill)
+        self.assertTrue(separate[0].bankrupt)
+        market_events = len(quant.context.market_event)
+
+        quant = get_quant([], NullSink())
+        quant.add_account('fast', FAST, initial_cash=150000)
+        quant.add_account('slow', SLOW)
+        quant.run()
+        for fill, name in zip(separate, ['fast', 'slow']):
+            account = quant.accounts[name]
+            self.assertEqual(account.fill.equity.date, fill.equity.date)
+            self.assertEqual(account.fill.equity.list, fill.equity.list)
+            self.assertEqual(account.fill.position.list, fill.position.list)
+        self.assertTrue(quant.accounts['fast'].finished)
+        self.assertFalse(quant.accounts['slow'].finished)
+        self.assertEqual(len(quant.context.market_event), market_events)
+
+
+if __name__ == '__main__':
+    unittest.main()
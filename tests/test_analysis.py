@@ -1,5 +1,6 @@
 # coding:utf-8
 import unittest
+import numpy as np
 import pandas as pd
 from quant import analysis
 from quant.context import Context
@@ -119,6 +120,95 @@ class TestAnalysis(unittest.TestCase):
         logger.info('---number---: {}'.format(number))
         self.assertEqual(number, 1)
 
+    def test_run_length_encode(self):
+        starts, lengths, values = analysis.run_length_encode(np.array([0, 0, 1, 0, 0, 0]))
+        self.assertEqual(starts.tolist(), [0, 2, 3])
+        self.assertEqual(lengths.tolist(), [2, 1, 3])
+        self.assertEqual(values.tolist(), [0, 1, 0])
+        self.assertEqual(analysis.max_run_length([True, True, False, True], True), 2)
+        self.assertEqual(analysis.max_run_length([], True), 0)
+        self.assertEqual(analysis.next_run_start([1, 1, 0, 1]).tolist(), [2, 2, 3, 4])
+
+    def test_repo_log(self):
+        trades = Context()
+        trades.ohlc_data = ohlc_data.copy()
+        trades.trade_log = trade_log.copy()
+        self.assertEqual(analysis.have_repo_log(trades), [18, 8, 2, 1, 7, 4])
+        self.assertEqual(analysis.None_repo_log(trades), (16, 10))
+        trades.trade_log = trade_log.copy()
+        log = analysis.log_profit_or_loss(trades)
+        self.assertEqual(list(log.index), ['2013/02/20', '2013/03/05', '2013/03/08',
+                                           '2013/03/12', '2013/03/22'])
+        self.assertEqual(log.tolist(), [529401.12, 528570.31, 517056.95, 504533.87, 474909.94])
+
+    def test_monte_carlo(self):
+        profits = [100.0, -50.0, 30.0, -80.0]
+        result = analysis.monte_carlo(profits, n_paths=1000, method='shuffle',
+                                      initial_cash=1000, seed=0, max_memory=1000)
+        # 打乱顺序不改变最终权益
+        self.assertTrue((abs(result['final_equity'] - 1000) < 1e-9).all())
+        # 先亏后赚时的最大回撤为 130
+        self.assertEqual(result['max_drawdown'].max(), 130.0)
+        again = analysis.monte_carlo(profits, n_paths=1000, method='shuffle',
+                                     initial_cash=1000, seed=0, max_memory=1000, processes=2)
+        self.assertTrue((result['max_drawdown'] == again['max_drawdown']).all())
+        result = analysis.monte_carlo(profits, n_paths=1000, initial_cash=100, seed=0)
+        self.assertTrue(0 < result['risk_of_ruin'] < 1)
+        table = analysis.monte_carlo_table(result, percentiles=(5, 50, 95))
+        self.assertEqual(list(table.index), ['5%', '50%', '95%'])
+
+    def test_rolling_max_dd(self):
+        values = np.array([100.0, 120.0, 90.0, 110.0, 80.0, 130.0, 125.0])
+        ser = pd.Series(values)
+        for period in (1, 2, 3, 10):
+            window = period + 1
+            expected_dd, expected_ru = [], []
+            for i in range(len(values)):
+                y = values[max(0, i - window + 1):i + 1]
+                peak = np.maximum.accumulate(y)
+                trough = np.minimum.accumulate(y)
+                expected_dd.append(((y - peak) / peak).min() * 100)
+                expected_ru.append(((y - trough) / trough).max() * 100)
+            self.assertTrue(np.allclose(analysis.rolling_max_dd(ser, period).values, expected_dd))
+            self.assertTrue(np.allclose(analysis.rolling_max_ru(ser, period).values, expected_ru))
+        self.assertTrue(np.isnan(analysis.rolling_max_dd(ser, 3, min_periods=2).values[0]))
+
+    def test_rolling_ratio(self):
+        returns = pd.Series(np.random.RandomState(0).normal(0, 0.01, 500))
+        returns[10] = np.nan
+        rolling = returns.rolling(50, min_periods=2)
+        volatility = analysis.rolling_volatility(returns, 50)
+        self.assertTrue(np.allclose(volatility, rolling.std(ddof=0) * np.sqrt(252), equal_nan=True))
+        sharpe = analysis.rolling_sharpe_ratio(returns, 50)
+        self.assertTrue(np.allclose(sharpe, np.sqrt(252) * rolling.mean() / rolling.std(ddof=0),
+                                    equal_nan=True))
+        sortino = analysis.rolling_sortino_ratio(returns, 50)
+        self.assertAlmostEqual(sortino[200], analysis.sortino_ratio(returns[151:201].values))
+
+    def test_compare_runs(self):
+        curves = {'a': [100.0, 110.0, 99.0, 120.0], 'b': [100.0, 90.0, 95.0, 80.0],
+                  'c': [100.0, 100.0, 100.0, 100.0]}
+        stats_list = [{'盈利率': '20.0%', '测试开始时间': '2013-01-04'},
+                      {'盈利率': '-20.0%', '测试开始时间': '2013-01-04'},
+                      {'盈利率': '0.0%', '测试开始时间': '2013-01-04'}]
+        report = analysis.compare_runs(stats_list, curves)
+        table = report['table']
+        self.assertEqual(list(table.index), ['a', 'b', 'c'])
+        self.assertNotIn('测试开始时间', table.columns)
+        self.assertAlmostEqual(table.loc['b', '盈利率'], -0.2)
+        self.assertAlmostEqual(table.loc['a', '最大回撤'], 11.0)
+        # 收益率越大越好，回撤越小越好
+        self.assertEqual(report['ranks']['总收益率'].tolist(), [1, 3, 2])
+        self.assertEqual(report['ranks']['最大回撤'].tolist(), [2, 3, 1])
+        self.assertEqual(report['percentile_ranks'].loc['a', '总收益率'], 1.0)
+        self.assertEqual(report['percentiles'].loc['50%', '总收益率'], 0.0)
+        matrix, names, _ = analysis.equity_matrix(curves)
+        corr = analysis.equity_correlation(matrix[:2], names[:2])
+        self.assertAlmostEqual(corr.loc['a', 'a'], 1.0)
+        returns = matrix[:2, 1:] / matrix[:2, :-1] - 1
+        self.assertAlmostEqual(corr.loc['a', 'b'], np.corrcoef(returns)[0, 1])
+        self.assertAlmostEqual(report['mean_correlation']['a'], corr.loc['a', 'b'] / 2)
+
 
 if __name__ == '__main__':
     unittest.main()
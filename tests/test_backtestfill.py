@@ -0,0 +1,49 @@
+# coding:utf-8
+import unittest
+from types import SimpleNamespace
+from quant.backtestfill import BacktestFill
+
+
+class TestAvgPrice(unittest.TestCase):
+    def setUp(self):
+        self.fill = BacktestFill()
+        for series in (self.fill.position, self.fill.avg_price):
+            series.initialize('IF', 0)
+            series.set_instrument('IF')
+            series.add('2013-01-01', 0)  # 第一条bar，空仓
+        self.day = 1
+
+    def trade(self, order_type, lots, price):
+        """成交一笔市价单，返回成交后的均价"""
+        self.day += 1
+        fill_event = SimpleNamespace(date='2013-01-{:02d}'.format(self.day), execute_type='MARKET',
+                                     order_type=order_type, direction=1 if order_type == 'BUY' else -1,
+                                     lots=lots, price=price, units=300)
+        self.fill.update_position(fill_event)
+        self.fill.update_avg_price(fill_event)
+        return self.fill.avg_price[-1]
+
+    def test_long_scale_in(self):
+        """加仓时均价按手数加权"""
+        self.assertEqual(self.trade('BUY', 1, 100), 100)
+        self.assertEqual(self.trade('BUY', 3, 200), 175)
+
+    def test_partial_close(self):
+        """部分平仓不改变均价，全部平仓后均价为0，反手后为反手的成交价"""
+        self.trade('BUY', 2, 100)
+        self.trade('BUY', 2, 200)
+        self.assertEqual(self.trade('SELL', 3, 300), 150)
+        self.assertEqual(self.trade('SELL', 1, 300), 0)
+        self.trade('SELL', 2, 100)
+        self.assertEqual(self.trade('BUY', 1, 50), 100)
+        self.assertEqual(self.trade('BUY', 3, 80), 80)
+
+    def test_short_scale_in(self):
+        """空头加仓时均价为正，按手数加权"""
+        self.assertEqual(self.trade('SELL', 2, 100), 100)
+        self.assertEqual(self.trade('SELL', 2, 200), 150)
+        self.assertEqual(self.fill.position[-1], -4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# coding:utf-8
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from quant import clock
+from quant.barstore import BarStore, StoreDataReader
+from helpers import DATA, MovingAverage, run
+
+
+class TestBarStore(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = BarStore(self.root)
+        self.store.import_csv('IF', DATA)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_store(self):
+        self.assertEqual(self.store.instruments(), ['IF'])
+        manifest = self.store.manifest('IF')
+        columns = self.store.open('IF')
+        self.assertIsInstance(columns['close'], np.memmap)
+        self.assertEqual(list(manifest['fields']), ['time', 'open', 'high', 'low', 'close'])
+        self.assertEqual(manifest['rows'], len(columns['time']))
+        data = self.store.read('IF', '2013-01-07', '2013-01-08')
+        self.assertEqual(clock.to_str(data['time'], '%Y-%m-%d').tolist(), ['2013-01-07', '2013-01-08'])
+        self.assertEqual(data['close'][0], 2533.2)
+
+    def test_append(self):
+        columns = self.store.read('IF')
+        rows = len(columns['time'])
+        new = {'close': np.array([1.0]), 'time': columns['time'][-1:] + clock.NS_PER_DAY,
+               'open': np.array([1.0]), 'high': np.array([1.0]), 'low': np.array([1.0])}
+        self.store.append('IF', new)
+        columns = self.store.open('IF')
+        self.assertEqual(self.store.manifest('IF')['rows'], rows + 1)
+        self.assertEqual(columns['close'][-1], 1.0)
+        with self.assertRaises(ValueError):
+            self.store.append('IF', new)  # 时间须晚于已有数据
+
+    def test_reader(self):
+        reader = StoreDataReader(self.root, 'IF', '2013-01-04', '2013-12-31')
+        store = run(MovingAverage, [reader], slippage=0)
+        csv = run(MovingAverage, slippage=0)
+        self.assertEqual(store.fill.equity.list, csv.fill.equity.list)
+        self.assertEqual(store.fill.position.list, csv.fill.position.list)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+# coding:utf-8
+import unittest
+import numpy as np
+from quant.broker import group_cumsum
+from quant.strategy import Strategy
+from helpers import make_context, make_quant
+
+
+class BuyFive(Strategy):
+    def next(self):
+        self.bar.close[-2]  # 从第二条bar开始交易
+        self.buy_open(5)
+
+
+def run(scale):
+    # 初始资金约可开2手
+    quant = make_quant(make_context(BuyFive, end_date='2013-01-31', initial_cash=400000,
+                                    commission=0.0003, slippage=0))
+    quant.broker.scale = scale
+    quant.run()
+    return quant
+
+
+class TestBroker(unittest.TestCase):
+    def test_reject(self):
+        quant = run(False)
+        self.assertEqual(set(quant.fill.position.list), {0})
+        self.assertEqual(len(quant.context.fill_event), 0)
+        rejection = quant.broker.rejections[0]
+        self.assertEqual(rejection.reason, 'MARGIN')
+        self.assertGreater(rejection.required, rejection.available)
+        self.assertEqual(quant.context.order_event[0].status, 'MARGIN')
+
+    def test_scale(self):
+        quant = run(True)
+        self.assertEqual(quant.fill.position[-1], 2)
+        rejection = quant.broker.rejections[0]
+        self.assertEqual((rejection.reason, rejection.lots, rejection.accepted_lots), ('SCALED', 5, 2))
+
+    def test_group_cumsum(self):
+        codes = np.array([1, 0, 1, 0, 1])
+        values = np.array([1., 2., 3., 4., 5.])
+        self.assertEqual(group_cumsum(codes, values).tolist(), [1., 2., 4., 6., 9.])
+
+
+if __name__ == '__main__':
+    unittest.main()
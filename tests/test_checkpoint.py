@@ -0,0 +1,58 @@
+# coding:utf-8
+import os
+import shutil
+import tempfile
+import unittest
+from quant.feedbase import CSV
+from helpers import DATA, MovingAverage, make_context, make_quant
+
+
+def get_quant(datapath=DATA, enddate='2013-12-31'):
+    return make_quant(make_context(MovingAverage, [CSV(datapath, 'IF', '2013-01-04', enddate)]))
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_resume(self):
+        quant = get_quant()
+        quant.set_checkpoint(os.path.join(self.path, 'ck_{count}.npz'), every=100)
+        quant.run()
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'ck_100.npz')))
+
+        resumed = get_quant()
+        resumed.resume(os.path.join(self.path, 'ck_100.npz'))
+        resumed.run()
+        self.assertEqual(resumed.fill.equity.date, quant.fill.equity.date)
+        self.assertEqual(resumed.fill.equity.list, quant.fill.equity.list)
+        self.assertEqual(len(resumed.fill.completed_list), len(quant.fill.completed_list))
+
+    def test_incremental(self):
+        with open(DATA, 'rb') as f:
+            lines = f.read().split(b'\r\n')[:250]
+        datapath = os.path.join(self.path, 'IF.csv')
+        path = os.path.join(self.path, 'IF.npz')
+        with open(datapath, 'wb') as f:
+            f.write(b'\r\n'.join(lines[:200]))
+        summary = get_quant(datapath, None).run_incremental(path)
+        self.assertEqual(summary['新增K线数'], 199)
+
+        with open(datapath, 'ab') as f:  # 每日在末尾追加新行情
+            f.write(b'\r\n' + b'\r\n'.join(lines[200:]))
+        quant = get_quant(datapath, None)
+        summary = quant.run_incremental(path)
+        self.assertEqual(quant.feed_list[0].columns['time'].size, 50)  # 只读取了新增的行
+        self.assertEqual(summary['新增K线数'], 50)
+
+        full = get_quant(datapath, None)
+        full.run()
+        self.assertEqual(quant.fill.equity.list, full.fill.equity.list)
+        self.assertEqual(summary['最新权益'], round(full.fill.equity[-1], 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# coding:utf-8
+import unittest
+from quant import clock
+from quant.event import events
+from quant.feedbase import CSV
+from quant.order import OrderData
+from quant.strategy import Strategy
+import helpers
+
+
+class Points(object):
+    type = 'points'
+    points = 30
+
+
+class StopLoss(Strategy):
+    def next(self):
+        if not self.position[-1] and self.indicator.SMA(period=5) > 0:
+            self.buy_open(1, stop_loss=Points)
+
+
+def run(strategy):
+    return helpers.run(strategy, end_date='2013-06-30', slippage=0)
+
+
+class TestClock(unittest.TestCase):
+    def test_clock(self):
+        engine = clock.Clock()
+        self.assertIsNone(engine.time)
+        engine.set_time(clock.to_timestamp('2013-01-04'))
+        self.assertEqual(str(engine), '2013-01-04 00:00:00')
+        self.assertEqual(engine.datetime.year, 2013)
+        engine.reset()
+        self.assertIsNone(engine.time)
+
+    def test_stop_loss(self):
+        quant = run(StopLoss)
+        feed = quant.feed_list[0]
+        # 引擎时钟停在最后一根bar，订单、成交和数据序列保存的都是整数时间戳
+        self.assertEqual(clock.clock.time, feed.bar.time[-1])
+        stops = [i for i in quant.context.fill_event if i.execute_type == 'STOP_LOSS_ORDER']
+        self.assertTrue(stops)
+        times = set(feed.bar.time.array.tolist())
+        for fill_event in quant.context.fill_event:
+            self.assertIsInstance(fill_event.date, int)
+            self.assertIn(fill_event.date, times)
+        self.assertTrue(all(isinstance(i, int) for i in quant.fill.position.date))
+
+    def test_calendars(self):
+        """多个feed的交易日历不同时，订单取下单品种feed时钟的时间，而不是引擎时钟"""
+        feed = CSV(helpers.DATA, 'IF', '2013-01-04', '2013-06-30')
+        other = CSV(helpers.DATA, 'IF', '2013-01-07', '2013-06-30')  # 晚一个交易日的日历
+        for i in (feed, other):
+            i.load_once()
+            i.get_new_bar()
+            i.next()
+        self.assertEqual(feed.clock.time, feed.cur_bar.cur_date)
+        self.assertEqual(other.clock.time, feed.clock.time + 3 * clock.NS_PER_DAY)
+        self.assertEqual(clock.clock.time, other.clock.time)  # 引擎时钟为最后一个feed的时间
+        order = OrderData('IF', 1, None, None, None, None, feed.cur_bar, feed.clock, 'open', 'BUY')
+        self.assertEqual(order.date, feed.clock.time)
+        while not events.empty():
+            events.get(False)
+        clock.clock.reset()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# coding:utf-8
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from quant import clock
+from quant.barstore import BarStore
+from quant.continuous import ContinuousBuilder, ContinuousDataReader
+from quant.feedbase import load_csv_columns
+from helpers import DATA, MovingAverage, run
+
+
+def split_contracts():
+    """
+    把主连数据拆成三个相互重叠的合约，后一个合约的价格较前一个高2%，
+    成交量在第400、800根bar换到下一个合约，按成交量换月时从下一根bar起使用新合约
+    """
+    columns = load_csv_columns(DATA, clock.TIME_FORMATS['daily'])
+    rows = len(columns['time'])
+    contracts = {}
+    for k, (start, stop) in enumerate([(0, 420), (380, 820), (780, rows)]):
+        contract = {name: values[start:stop] * (1.02 ** k if name != 'time' else 1)
+                    for name, values in columns.items()}
+        volume = np.full(stop - start, 100.0)
+        volume[max(0, 400 * k - start):] = 200.0
+        volume[400 * (k + 1) - start:] = 50.0
+        contract['volume'] = volume
+        contracts['IF{}'.format(k)] = contract
+    return columns, [(name, contracts[name]) for name in sorted(contracts)]
+
+
+class TestContinuous(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.columns, self.contracts = split_contracts()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_rule(self):
+        builder = ContinuousBuilder(self.contracts, rule='volume', method='ratio')
+        columns = builder.build()
+        times = self.columns['time']
+        self.assertEqual(columns['time'].tolist(), times.tolist())
+        self.assertEqual([i['to'] for i in builder.rolls], ['IF1', 'IF2'])
+        self.assertEqual([i['time'] for i in builder.rolls], [times[401], times[801]])
+        # 向后复权后与主连相差一个固定比例，最后一段为真实价格
+        np.testing.assert_allclose(columns['close'], self.columns['close'] * 1.02 ** 2)
+        np.testing.assert_allclose(columns['volume'][:400], 200.0)
+        self.assertEqual(columns['volume'][400], 50.0)  # 第400根bar仍用旧合约
+
+    def test_schedule(self):
+        times = self.columns['time']
+        schedule = [(None, 'IF0'), (int(times[400]), 'IF1'), (clock.to_str(times[800], '%Y-%m-%d'), 'IF2')]
+        ratio = ContinuousBuilder(self.contracts, schedule=schedule, method='ratio').build()
+        difference = ContinuousBuilder(self.contracts, schedule=schedule, method='difference').build()
+        raw = ContinuousBuilder(self.contracts, schedule=schedule, method=None).build()
+        close = self.columns['close']
+        np.testing.assert_allclose(ratio['close'], close * 1.02 ** 2)
+        self.assertTrue(np.allclose(difference['close'][800:], close[800:] * 1.02 ** 2))
+        # 按价差调整时，换月前后的涨跌与主连相同
+        np.testing.assert_allclose(np.diff(difference['close'])[399], np.diff(close)[399] * 1.02, rtol=1e-9)
+        np.testing.assert_allclose(raw['close'][:400], close[:400])
+        with self.assertRaises(ValueError):
+            ContinuousBuilder(self.contracts, schedule=schedule[::-1]).build()
+
+    def test_cached(self):
+        builder = ContinuousBuilder(self.contracts, rule='volume')
+        first = builder.cached(self.root, 'IF')
+        self.assertIsInstance(first['close'], np.memmap)
+        rolls = builder.rolls
+        builder.build = None  # 命中缓存时不再拼接
+        second = builder.cached(BarStore(self.root), 'IF')
+        self.assertEqual(builder.rolls, rolls)
+        np.testing.assert_array_equal(first['close'], second['close'])
+        changed = ContinuousBuilder(self.contracts, rule='volume', method='difference')
+        self.assertNotEqual(changed.key(), builder.key())
+        changed.cached(self.root, 'IF')
+        self.assertNotEqual(changed.rolls[0]['gap'], rolls[0]['gap'])
+
+    def test_reader(self):
+        builder = ContinuousBuilder(self.contracts, rule='volume', method=None)
+        reader = ContinuousDataReader(builder, self.root, 'IF', '2013-01-04', '2013-12-31')
+        continuous = run(MovingAverage, [reader], slippage=0)
+        csv = run(MovingAverage, slippage=0)
+        self.assertEqual(len(reader.rolls), 2)
+        self.assertEqual(continuous.fill.position.list, csv.fill.position.list)
+
+
+if __name__ == '__main__':
+    unittest.main()
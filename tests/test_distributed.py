@@ -0,0 +1,134 @@
+# coding:utf-8
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+from quant.distributed import (DistributedSweep, Scheduler, Worker, build_feed, feed_spec, make_jobs,
+                               resolve_strategy)
+from quant.feedbase import CSV, ColumnDataReader
+import helpers
+
+
+class Faulty(helpers.MovingAverage):
+    """可按参数模拟工作进程崩溃或策略出错的 MovingAverage"""
+    exit = True
+    marker = None  # 文件不存在时创建该文件并退出进程，模拟工作进程崩溃
+    crash = False  # 每次都退出进程
+    error = False
+
+    def next(self):
+        if self.crash:
+            os._exit(1)
+        if self.marker is not None and not os.path.exists(self.marker):
+            open(self.marker, 'w').close()
+            os._exit(1)
+        if self.error:
+            raise ValueError('策略出错')
+        super().next()
+
+
+class Weekly(Faulty):
+    """只在合成的周线上交易"""
+    timeframes = ['1W']
+    fast = 3
+    slow = 5
+
+
+def make_context(strategy=Faulty):
+    return helpers.make_context(strategy)
+
+
+class TestDistributed(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_scheduler(self):
+        scheduler = Scheduler(retries=1)
+        scheduler.add(make_jobs(make_context(), {'fast': [3, 5]}))
+        job = scheduler.take('a')
+        self.assertIs(resolve_strategy(job['strategy']), Faulty)
+        # 任务只带feed的读取参数，不带数据
+        self.assertEqual(job['feed']['path'], os.path.abspath(helpers.DATA))
+        self.assertLess(len(pickle.dumps(job)), 2000)
+        scheduler.fail('a', job['id'], 'Traceback\nValueError')  # 出错后重新排队
+        self.assertEqual(scheduler.take('b')['id'], 1)
+        scheduler.lost('b')  # b 退出，任务重新排队
+        self.assertEqual(scheduler.progress()['pending'], 2)
+        job = scheduler.take('c')
+        scheduler.fail('c', job['id'], 'Traceback\nValueError')  # 超过重试次数
+        job = scheduler.take('c')
+        scheduler.done('c', job['id'], {'score': 1.0})
+        scheduler.done('b', job['id'], {'score': 2.0})  # 已收回的任务不再接受结果
+        self.assertEqual(scheduler.take('c'), 'stop')
+        self.assertEqual(scheduler.progress()['failed'], 1)
+        rows = scheduler.results()
+        self.assertEqual([i['attempts'] for i in rows], [2, 2])
+        self.assertEqual([i['score'] for i in rows[1:]], [1.0])
+        self.assertIsNone(rows[1]['error'])
+
+    def test_worker(self):
+        """工作进程缓存已加载的行情，各任务共用"""
+        jobs = make_jobs(make_context(), {'fast': [3, 5]})
+        worker = Worker(('127.0.0.1', 0), b'key')
+        rows = [worker.execute(job) for job in jobs]
+        self.assertEqual(len(worker.columns), 1)
+        self.assertNotEqual(rows[0]['final_equity'], rows[1]['final_equity'])
+        self.assertEqual(rows[0]['score'], rows[0]['final_equity'])
+        with self.assertRaises(TypeError):  # 内存中的行情不能分发
+            feed_spec(ColumnDataReader('IF', columns={}))
+
+    def test_timeframes(self):
+        """任务带上feed合成的大周期，工作进程重建的feed同样合成"""
+        context = make_context(Weekly)
+        context.feed_list[0].resample('1W')
+        job = make_jobs(context, [{'fast': 3}])[0]
+        self.assertEqual(job['feed']['timeframes'], [['1W', 0]])
+        self.assertIn('1W', build_feed(job['feed']).timeframes)
+        row = Worker(('127.0.0.1', 0), b'key').execute(job)
+        feed = CSV(helpers.DATA, 'IF', '2013-01-04', '2013-12-31')
+        feed.resample('1W')
+        expected = helpers.run(Weekly, [feed])
+        self.assertGreater(row['trades'], 0)
+        self.assertEqual(row['trades'], len(expected.fill.completed_list))
+        self.assertEqual(row['final_equity'], expected.fill.equity[-1])
+        context.feed_list.append(CSV(helpers.DATA, 'IF', '2013-01-04', '2013-12-31'))
+        with self.assertRaises(ValueError):  # 只支持单个feed
+            make_jobs(context, [{'fast': 3}])
+
+    def test_respawns(self):
+        """本机工作进程反复退出时，重新启动的次数有上限"""
+        sweep = DistributedSweep(make_context(), [{'crash': True}], workers=1, retries=10, respawns=2,
+                                 timeout=120)
+        with self.assertRaises(RuntimeError):
+            sweep.run()
+        self.assertEqual(sweep.spawned, 3)
+
+    def test_sweep(self):
+        marker = os.path.join(self.root, 'crashed')
+        grid = [{'fast': 3}, {'fast': 5, 'marker': marker}, {'fast': 8}, {'fast': 5, 'error': True}]
+        with self.assertRaises(ValueError):  # 监听全部网卡时须指定 authkey
+            DistributedSweep(make_context(), grid, address=('0.0.0.0', 0))
+        sweep = DistributedSweep(make_context(), grid, workers=3, lease=5, retries=1, timeout=120)
+        self.assertEqual(len(sweep.authkey), 32)  # 未指定时随机生成
+        sweep.run()
+        results = sweep.results
+        self.assertEqual(results['id'].tolist(), [0, 1, 2, 3])
+        self.assertTrue(os.path.exists(marker))
+        # 崩溃的任务在重新启动的工作进程上重试成功，与不崩溃时结果相同
+        self.assertEqual(results['attempts'][1], 2)
+        self.assertTrue(pd.isnull(results['error'][1]))
+        expected = Worker(sweep.address, sweep.authkey).execute(make_jobs(make_context(), [{'fast': 5}])[0])
+        self.assertEqual(results['final_equity'][1], expected['final_equity'])
+        # 一直出错的任务重试后记为失败
+        self.assertEqual(results['attempts'][3], 2)
+        self.assertIn('策略出错', results['error'][3])
+        self.assertIn(sweep.best()['fast'], (3, 5, 8))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# coding:utf-8
+import os
+import tempfile
+import unittest
+import numpy as np
+from quant import clock
+from quant.feedbase import CSV, MinuteCSV, TickCSV, ColumnDataReader
+from quant.resample import Resampler
+from quant.barbase import Bar
+from quant.event import events
+
+
+def write_csv(text):
+    f = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+    f.write(text)
+    f.close()
+    return f.name
+
+
+minute_path = write_csv(
+    'time,open,high,low,close\n'
+    '2017/5/26 14:59,10,11,9,10.5\n'
+    '2017/5/27 9:31,11,12,10,11.5\n'
+    '2017/5/27 9:32,12,13,11,12.5\n'
+    '2017/5/28 9:31,13,14,12,13.5\n')
+tick_path = write_csv(
+    'time,open,high,low,close\n'
+    '2017/5/27 9:31:00.000,1,1,1,1\n'
+    '2017/5/27 9:31:00.500,2,2,2,2\n')
+
+
+def run_feed(feed):
+    feed.load_once()
+    bars = []
+    while True:
+        feed.get_new_bar()
+        if not feed.continue_backtest:
+            return bars
+        bars.append(feed.cur_bar.cur_data)
+
+
+def tearDownModule():
+    os.remove(minute_path)
+    os.remove(tick_path)
+
+
+class TestFeed(unittest.TestCase):
+    def test_daily(self):
+        feed = CSV('../data/CFFEX沪深300期货IF主连.csv', 'IF', '2013-01-07', '2013-01-08')
+        bars = run_feed(feed)
+        self.assertEqual(len(bars), 2)
+        self.assertEqual(clock.to_str(bars[0]['time'], '%Y/%m/%d'), '2013/01/07')
+        self.assertEqual(bars[0]['close'], 2533.2)
+
+    def test_minute(self):
+        feed = MinuteCSV(minute_path, 'IF', '2017-05-27', '2017-05-28')
+        bars = run_feed(feed)
+        self.assertEqual([clock.to_str(i['time'], '%H:%M') for i in bars], ['09:31', '09:32'])
+        self.assertEqual(bars[1]['time'] - bars[0]['time'], clock.NS_PER_MINUTE)
+        feed.preload()
+        self.assertEqual(feed.preload_bar_list[0]['close'], 10.5)
+
+    def test_tick(self):
+        bars = run_feed(TickCSV(tick_path, 'IF'))
+        self.assertEqual(bars[1]['time'] - bars[0]['time'], clock.NS_PER_SECOND // 2)
+
+    def test_columns(self):
+        time = clock.parse_timestamps(['2017/5/27 9:31', '2017/5/27 9:32'], 'minute')
+        columns = {'time': time, 'close': np.array([1.0, 2.0])}
+        bars = run_feed(ColumnDataReader('IF', columns=columns))
+        self.assertEqual([i['close'] for i in bars], [1.0, 2.0])
+        self.assertIsInstance(bars[0]['time'], int)
+
+
+class TestBar(unittest.TestCase):
+    def test_columns(self):
+        bar = Bar('IF')
+        for i in range(300):  # 超过初始容量，触发扩容
+            bar.add_new_bar({'time': i, 'open': i + 0.1, 'high': i + 1.0, 'low': i - 1.0, 'close': float(i)})
+        self.assertEqual(len(bar.close), 300)
+        self.assertEqual(bar.close[-1], 299.0)
+        self.assertEqual(bar.open[0], 0.1)
+        self.assertEqual(list(bar.high[-3:-1]), [298.0, 299.0])
+        self.assertIs(bar.close, bar.close)
+        view = bar.low[-5:]
+        self.assertFalse(view.flags.writeable)
+        self.assertEqual(bar.time.array.dtype, np.int64)
+
+
+class TestResample(unittest.TestCase):
+    def test_resampler(self):
+        resampler = Resampler('IF', '5min')
+        time = clock.parse_timestamps(['2017/5/27 9:3{}'.format(i) for i in range(1, 7)], 'minute')
+        completed = [resampler.update({'time': int(t), 'open': i, 'high': i + 1, 'low': i - 1,
+                                       'close': i + 0.5, 'volume': 1.0})
+                     for i, t in enumerate(time)]
+        self.assertEqual(completed[:4], [None] * 4)
+        self.assertEqual(completed[4], {'time': clock.to_timestamp('2017-05-27 09:30', '%Y-%m-%d %H:%M'),
+                                        'open': 0, 'high': 4, 'low': -1, 'close': 3.5, 'volume': 4.0})
+        self.assertIsNone(resampler.update({'time': int(time[-1]), 'open': 9}))  # 重复的bar被忽略
+        self.assertEqual(resampler.flush()['volume'], 2.0)
+        self.assertEqual(len(resampler.bar.data), 2)
+
+    def test_feed_events(self):
+        feed = MinuteCSV(minute_path, 'IF')
+        bar_1d = feed.resample('1D')
+        feed.load_once()
+        while not events.empty():  # 清除之前的测试中回测残留的事件
+            events.get(False)
+        timeframes = []
+        while feed.continue_backtest:
+            feed.prenext()
+            feed.next()
+            while not events.empty():
+                timeframes.append(events.get().timeframe)
+        self.assertEqual(timeframes, [None, '1D', None, None, '1D', None, '1D', None])
+        self.assertEqual([i['close'] for i in bar_1d.data], [10.5, 12.5, 13.5])
+
+
+if __name__ == '__main__':
+    unittest.main()
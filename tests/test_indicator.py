@@ -0,0 +1,98 @@
+# coding:utf-8
+import unittest
+import talib
+from quant.indicator import IndicatorCache
+from quant.strategy import Strategy
+import helpers
+
+
+class RecordSMA(Strategy):
+    values = []
+
+    def next(self):
+        self.values.append((self.indicator.SMA(period=5), self.indicator.SMA(period=5)))
+
+
+class RecordSMAAgain(RecordSMA):
+    values = []
+
+
+class StreamIndicators(Strategy):
+    values = []
+
+    def next(self):
+        self.values.append((self.indicator.SMA(period=10), self.indicator.max_high(20, 1),
+                            self.indicator.average_true_range(14)))
+
+
+class PrecomputeIndicators(Strategy):
+    precompute = {'sma': ('SMA', 10), 'upper': ('max_high', 20, 1), 'atr': ('ATR', 14)}
+    values = []
+    seen = []
+
+    def next(self):
+        self.seen.append((len(self.precomputed['sma']), len(self.bar.close)))
+        self.values.append((self.precomputed['sma'][-1], self.precomputed['upper'][-1],
+                            self.precomputed['atr'][-1]))
+
+
+def run(strategy_list):
+    return helpers.run(strategy_list, end_date='2013-03-31')
+
+
+class TestIndicatorCache(unittest.TestCase):
+    def test_get(self):
+        cache = IndicatorCache()
+        calls = []
+
+        def compute(x):
+            calls.append(x)
+            return x * 2
+
+        self.assertEqual(cache.get(('IF', None, 'f', (1,)), 10, compute, 1), 2)
+        self.assertEqual(cache.get(('IF', None, 'f', (1,)), 10, compute, 1), 2)
+        self.assertEqual(cache.get(('IF', None, 'f', (1,)), 11, compute, 1), 2)  # 新的bar重新计算
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(cache), 1)  # 旧bar的值被替换
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_shared(self):
+        quant = run([RecordSMA, RecordSMAAgain])
+        stats = quant.get_indicator_cache_stats()['IF']
+        close = quant.feed_list[0].bar.close.array
+        self.assertEqual(stats['未命中'], len(close))  # 每根bar只计算一次
+        self.assertGreater(stats['命中'], 2 * stats['未命中'])
+        self.assertEqual(RecordSMA.values, RecordSMAAgain.values)
+        expected = talib.SMA(close, 5)[-1]
+        self.assertAlmostEqual(RecordSMA.values[-1][0], expected)
+
+
+class TestPrecomputedIndicators(unittest.TestCase):
+    def test_precompute(self):
+        quant = run([StreamIndicators, PrecomputeIndicators])
+        self.assertEqual(len(quant.feed_list[0].precomputed), 3)
+        # 游标只暴露到当前bar，长度与已产生的bar相同（最后一根bar重复加入，游标不重复）
+        self.assertTrue(all(n == m for n, m in PrecomputeIndicators.seen[:-1]))
+        self.assertEqual(len(StreamIndicators.values), len(PrecomputeIndicators.values))
+        for streamed, precomputed in zip(StreamIndicators.values[:-1], PrecomputeIndicators.values[:-1]):
+            for a, b in zip(streamed, precomputed):
+                self.assertAlmostEqual(a, b)
+        cursor = quant.feed_list[0].precomputed.get(PrecomputeIndicators)['sma']
+        with self.assertRaises(IndexError):
+            cursor[len(cursor)]
+        self.assertFalse(cursor[:].flags.writeable)
+
+    def test_start_date(self):
+        """起始时间在数据中间时，预计算的指标同样从第一根回测bar开始，数据不足时raise Warning"""
+        stream = type('StreamIndicators', (StreamIndicators,), {'values': []})
+        precompute = type('PrecomputeIndicators', (PrecomputeIndicators,), {'values': [], 'seen': []})
+        helpers.run([stream, precompute], start_date='2014-01-02', end_date='2014-03-31')
+        self.assertEqual(len(precompute.seen) - len(precompute.values), 20)  # max_high(20, 1) 需要21根bar
+        self.assertEqual(len(stream.values), len(precompute.values))
+        for streamed, precomputed in zip(stream.values[:-1], precompute.values[:-1]):  # 最后一根bar重复加入
+            for a, b in zip(streamed, precomputed):
+                self.assertAlmostEqual(a, b)
+
+
+if __name__ == '__main__':
+    unittest.main()
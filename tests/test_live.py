@@ -0,0 +1,58 @@
+# coding:utf-8
+import asyncio
+import unittest
+from quant.feedbase import CSV
+from quant.live import AsyncDataHandler, AsyncPaperBroker, ReplayServer
+from quant.strategy import Strategy
+from helpers import DATA, make_context, make_quant
+
+
+class OpenAndClose(Strategy):
+    """第20条行情买入开仓2手，第60条行情卖出平仓"""
+    count = 0
+
+    def next(self):
+        OpenAndClose.count += 1
+        if OpenAndClose.count == 20:
+            self.buy(2)
+        elif OpenAndClose.count == 60:
+            self.sell(2)
+
+
+class TestLive(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_replay(self):
+        feed = CSV(DATA, 'IF')
+        columns = {name: value[:100] for name, value in feed.load_data().items()}
+
+        async def run():
+            server = ReplayServer(columns, batch=10)
+            await server.start()
+            context = make_context(OpenAndClose, [AsyncDataHandler('IF', port=server.port)],
+                                   end_date='2013-06-04')
+            quant = make_quant(context)
+            quant.set_broker(AsyncPaperBroker(ack_latency=0.001, fill_latency=0.001, max_fill_lots=1))
+            await quant.run_async()
+            await server.close()
+            return quant
+
+        quant = self.loop.run_until_complete(run())
+        self.assertEqual(len(quant.fill.equity.date), 100)
+        self.assertEqual(len(quant.latency), 100)
+        self.assertEqual(quant.latency.summary()['次数'], 100)
+        # 每个订单分两次成交，部分成交的状态为 PARTIAL，最终为 FILLED
+        self.assertEqual(len(quant.context.order_event), 2)
+        self.assertEqual(len(quant.context.fill_event), 4)
+        self.assertEqual(set(i.order.status for i in quant.context.order_event), {'FILLED'})
+        self.assertEqual(sorted(set(quant.fill.position.list)), [0, 1, 2])
+        self.assertEqual(quant.fill.position[-1], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+# coding:utf-8
+import unittest
+import numpy as np
+from quant.plotter import downsample, lttb, min_max
+
+
+class TestDownsample(unittest.TestCase):
+    def setUp(self):
+        self.x = np.arange(100000, dtype=np.int64) * 60 * 10 ** 9
+        self.y = np.cumsum(np.random.RandomState(0).randn(100000))
+        self.y[777] = 1000
+        self.y[50000] = -1000
+
+    def check(self, index, n_out):
+        self.assertLessEqual(len(index), n_out)
+        self.assertEqual(index[0], 0)
+        self.assertEqual(index[-1], len(self.y) - 1)
+        self.assertTrue((np.diff(index) > 0).all())
+        self.assertIn(777, index)
+        self.assertIn(50000, index)
+
+    def test_lttb(self):
+        self.check(lttb(self.x, self.y, 1000), 1000)
+
+    def test_min_max(self):
+        self.check(min_max(self.y, 1000), 1000)
+
+    def test_small(self):
+        x, y = downsample(self.x[:100], self.y[:100], 1000)
+        self.assertEqual(len(y), 100)
+        x, y = downsample(self.x, self.y, None)
+        self.assertEqual(len(y), len(self.y))
+        with self.assertRaises(ValueError):
+            downsample(self.x, self.y, 1000, 'mean')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+# coding:utf-8
+import unittest
+from quant.portfolio import Portfolio
+from quant.strategy import Strategy
+from helpers import make_context, make_quant
+
+
+class Reverse(Strategy):
+    """均线交叉时反手，反手时发出平仓和开仓两个信号"""
+    def next(self):
+        fast = self.indicator.SMA(period=5, index=-1)
+        slow = self.indicator.SMA(period=10, index=-1)
+        if fast > slow:
+            self.buy_even_and_open(1)
+        elif fast < slow:
+            self.sell_even_and_open(1)
+
+
+def run(netting=None):
+    quant = make_quant(make_context(Reverse, end_date='2013-06-30', commission=0.0003, slippage=0))
+    if netting is not None:
+        quant.portfolio.netting = netting
+    quant.run()
+    return quant
+
+
+class TestPortfolio(unittest.TestCase):
+    def test_netting(self):
+        netted = run(True)
+        separate = run(False)
+        self.assertFalse(Portfolio.netting)  # 默认不合并
+        self.assertEqual(len(run().context.order_event), len(separate.context.order_event))
+        reversals = len(separate.context.order_event) - len(netted.context.order_event)
+        self.assertGreater(reversals, 0)
+        self.assertEqual(len(netted.context.fill_event), len(netted.context.order_event))
+        self.assertEqual(netted.fill.position.list, separate.fill.position.list)
+        self.assertEqual(sum(netted.fill.realized_gain_and_loss.list),
+                         sum(separate.fill.realized_gain_and_loss.list))
+        # 反手时合并为一张2手的订单，保证金按交易后的1手仓位计算
+        self.assertEqual(netted.fill.margin.list, separate.fill.margin.list)
+
+
+if __name__ == '__main__':
+    unittest.main()
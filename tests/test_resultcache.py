@@ -0,0 +1,99 @@
+# coding:utf-8
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from quant.broker import Broker
+from quant.resultcache import ResultCache
+import helpers
+
+
+MovingAverage = helpers.moving_average(exit=True)
+
+
+def make_context(strategy=MovingAverage, commission=0.0003):
+    return helpers.make_context(strategy, commission=commission, slippage=0)
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ResultCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_key(self):
+        key = self.cache.key(make_context())
+        self.assertEqual(key, self.cache.key(make_context()))
+        self.assertNotEqual(key, self.cache.key(make_context(commission=0.0001)))
+        faster = helpers.moving_average(exit=True, fast=3)
+        self.assertNotEqual(key, self.cache.key(make_context(faster)))
+        context = make_context()
+        context.feed_list[0].resample('1W')
+        self.assertNotEqual(key, self.cache.key(context))
+        Broker.batch = False  # 改变回测结果的类属性开关
+        try:
+            self.assertNotEqual(key, self.cache.key(make_context()))
+        finally:
+            Broker.batch = True
+
+    def test_corrupt(self):
+        """无法读取的缓存文件（如旧版本的pickle）视为未命中并删除"""
+        os.makedirs(self.directory, exist_ok=True)
+        for key, data in [('truncated', b'\x80\x04'), ('missing', b'cno_such_module\nThing\n.')]:
+            with open(self.cache.path(key), 'wb') as f:
+                f.write(data)
+            self.assertIsNone(self.cache.get(key))
+            self.assertFalse(os.path.exists(self.cache.path(key)))
+
+    def test_run(self):
+        first = self.cache.run(make_context(), analysis=False)
+        second = self.cache.run(make_context(), analysis=False)
+        self.assertEqual(self.cache.stats()['命中'], 1)
+        self.assertTrue(len(first['trade_log']))
+        self.assertEqual(first['equity']['equity'].tolist(), second['equity']['equity'].tolist())
+        self.assertEqual(first['trade_log']['price'].tolist(), second['trade_log']['price'].tolist())
+        self.assertEqual(first['results'], second['results'])
+        self.cache.run(make_context(), force=True, analysis=False)
+        self.assertEqual(self.cache.stats()['未命中'], 2)
+
+    def test_analysis(self):
+        """默认做详细的统计分析，读出的结果与回测时相同"""
+        first = self.cache.run(make_context())
+        second = self.cache.run(make_context())
+        self.assertEqual(self.cache.stats()['命中'], 1)
+        self.assertEqual(list(first['stats'].items()), list(second['stats'].items()))
+        self.assertTrue(first['equity'].equals(second['equity']))
+        self.assertTrue(first['trade_log'].equals(second['trade_log']))
+        self.assertIsNotNone(self.cache.run(make_context(), analysis=False)['stats'])
+        self.assertEqual([name for name in os.listdir(self.directory)], [self.cache.key(make_context()) + '.npz'])
+
+    def test_removed(self):
+        """文件被其他进程删除时，读取视为未命中，淘汰和清空时跳过"""
+        self.cache.put('a', {'stats': None, 'data': np.zeros(125)})
+        entries = self.cache.entries()
+        os.remove(self.cache.path('a'))
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.entries = lambda: entries  # 其他进程删除之前列出的文件
+        self.cache.max_bytes = 0
+        self.cache.evict()
+        self.cache.clear()
+
+    def test_evict(self):
+        self.cache.put('a', {'stats': None, 'data': np.zeros(125)})
+        self.cache.put('b', {'stats': None, 'data': np.zeros(125)})
+        os.utime(self.cache.path('a'), ns=(0, 0))
+        os.utime(self.cache.path('b'), ns=(1, 1))
+        self.cache.get('a')  # a 最近使用，b 被淘汰
+        self.cache.max_bytes = 2 * os.path.getsize(self.cache.path('a')) + 100  # 只能保留两个
+        self.cache.put('c', {'stats': None, 'data': np.zeros(125)})
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('c'))
+        self.assertLessEqual(self.cache.size, self.cache.max_bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+# coding:utf-8
+import gc
+import os
+import shutil
+import threading
+import tempfile
+import unittest
+import queue
+import numpy as np
+import pandas as pd
+from quant.sink import DirectorySink, MemorySink, NullSink, _write_items
+import helpers
+
+
+def run(sink):
+    return helpers.run(helpers.MovingAverage, sink=sink, end_date='2013-06-30')
+
+
+class TestSink(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_memory(self):
+        sink = MemorySink()
+        run(sink)
+        self.assertEqual(list(sink.results), ['drawdown', 'results'])
+        self.assertIn('最终权益', sink['results'])
+        self.assertIsInstance(sink['drawdown'], pd.DataFrame)
+
+    def test_directory(self):
+        first = DirectorySink(self.path, formats={'drawdown': 'pickle'})
+        second = DirectorySink(self.path)
+        run(first)
+        run(second)
+        first.flush()
+        second.flush()
+        self.assertNotEqual(first.run_id, second.run_id)  # 每次回测的文件名不同
+        self.assertEqual(len(os.listdir(self.path)), 4)
+        self.assertTrue(first.paths['drawdown'].endswith('_drawdown.pickle'))
+        drawdown = pd.read_pickle(first.paths['drawdown'])
+        self.assertTrue(np.allclose(drawdown['equity'], pd.read_csv(second.paths['drawdown'])['equity']))
+        with self.assertRaises(ValueError):
+            DirectorySink(self.path, default_format='xls')
+
+    def test_thread(self):
+        """close 或回收后后台线程结束，多次回测不会留下线程"""
+        def writers():
+            return [i for i in threading.enumerate() if i.name == 'DirectorySink']
+
+        before = len(writers())
+        sink = DirectorySink(self.path)
+        run(sink)
+        sink.close()
+        self.assertEqual(len(writers()), before)
+        self.assertTrue(all(os.path.exists(i) for i in sink.paths.values()))
+        for _ in range(3):
+            run(DirectorySink(self.path))  # 不调用close，sink随Quant一起被回收
+        gc.collect()
+        self.assertEqual(len(writers()), before)
+        self.assertEqual(len(os.listdir(self.path)), 8)
+
+    def test_batch(self):
+        """后台线程每次取出队列中已有的结果一起写，None 之前的结果都会写完"""
+        class Items(queue.Queue):
+            def __init__(self):
+                super(Items, self).__init__()
+                self.drains = 0
+
+            def get(self, block=True, timeout=None):
+                self.drains += block  # get_nowait 为 get(block=False)
+                return super(Items, self).get(block, timeout)
+
+        paths = [os.path.join(self.path, '{}.txt'.format(i)) for i in range(5)]
+        items = Items()
+        for i, path in enumerate(paths):
+            items.put((str(i), path, 'txt', True))
+        items.put(None)
+        _write_items(items, 16)
+        self.assertEqual(items.drains, 1)
+        self.assertTrue(all(os.path.exists(i) for i in paths))
+        items.join()  # task_done 与放入的结果一一对应
+
+        items = Items()
+        for i, path in enumerate(paths):
+            items.put((str(i), path, 'txt', True))
+        items.put(None)
+        _write_items(items, 2)
+        self.assertEqual(items.drains, 3)
+        items.join()
+
+    def test_null(self):
+        quant = run(NullSink())
+        self.assertEqual(len(os.listdir(self.path)), 0)
+        self.assertGreater(len(quant.fill.equity.list), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
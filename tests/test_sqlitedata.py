@@ -0,0 +1,49 @@
+# coding:utf-8
+import os
+import tempfile
+import unittest
+from quant import sqlitedata
+from quant.feedbase import load_csv_columns
+from quant.sqlitedata import SQLiteDataReader, write_sqlite
+from helpers import DATA, MovingAverage, run
+
+
+class TestSQLiteDataReader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        f = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        f.close()
+        cls.path = f.name
+        columns = load_csv_columns(DATA, 'daily')
+        write_sqlite(cls.path, 'IF', columns)
+        write_sqlite(cls.path, 'IH', {name: values[:100] for name, values in columns.items()})
+
+    @classmethod
+    def tearDownClass(cls):
+        sqlitedata.close_all()
+        os.remove(cls.path)
+
+    def test_range(self):
+        feed = SQLiteDataReader(self.path, 'IF', '2013-01-07', '2013-01-08', batch_size=1)
+        feed.load_once()
+        self.assertEqual(len(feed.columns['time']), 2)  # 起止时间在SQL中过滤
+        self.assertEqual(feed.columns['close'][0], 2533.2)
+        feed = SQLiteDataReader(self.path, 'IF', '2013-01-07', '2013-01-08', preload_rows=2)
+        feed.load_once()
+        self.assertEqual(len(feed.columns['time']), 3)  # 数据中起始时间之前只有一条
+        self.assertEqual((feed._start, feed._stop), (1, 3))
+        other = SQLiteDataReader(self.path, 'IH')
+        other.load_once()
+        self.assertEqual(len(other.columns['time']), 100)
+        self.assertIs(sqlitedata.connect(self.path), sqlitedata.connect(other.path))
+
+    def test_reader(self):
+        reader = SQLiteDataReader(self.path, 'IF', '2013-01-04', '2013-12-31', batch_size=64)
+        sqlite = run(MovingAverage, [reader], slippage=0)
+        csv = run(MovingAverage, slippage=0)
+        self.assertEqual(sqlite.fill.equity.list, csv.fill.equity.list)
+        self.assertEqual(sqlite.fill.position.list, csv.fill.position.list)
+
+
+if __name__ == '__main__':
+    unittest.main()
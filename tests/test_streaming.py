@@ -0,0 +1,74 @@
+# coding:utf-8
+import os
+import shutil
+import tempfile
+import unittest
+from quant.barbase import Column
+from quant.sink import MemorySink
+from quant.spill import SpillFile
+from quant.strategy import Strategy
+from helpers import make_context, make_quant, moving_average
+
+
+MovingAverage = moving_average(lookback=11)
+
+
+class LongMovingAverage(Strategy):
+    def next(self):
+        self.indicator.SMA(period=60)
+
+
+def run(strategy, directory=None, lookback=None):
+    quant = make_quant(make_context(strategy, commission=0.0003, slippage=0), MemorySink())
+    if directory:
+        quant.set_streaming(directory, lookback, chunk=16)
+    quant.run()
+    return quant
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_streaming(self):
+        memory = run(MovingAverage)
+        streaming = run(MovingAverage, self.directory)
+        fill = streaming.fill
+        # 内存中只保留最近的数据，较旧的写入磁盘
+        self.assertLessEqual(len(fill.equity.get_state()['series']['all']['value']), 11 + 16)
+        self.assertLessEqual(len(streaming.feed_list[0].bar.close), 2 * (11 + 16))
+        self.assertLessEqual(len(streaming.context.market_event), 11)
+        self.assertTrue(os.path.getsize(os.path.join(self.directory, 'default', 'equity.all.value.bin')))
+        # 结果与非流式模式相同
+        self.assertEqual(len(fill.equity), len(memory.fill.equity))
+        self.assertEqual(fill.equity.list, memory.fill.equity.list)
+        self.assertEqual(fill.commission.sum(), sum(memory.fill.commission.list))
+        self.assertEqual(fill.position.date, memory.fill.position.date)
+        self.assertEqual(streaming.feed_list[0].bar.df['close'].tolist(),
+                         memory.feed_list[0].bar.df['close'].tolist())
+        self.assertEqual(streaming.sink.results['results'], memory.sink.results['results'])
+
+    def test_lookback(self):
+        with self.assertRaises(ValueError):
+            run(LongMovingAverage, self.directory, lookback=20)
+
+    def test_spill_view(self):
+        """写入磁盘后，策略之前取得的视图不变"""
+        column = Column(capacity=8)
+        column.set_spill(SpillFile(os.path.join(self.directory, 'close.bin'), 'float64'), 3, 8)
+        for value in range(1, 8):
+            column.append(value)
+        kept = column[-3:]
+        self.assertEqual(kept.tolist(), [5, 6, 7])
+        for value in range(8, 12):
+            column.append(value)
+        self.assertEqual(column.spilled, 5)
+        self.assertEqual(kept.tolist(), [5, 6, 7])
+        self.assertEqual(column.history().tolist(), list(range(1, 12)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# coding:utf-8
+import unittest
+import pandas as pd
+from quant.context import Context
+from quant.feedbase import CSV
+from quant.walkforward import WalkForward, make_windows, param_grid
+from helpers import DATA, MovingAverage
+
+
+class Weekly(MovingAverage):
+    """只在合成的周线上交易"""
+    timeframes = ['1W']
+
+
+def make_context(strategy=MovingAverage, rule=None):
+    context = Context()
+    context.feed_list = [CSV(DATA, 'IF')]
+    if rule:
+        context.feed_list[0].resample(rule)
+    context.strategy = [strategy]
+    return context
+
+
+class TestWalkForward(unittest.TestCase):
+    def test_windows(self):
+        windows = make_windows('2013-01-01', '2014-01-01', 6, 3)
+        self.assertEqual(windows, [
+            (pd.Timestamp('2013-01-01'), pd.Timestamp('2013-07-01'), pd.Timestamp('2013-10-01')),
+            (pd.Timestamp('2013-04-01'), pd.Timestamp('2013-10-01'), pd.Timestamp('2014-01-01'))])
+        anchored = make_windows('2013-01-01', '2014-01-01', 6, 3, anchored=True)
+        self.assertEqual(anchored[1][0], pd.Timestamp('2013-01-01'))
+        self.assertEqual(len(param_grid({'fast': [3, 5], 'slow': [10, 20, 30]})), 6)
+
+    def test_run(self):
+        context = make_context()
+        windows = make_windows('2013-01-04', '2014-01-04', 6, 3)
+        wf = WalkForward(context, {'fast': [3, 5], 'slow': [10]}, windows, processes=1).run()
+        self.assertEqual(len(wf.results), 2)
+        # 第二个窗口从第一个窗口的最终权益开始累加
+        first = wf.equity[:windows[1][1]]
+        self.assertAlmostEqual(first.iloc[-1] - context.initial_cash, wf.results['oos_profit'][0])
+        self.assertAlmostEqual(wf.equity.iloc[-1] - context.initial_cash, wf.results['oos_profit'].sum())
+
+    def test_processes(self):
+        """多进程遍历（工作进程启动时传入列数据）与在当前进程中执行的结果相同"""
+        windows = make_windows('2013-01-04', '2014-01-04', 6, 3)
+        grid = {'fast': [3, 5], 'slow': [10]}
+        serial = WalkForward(make_context(), grid, windows, processes=1).run()
+        parallel = WalkForward(make_context(), grid, windows, processes=2).run()
+        self.assertTrue(serial.results.equals(parallel.results))
+        self.assertTrue(serial.equity.equals(parallel.equity))
+
+    def test_timeframes(self):
+        """模板feed合成的大周期在每次回测中同样合成"""
+        windows = make_windows('2013-01-04', '2014-01-04', 6, 3)
+        wf = WalkForward(make_context(Weekly, '1W'), {'fast': [3], 'slow': [5]}, windows, processes=1).run()
+        self.assertNotEqual(wf.results['oos_profit'].abs().sum(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()